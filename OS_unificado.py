@@ -9,9 +9,12 @@ import time
 import os
 import pyautogui
 import pandas as pd
-import json
+import re
 import shutil # Para manipulação de arquivos/pastas
 
+import codec_json # JSON compacto (orjson quando instalado), o mesmo do app
+import snapshot_os # snapshot consolidado das OS que o app mapeia em memória
+
 # ========================= CONFIGURAÇÕES GLOBAIS =========================
 CHROMEDRIVER_PATH = "chromedriver.exe" # Certifique-se que o chromedriver.exe está no PATH ou especifique o caminho completo
 USUARIO_SISTEMA = "WILSONS"
@@ -40,6 +43,10 @@ PASTA_SAIDA_OS_PY = os.path.join(PASTA_SAIDA_BASE, "Saidas_OS_Py")
 PASTA_SAIDA_OS_PY_TXT_POR_GERENTE = r"C:\\Users\\wilsonsantana\\Documents\\os-manager\\mensagens_por_gerente"
 PASTA_SAIDA_OS_PY_JSON_CONVERTIDOS = r"C:\\Users\\wilsonsantana\\Documents\\os-manager\\static\\json"
 PASTA_SAIDA_OS_PY_JSON_POR_PRESTADOR = r"C:\\Users\\wilsonsantana\\Documents\\os-manager\\mensagens_por_prestador"
+# Situação de todas as OS no PIMS (abertas x fechadas), lida pela reconciliação do status_pimns no app
+ARQUIVO_STATUS_PIMS = r"C:\\Users\\wilsonsantana\\Documents\\os-manager\\os_status_pims.json"
+# Todas as OS num único arquivo msgpack; os workers do app aquecem os caches com uma leitura no boot
+ARQUIVO_SNAPSHOT_OS = r"C:\\Users\\wilsonsantana\\Documents\\os-manager\\os_snapshot.bin"
 
 # Coordenadas PyAutoGUI (ATENÇÃO: ESTA É A PARTE MAIS FRÁGIL DO SCRIPT)
 # Usando as coordenadas e tempos do OS.py, que parecem ser os mais completos/recentes.
@@ -255,8 +262,7 @@ def processar_para_extrair_aberta(df_original, pasta_saida):
 
 
         path = os.path.join(pasta_destino, nome_arquivo)
-        with open(path, "w", encoding="utf-8") as f:
-            json.dump(dados, f, ensure_ascii=False, indent=4)
+        codec_json.salvar(path, dados)
         print(f"📁 JSON (extrair_aberta) salvo: {path}")
 
     salvar_txt_lista(mauricio_os, "relatorio_mauricio_extrair_aberta.txt", pasta_saida)
@@ -363,8 +369,7 @@ def processar_para_os_py(df_original, pasta_base_saida_os_py):
             
             dados_json = processar_arquivo_txt_os_py(caminho_txt_completo)
             caminho_json_final = os.path.join(PASTA_SAIDA_OS_PY_JSON_CONVERTIDOS, nome_json_convertido)
-            with open(caminho_json_final, "w", encoding="utf-8") as fjson:
-                json.dump(dados_json, fjson, ensure_ascii=False, indent=2)
+            codec_json.salvar(caminho_json_final, dados_json)
     print("✅ Conversão dos .txt para .json (OS_py) concluída!")
 
     # Gerar JSON por prestador
@@ -385,11 +390,52 @@ def processar_para_os_py(df_original, pasta_base_saida_os_py):
         nome_prestador_sanitizado = str(prestador).upper().replace(" ", "_").replace("/", "_").replace("\\", "_")
         nome_arquivo_prestador = f"{nome_prestador_sanitizado}.json"
         caminho_json_prestador = os.path.join(PASTA_SAIDA_OS_PY_JSON_POR_PRESTADOR, nome_arquivo_prestador)
-        with open(caminho_json_prestador, "w", encoding="utf-8") as f:
-            json.dump(registros, f, indent=2, ensure_ascii=False)
+        codec_json.salvar(caminho_json_prestador, registros)
     print("✅ JSONs por prestador (OS_py) gerados com sucesso!")
     print("✅ Processamento (OS_py) concluído.")
 
+# ========================= SITUAÇÃO DAS OS NO PIMS (RECONCILIAÇÃO) =========================
+def _numero_os(valor):
+    """'119046.0' / 119046 -> '119046' (mesmo formato de Finalizacao.os_numero)."""
+    if pd.isnull(valor):
+        return ""
+    texto = str(valor).strip()
+    try:
+        return str(int(float(texto)))
+    except ValueError:
+        return texto
+
+def processar_status_pims(df_original, caminho_saida):
+    """Grava o conjunto de OS abertas e fechadas segundo o PIMS (coluna STATUS de toda a consulta)."""
+    print("\n--- Iniciando Processamento: Situação das OS no PIMS ---")
+    df = df_original[["NO_SERVICO", "STATUS"]].copy()
+    df["NO_SERVICO"] = df["NO_SERVICO"].map(_numero_os)
+    df["STATUS"] = df["STATUS"].astype(str).str.strip().str.upper()
+    df = df[(df["NO_SERVICO"] != "") & (~df["STATUS"].isin(["", "NAN", "NONE"]))]
+
+    abertas = set(df.loc[df["STATUS"] == "ABERTO", "NO_SERVICO"])
+    fechadas = set(df.loc[df["STATUS"] != "ABERTO", "NO_SERVICO"]) - abertas
+    dados = {
+        "gerado_em": datetime.now().isoformat(timespec="seconds"),
+        "indicador": CODIGO_INDICADOR_CONSULTA,
+        "periodo": [DATA_INICIO_CONSULTA, DATA_FIM_CONSULTA],
+        "os_abertas": sorted(abertas),
+        "os_fechadas": sorted(fechadas),
+    }
+    os.makedirs(os.path.dirname(caminho_saida), exist_ok=True)
+    codec_json.salvar(caminho_saida, dados)
+    print(f"✅ Situação PIMS salva: {len(abertas)} abertas, {len(fechadas)} fechadas -> {caminho_saida}")
+
+
+def gerar_snapshot_os(caminho_saida):
+    try:
+        quantidade = snapshot_os.gerar(caminho_saida, os.path.dirname(caminho_saida))
+    except ImportError:
+        print("⚠️ msgpack não instalado: snapshot das OS não gerado (o app lê os JSONs normalmente).")
+        return
+    print(f"✅ Snapshot das OS salvo: {quantidade} arquivos -> {caminho_saida}")
+
+
 # ========================= FUNÇÃO PRINCIPAL =========================
 def main():
     print("🚀 Iniciando Processo Unificado de Extração e Relatórios 🚀")
@@ -420,6 +466,12 @@ def main():
             # --- Executar lógica baseada em OS.py ---
             processar_para_os_py(df_principal, PASTA_SAIDA_OS_PY) # Passa a pasta base de OS_py
 
+            # --- Situação (aberta/fechada) de todas as OS para a reconciliação do PIMNS ---
+            processar_status_pims(df_principal, ARQUIVO_STATUS_PIMS)
+
+            # --- Snapshot das OS para o boot dos workers (depois de todos os JSONs) ---
+            gerar_snapshot_os(ARQUIVO_SNAPSHOT_OS)
+
             print("\n🎉🎉 Processo Unificado Finalizado com Sucesso! 🎉🎉")
         else:
             print("❌ Falha ao baixar ou encontrar o relatório Excel. Processamento subsequente cancelado.")
@@ -0,0 +1,155 @@
+import logging
+import threading
+
+from instrumentacao import medir
+
+# numpy/pandas são importados na primeira análise: o import custa ~250 ms e não entra no boot do app
+np = pd = None
+
+logger = logging.getLogger(__name__)
+
+# Faixas de aging das OS abertas, em dias desde a abertura (limites inclusivos à direita)
+LIMITES_AGING = (7, 30, 90)
+FAIXAS_AGING = ('0–7', '8–30', '31–90', '90+')
+# Quebras do backlog: (coluna, título na página)
+DIMENSOES = (('gerente', 'Gerente'), ('prestador', 'Prestador'), ('modelo', 'Modelo'), ('frota', 'Frota'))
+SEM_PRESTADOR = 'Sem prestador'
+
+
+def _importar():
+    global np, pd
+    if pd is None:
+        import numpy
+        import pandas
+        np, pd = numpy, pandas
+
+
+def disponivel():
+    """Sem pandas/numpy a página de análise fica indisponível; o resto do app segue."""
+    try:
+        _importar()
+    except ImportError:
+        return False
+    return True
+
+
+def quadro_abertas(registros, hoje, prestadores_nao_definidos=()):
+    """DataFrame das OS abertas a partir de (gerente, RegistroOS); OS repetida em mais de um arquivo conta uma vez."""
+    _importar()
+    colunas = {'os': [], 'gerente': [], 'prestador': [], 'modelo': [], 'frota': [], 'data_abertura': []}
+    for gerente, registro in registros:
+        colunas['os'].append(registro.os)
+        colunas['gerente'].append(gerente)
+        colunas['prestador'].append(registro.prestador)
+        colunas['modelo'].append(registro.modelo)
+        colunas['frota'].append(registro.frota)
+        colunas['data_abertura'].append(registro.data_abertura)
+    # dtype explícito: sem OS abertas o pandas criaria colunas float e o .str falharia
+    df = pd.DataFrame({nome: pd.Series(valores, dtype=object) for nome, valores in colunas.items()}).drop_duplicates('os')
+    prestador = df['prestador'].str.strip()
+    df['prestador'] = prestador.mask(prestador.str.lower().isin(prestadores_nao_definidos), SEM_PRESTADOR)
+    df['frota'] = df['frota'].str.strip().replace('', '—')
+    abertura = pd.to_datetime(df['data_abertura'], errors='coerce')
+    df['dias'] = (pd.Timestamp(hoje) - abertura).dt.days
+    return df
+
+
+def quadro_fechadas(linhas):
+    """DataFrame das finalizações a partir de (responsável, data_fin 'DD/MM/AAAA', data_abertura)."""
+    _importar()
+    df = pd.DataFrame(list(linhas), columns=['responsavel', 'data_fin', 'data_abertura'])
+    fim = pd.to_datetime(df['data_fin'], format='%d/%m/%Y', errors='coerce')
+    abertura = pd.to_datetime(df['data_abertura'], errors='coerce')
+    df['dias'] = (fim - abertura).dt.days
+    return df
+
+
+def aging_por(df, dimensao, limite=None):
+    """Linhas {'nome', 'faixas', 'total', 'media_dias'} por valor da dimensão, maiores backlogs primeiro."""
+    com_data = df[df['dias'].notna()]
+    faixa = pd.cut(com_data['dias'], bins=[-np.inf, *LIMITES_AGING, np.inf], labels=FAIXAS_AGING)
+    tabela = pd.crosstab(com_data[dimensao], faixa).reindex(columns=list(FAIXAS_AGING), fill_value=0)
+    tabela['total'] = tabela.sum(axis=1)
+    tabela['media_dias'] = com_data.groupby(dimensao)['dias'].mean()
+    tabela = tabela.sort_values(['total', 'media_dias'], ascending=False)
+    if limite:
+        tabela = tabela.head(limite)
+    return [{'nome': nome,
+             'faixas': [int(v) for v in linha[list(FAIXAS_AGING)]],
+             'total': int(linha['total']),
+             'media_dias': round(float(linha['media_dias']), 1)}
+            for nome, linha in tabela.iterrows()]
+
+
+def tempo_fechamento(df):
+    """Média/mediana de dias entre abertura e finalização, no geral e por responsável."""
+    validas = df[df['dias'].notna() & (df['dias'] >= 0)]
+    geral = {
+        'quantidade': int(len(validas)),
+        'sem_abertura': int(len(df) - len(validas)),
+        'media_dias': round(float(validas['dias'].mean()), 1) if len(validas) else None,
+        'mediana_dias': round(float(validas['dias'].median()), 1) if len(validas) else None,
+    }
+    agregado = (validas.groupby('responsavel')['dias']
+                .agg(['count', 'mean', 'median'])
+                .sort_values('count', ascending=False))
+    por_responsavel = [{'nome': nome, 'quantidade': int(linha['count']),
+                        'media_dias': round(float(linha['mean']), 1), 'mediana_dias': round(float(linha['median']), 1)}
+                       for nome, linha in agregado.iterrows()]
+    return geral, por_responsavel
+
+
+class AnaliseOS:
+    """Aging do backlog e tempo até o fechamento, calculados em colunas (pandas) e guardados até os dados mudarem.
+
+    `carregar_abertas()` devolve (hoje, [(gerente, RegistroOS)]) e `carregar_fechadas()` as linhas de
+    `quadro_fechadas`; só são chamados quando a assinatura correspondente muda (JSONs ou banco).
+    """
+
+    def __init__(self, carregar_abertas, carregar_fechadas, prestadores_nao_definidos=(), limite_por_dimensao=25):
+        self.carregar_abertas = carregar_abertas
+        self.carregar_fechadas = carregar_fechadas
+        self.prestadores_nao_definidos = tuple(prestadores_nao_definidos)
+        self.limite_por_dimensao = limite_por_dimensao
+        self._lock = threading.Lock()
+        self._abertas = self._fechadas = None
+        self._assinatura_abertas = self._assinatura_fechadas = None
+        self._resumo = None
+
+    def resumo(self, assinatura_abertas, assinatura_fechadas):
+        with self._lock:
+            mudou = False
+            if self._abertas is None or assinatura_abertas != self._assinatura_abertas:
+                with medir('analise_os_abertas'):
+                    hoje, registros = self.carregar_abertas()
+                    self._abertas = quadro_abertas(registros, hoje, self.prestadores_nao_definidos)
+                self._assinatura_abertas, mudou = assinatura_abertas, True
+            if self._fechadas is None or assinatura_fechadas != self._assinatura_fechadas:
+                with medir('analise_os_fechadas'):
+                    self._fechadas = quadro_fechadas(self.carregar_fechadas())
+                self._assinatura_fechadas, mudou = assinatura_fechadas, True
+            if mudou or self._resumo is None:
+                with medir('analise_os_resumo'):
+                    self._resumo = self._calcular()
+            return self._resumo
+
+    def _calcular(self):
+        abertas = self._abertas
+        dias = abertas['dias'].dropna()
+        geral_fechamento, fechamento_por_responsavel = tempo_fechamento(self._fechadas)
+        return {
+            'faixas': FAIXAS_AGING,
+            'total_abertas': int(len(abertas)),
+            'abertas_sem_data': int(abertas['dias'].isna().sum()),
+            'media_dias_abertas': round(float(dias.mean()), 1) if len(dias) else None,
+            'mediana_dias_abertas': round(float(dias.median()), 1) if len(dias) else None,
+            'aging_geral': [int(v) for v in pd.cut(dias, bins=[-np.inf, *LIMITES_AGING, np.inf], labels=FAIXAS_AGING)
+                            .value_counts().reindex(list(FAIXAS_AGING), fill_value=0)],
+            'aging': [(coluna, titulo, aging_por(abertas, coluna, self.limite_por_dimensao)) for coluna, titulo in DIMENSOES],
+            'fechamento': geral_fechamento,
+            'fechamento_por_responsavel': fechamento_por_responsavel,
+        }
+
+    def limpar(self):
+        with self._lock:
+            self._abertas = self._fechadas = self._resumo = None
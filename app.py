@@ -1,41 +1,62 @@
 import os
 import json
+import hashlib
 import logging
 import re
-from datetime import datetime, timedelta
+from datetime import date, datetime, timedelta
+from decimal import Decimal, InvalidOperation
 import pytz
 import random
-from flask import Flask, render_template, request, redirect, session, url_for, flash, send_file
+import threading
+import time
+import click
+from flask import Flask, render_template, request, redirect, session, url_for, flash, send_file, jsonify, stream_with_context
 from flask_sqlalchemy import SQLAlchemy
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import A4, landscape
-from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle, Spacer
-from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
-from reportlab.lib import colors
-from reportlab.lib.units import cm
 from collections import Counter
+from dataclasses import replace
+from types import SimpleNamespace
 from sqlalchemy.sql import text
-from dateutil.parser import parse
+from werkzeug.exceptions import RequestEntityTooLarge
 from werkzeug.utils import secure_filename
-from PIL import Image
-
-# Configuração de logging para depuração
-logging.basicConfig(level=logging.DEBUG)
+# reportlab, PIL e dateutil são importados dentro das rotas que os usam (boot mais leve dos workers)
+from analise_os import AnaliseOS, disponivel as analise_os_disponivel
+from banco import normalizar_database_url, opcoes_engine, registrar_pragmas_sqlite
+from blobs import ArmazemBlobs, eh_chave_blob
+import codec_json
+from carga_prestadores import CargaPrestadores
+from busca import IndiceOS, documento_gerente, documento_manutencao, documento_prestador, tokenizar
+from evidencias import STATUS_ERRO, STATUS_PROCESSANDO, STATUS_PRONTA, FilaEvidencias
+from exportacao import MIMETYPES as MIMETYPES_EXPORTACAO, gerar_exportacao, neutralizar_formula
+from instrumentacao import cronometrar, instrumentar_app, medir
+from metricas import os_abertas, os_finalizadas_total, registrar_metricas_app
+from registros_os import CacheRegistrosOS
+from snapshot_os import SnapshotOS, gerar as gerar_snapshot_os
+
+# Configuração de logging (nível ajustável por LOG_LEVEL, padrão DEBUG)
+logging.basicConfig(level=os.environ.get('LOG_LEVEL', 'DEBUG').upper())
 logger = logging.getLogger(__name__)
 
 # --- Configuração do app e banco ---
 app = Flask(__name__)
 app.secret_key = os.environ.get('SECRET_KEY', os.urandom(24).hex())
 app.config.update(
-    SESSION_COOKIE_SECURE=True,
+    # Desligável apenas para testes locais em HTTP (ex.: teste de carga)
+    SESSION_COOKIE_SECURE=os.environ.get('SESSION_COOKIE_SECURE', '1') != '0',
     SESSION_COOKIE_SAMESITE='Lax',
-    SQLALCHEMY_DATABASE_URI=os.environ.get(
+    SQLALCHEMY_DATABASE_URI=normalizar_database_url(os.environ.get(
         'DATABASE_URL',
         f"sqlite:///{os.path.join(os.path.dirname(__file__),'app.db')}"
-    ),
-    SQLALCHEMY_TRACK_MODIFICATIONS=False
+    )),
+    SQLALCHEMY_TRACK_MODIFICATIONS=False,
+    # Limite do corpo da requisição (uploads de evidência/fotos); acima disso o Werkzeug responde 413
+    MAX_CONTENT_LENGTH=int(os.environ.get('MAX_UPLOAD_MB', '25')) * 1024 * 1024,
 )
+# Pool/pre-ping no Postgres e WAL/busy_timeout no SQLite (ver banco.py para as variáveis de ambiente)
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = opcoes_engine(app.config['SQLALCHEMY_DATABASE_URI'])
+registrar_pragmas_sqlite()
 db = SQLAlchemy(app)
+instrumentar_app(app)
+registrar_metricas_app(app, db)
 class FrotaLeve(db.Model):
     __tablename__ = 'frota_leve'
     id = db.Column(db.Integer, primary_key=True)
@@ -47,8 +68,8 @@ class FrotaLeve(db.Model):
     situacao = db.Column(db.String(20))
     entrada = db.Column(db.String(20))
     saida = db.Column(db.String(20))
-    valor_mo = db.Column(db.String(20))
-    valor_pecas = db.Column(db.String(20))
+    valor_mo = db.Column(db.Numeric(12, 2))
+    valor_pecas = db.Column(db.Numeric(12, 2))
     aprovado_por = db.Column(db.String(50))
     cotacao1 = db.Column(db.Text)
     cotacao2 = db.Column(db.Text)
@@ -63,6 +84,18 @@ UPLOAD_FOLDER = os.path.join('static', 'uploads')
 os.makedirs(UPLOAD_FOLDER, exist_ok=True)
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif'}
+EVIDENCIAS_DIR = os.path.join(UPLOAD_FOLDER, 'evidencias')
+# Fotos de perfil e evidências ficam num armazém endereçado pelo sha256 do conteúdo (ver blobs.py)
+BLOBS_DIR = os.environ.get('BLOBS_DIR', os.path.join(UPLOAD_FOLDER, 'blobs'))
+BLOBS_MAX_AGE = 365 * 24 * 3600
+armazem_blobs = ArmazemBlobs(BLOBS_DIR)
+# Evidências são recodificadas (sem EXIF, tamanho limitado, miniatura) fora da requisição
+fila_evidencias = FilaEvidencias()
+
+@app.errorhandler(RequestEntityTooLarge)
+def arquivo_muito_grande(e):
+    flash(f"Arquivo muito grande (limite de {app.config['MAX_CONTENT_LENGTH'] // (1024 * 1024)} MB).", 'danger')
+    return redirect(request.referrer or url_for('login'))
 
 # --- Fuso horário de São Paulo ---
 saopaulo_tz = pytz.timezone('America/Sao_Paulo')
@@ -76,11 +109,55 @@ def capitalize_name(name):
     return " ".join(capitalized_parts)
 app.jinja_env.filters["capitalize_name"] = capitalize_name
 
+# --- Valores em reais (colunas Numeric da Frota Leve) ---
+def parse_valor_brl(valor):
+    """Converte 'R$ 1.234,56', '1234,56', '1234.56' ou número em Decimal; None se vazio/inválido."""
+    if valor is None:
+        return None
+    if isinstance(valor, (int, float, Decimal)):
+        return Decimal(str(valor)).quantize(Decimal('0.01'))
+    texto = re.sub(r'[^\d,.\-]', '', str(valor))
+    if not texto:
+        return None
+    if ',' in texto and '.' in texto:
+        # O último separador é o decimal
+        if texto.rfind(',') > texto.rfind('.'):
+            texto = texto.replace('.', '').replace(',', '.')
+        else:
+            texto = texto.replace(',', '')
+    elif ',' in texto:
+        texto = texto.replace('.', '').replace(',', '.')
+    elif re.fullmatch(r'-?\d{1,3}(\.\d{3})+', texto):
+        texto = texto.replace('.', '')  # '1.234' = mil duzentos e trinta e quatro
+    try:
+        return Decimal(texto).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        logger.warning(f"parse_valor_brl: valor '{valor}' não reconhecido.")
+        return None
+
+def moeda_brl(valor):
+    if valor is None or valor == '':
+        return ''
+    return 'R$ ' + f"{Decimal(valor):,.2f}".replace(',', '_').replace('.', ',').replace('_', '.')
+app.jinja_env.filters["moeda_brl"] = moeda_brl
+
+def url_arquivo(valor, pasta_legado=''):
+    """URL de um upload: chave do armazém de blobs ou caminho antigo dentro de static/ (`pasta_legado`)."""
+    if not valor:
+        return None
+    if eh_chave_blob(valor):
+        return url_for('servir_blob', chave=valor)
+    return url_for('static', filename=f"{pasta_legado}/{valor}" if pasta_legado else valor)
+
+app.jinja_env.filters["url_arquivo"] = url_arquivo
+
 # --- Helper para formatar datas no horário de São Paulo (AJUSTADO) ---
 def format_datetime(dt_input):
     if not dt_input:
         return None
     
+    from dateutil.parser import parse
+
     dt_obj = None
     if isinstance(dt_input, datetime):
         dt_obj = dt_input
@@ -164,6 +241,18 @@ class Finalizacao(db.Model):
     observacoes = db.Column(db.Text)
     registrado_em = db.Column(db.DateTime, default=lambda: saopaulo_tz.localize(datetime.now()))
     status_pimns = db.Column(db.Boolean, default=False, nullable=False)
+    # Evidência (em static/uploads/evidencias): original enquanto 'processando', depois a versão recodificada
+    evidencia = db.Column(db.String(256))
+    evidencia_miniatura = db.Column(db.String(256))
+    evidencia_status = db.Column(db.String(20))
+    # Data de abertura da OS (do JSON) no momento da finalização: base do tempo até o fechamento
+    data_abertura = db.Column(db.Date)
+
+    __table_args__ = (
+        # Visão "ainda não lançadas no PIMNS" (status_pimns = false, mais recentes primeiro)
+        db.Index('ix_finalizacoes_status_pimns_registrado', 'status_pimns', 'registrado_em'),
+        db.Index('ix_finalizacoes_os_numero', 'os_numero'),
+    )
 
 class LoginEvent(db.Model):
     __tablename__ = 'login_events'
@@ -183,14 +272,38 @@ class OSPendente(db.Model):
     status_definido_por = db.Column(db.String(80), nullable=False)
     status_data = db.Column(db.String(20), nullable=False)
 
+class SyncEstado(db.Model):
+    """Estado das sincronizações arquivo -> banco (ex.: hash do users.json já aplicado)."""
+    __tablename__ = 'sync_estado'
+    chave = db.Column(db.String(80), primary_key=True)
+    valor = db.Column(db.String(128), nullable=False)
+    atualizado_em = db.Column(db.DateTime(timezone=True), default=lambda: saopaulo_tz.localize(datetime.now()))
+
+class EventoOS(db.Model):
+    """Mudanças nas OS (finalizada, atribuída, pendente, nova/removida pelo ETL) entregues aos painéis por /eventos.
+
+    A tabela é o barramento entre os workers: cada consulta a /eventos lê os eventos com id maior que o último recebido.
+    """
+    __tablename__ = 'eventos_os'
+    id = db.Column(db.Integer, primary_key=True)
+    tipo = db.Column(db.String(30), nullable=False)
+    os_numero = db.Column(db.String(50))
+    destino = db.Column(db.String(80))  # usuário ou '@perfil' que deve receber; None = todos
+    dados = db.Column(db.Text)
+    criado_em = db.Column(db.DateTime(timezone=True), default=lambda: saopaulo_tz.localize(datetime.now()))
+
 # --- Constantes de caminho e inicialização do JSON ---
 BASE_DIR = os.path.dirname(__file__)
-MENSAGENS_DIR = os.path.join(BASE_DIR, 'mensagens_por_gerente')
-MENSAGENS_PRESTADOR_DIR = os.path.join(BASE_DIR, 'mensagens_por_prestador')
-JSON_DIR = os.path.join(BASE_DIR, 'static', 'json')
-USERS_FILE = os.path.join(BASE_DIR, 'users.json')
-PRESTADORES_FILE = os.path.join(BASE_DIR, 'prestadores.json')
-MANUTENCAO_FILE = os.path.join(BASE_DIR, 'manutencao.json')
+# Diretório dos dados (JSONs de OS e usuários); pode ser trocado por OS_MANAGER_DATA_DIR (ex.: benchmarks)
+DATA_DIR = os.environ.get('OS_MANAGER_DATA_DIR', BASE_DIR)
+MENSAGENS_DIR = os.path.join(DATA_DIR, 'mensagens_por_gerente')
+MENSAGENS_PRESTADOR_DIR = os.path.join(DATA_DIR, 'mensagens_por_prestador')
+JSON_DIR = os.path.join(DATA_DIR, 'static', 'json')
+USERS_FILE = os.path.join(DATA_DIR, 'users.json')
+PRESTADORES_FILE = os.path.join(DATA_DIR, 'prestadores.json')
+MANUTENCAO_FILE = os.path.join(DATA_DIR, 'manutencao.json')
+PIMS_STATUS_FILE = os.path.join(DATA_DIR, 'os_status_pims.json')  # gerado pelo OS_unificado.py
+SNAPSHOT_OS_FILE = os.path.join(DATA_DIR, 'os_snapshot.bin')  # idem; todas as OS num arquivo só (ver snapshot_os.py)
 os.makedirs(MENSAGENS_DIR, exist_ok=True)
 os.makedirs(MENSAGENS_PRESTADOR_DIR, exist_ok=True)
 os.makedirs(JSON_DIR, exist_ok=True)
@@ -198,24 +311,71 @@ os.makedirs(JSON_DIR, exist_ok=True)
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
+def ler_json(caminho):
+    with medir('json_load'):
+        return codec_json.carregar(caminho)
+
+def salvar_json(caminho, dados):
+    """Grava o JSON (compacto, ver codec_json) de forma atômica: quem lê nunca vê o arquivo pela metade."""
+    with medir('json_dump'):
+        codec_json.salvar(caminho, dados)
+
+# Serializa o ler-alterar-gravar dos JSONs de OS entre as threads do processo
+_lock_json_os = threading.Lock()
+
+# Snapshot consolidado do ETL: a lista de um usuário sai de uma fatia do arquivo mapeado
+snapshot_os = SnapshotOS(SNAPSHOT_OS_FILE, DATA_DIR)
+
+def ler_json_os(caminho):
+    """JSON de OS: do snapshot enquanto o arquivo for o mesmo do ETL, senão do próprio arquivo."""
+    dados = snapshot_os.dados(caminho)
+    return dados if dados is not None else ler_json(caminho)
+
+def listar_json_os(diretorio):
+    """Nomes dos JSONs de OS do diretório (pela tabela do snapshot quando possível)."""
+    nomes = snapshot_os.listar(diretorio)
+    if nomes is None:
+        nomes = [nome for nome in os.listdir(diretorio) if nome.lower().endswith('.json')]
+    return nomes
+
+# OS abertas normalizadas por arquivo (refeitas quando o JSON muda ou vira o dia)
+cache_registros_os = CacheRegistrosOS(ler_json_os)
+
 # ----------- PATCH: Função para remover OS em todos os JSONs -----------
-def remover_os_de_todos_json(diretorio, os_numero):
-    removido_de = []
-    for arquivo in os.listdir(diretorio):
-        if arquivo.lower().endswith('.json'):
+def remover_varias_os_de_todos_json(diretorio, numeros_os, arquivos=None):
+    """Remove as OS `numeros_os` de todos os JSONs de `diretorio`, regravando cada arquivo no máximo uma vez.
+
+    `arquivos` restringe a busca aos arquivos informados (quando a origem das OS já é conhecida).
+    Retorna {arquivo: [OS removidas]}.
+    """
+    numeros_os = {str(n) for n in numeros_os}
+    removidas_por_arquivo = {}
+    if not numeros_os:
+        return removidas_por_arquivo
+    with _lock_json_os:
+        for arquivo in (sorted(arquivos) if arquivos is not None else os.listdir(diretorio)):
+            if not arquivo.lower().endswith('.json'):
+                continue
             caminho = os.path.join(diretorio, arquivo)
             try:
-                with open(caminho, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                original_len = len(data)
-                data = [item for item in data if str(item.get('os') or item.get('OS', '')) != os_numero]
-                if len(data) < original_len:
-                    with open(caminho, 'w', encoding='utf-8') as f:
-                        json.dump(data, f, ensure_ascii=False, indent=2)
-                    removido_de.append(arquivo)
-                    logger.info(f"OS {os_numero} removida do arquivo: {caminho}")
+                data = ler_json(caminho)
+                restantes, removidas = [], []
+                for item in data:
+                    numero = str(item.get('os') or item.get('OS', ''))
+                    if numero in numeros_os:
+                        removidas.append(numero)
+                    else:
+                        restantes.append(item)
+                if removidas:
+                    salvar_json(caminho, restantes)
+                    removidas_por_arquivo[arquivo] = removidas
+                    logger.info(f"OS {', '.join(removidas)} removida(s) do arquivo: {caminho}")
             except Exception as e:
                 logger.error(f"Erro ao atualizar {caminho}: {e}")
+    return removidas_por_arquivo
+
+def remover_os_de_todos_json(diretorio, os_numero):
+    removido_de = list(remover_varias_os_de_todos_json(diretorio, [os_numero]))
     if not removido_de:
         logger.warning(f"OS {os_numero} não encontrada em nenhum arquivo JSON de {diretorio}")
     else:
@@ -266,38 +426,29 @@ def init_db():
             else:
                 logger.warning("Tabela 'users' não encontrada para migração.")
 
-            # Sincronização de usuários do JSON para o Banco de Dados
-            logger.info("Iniciando sincronização de usuários do users.json.")
-            if os.path.exists(USERS_FILE):
-                with open(USERS_FILE, encoding='utf-8') as f:
-                    js_users = json.load(f)
-
-                db_users_query = User.query.all()
-                db_users = {user.username: user for user in db_users_query}
-                admins = {'wilson.santana'}
-
-                for u_name, u_data in js_users.items():
-                    username_lower = u_name.lower()
-                    senha_val = u_data.get("senha", "") if isinstance(u_data, dict) else u_data
-                    pic_val = u_data.get("profile_picture") if isinstance(u_data, dict) else None
-                    is_admin_val = username_lower in admins
-
-                    if username_lower in db_users:
-                        user_in_db = db_users[username_lower]
-                        if user_in_db.password != senha_val or user_in_db.is_admin != is_admin_val or user_in_db.profile_picture != pic_val:
-                            user_in_db.password = senha_val
-                            user_in_db.is_admin = is_admin_val
-                            user_in_db.profile_picture = pic_val
-                            logger.info(f"Usuário '{username_lower}' atualizado.")
-                    else:
-                        new_user = User(username=username_lower, password=senha_val, is_admin=is_admin_val, profile_picture=pic_val)
-                        db.session.add(new_user)
-                        logger.info(f"Novo usuário '{username_lower}' adicionado.")
-
-                db.session.commit()
-                logger.info("Sincronização de usuários concluída com sucesso.")
-            else:
-                logger.warning(f"Arquivo {USERS_FILE} não encontrado. Pulando sincronização de usuários.")
+            # Índices e colunas de evidência de 'finalizacoes' (create_all não altera tabelas já existentes)
+            if 'finalizacoes' in inspector.get_table_names():
+                colunas_finalizacoes = [col['name'] for col in inspector.get_columns('finalizacoes')]
+                for coluna, tipo in (('evidencia', 'VARCHAR(256)'), ('evidencia_miniatura', 'VARCHAR(256)'), ('evidencia_status', 'VARCHAR(20)'),
+                                     ('data_abertura', 'DATE')):
+                    if coluna not in colunas_finalizacoes:
+                        logger.info(f"Adicionando coluna '{coluna}' à tabela 'finalizacoes'.")
+                        db.session.execute(text(f'ALTER TABLE finalizacoes ADD COLUMN {coluna} {tipo}'))
+                        db.session.commit()
+                for indice in Finalizacao.__table__.indexes:
+                    indice.create(bind=db.engine, checkfirst=True)
+
+            # Migração de valor_mo/valor_pecas (texto em reais) para NUMERIC em 'frota_leve'
+            if 'frota_leve' in inspector.get_table_names():
+                tipos_frota_leve = {col['name']: col['type'] for col in inspector.get_columns('frota_leve')}
+                if any(not isinstance(tipos_frota_leve.get(c), db.Numeric) for c in ('valor_mo', 'valor_pecas')):
+                    migrar_valores_frota_leve()
+
+            # Índices de busca da Frota Leve (FTS5 no SQLite, tsvector + GIN no Postgres)
+            criar_busca_frota_leve()
+
+            # Sincronização de usuários do JSON para o Banco de Dados (pulada se o users.json não mudou)
+            sincronizar_usuarios()
 
             logger.info("Função init_db concluída com sucesso.")
 
@@ -307,14 +458,268 @@ def init_db():
         # para impedir que a aplicação inicie em um estado inconsistente.
         raise
 
+def migrar_valores_frota_leve():
+    """Troca valor_mo/valor_pecas de VARCHAR para NUMERIC(12,2), convertendo os textos em reais."""
+    if db.engine.dialect.name == 'sqlite':
+        import sqlite3
+        if sqlite3.sqlite_version_info < (3, 35, 0):
+            raise RuntimeError(
+                f"A migração de valor_mo/valor_pecas para NUMERIC usa ALTER TABLE DROP/RENAME COLUMN, que exige "
+                f"SQLite 3.35 ou mais novo (este Python usa {sqlite3.sqlite_version}). Atualize o SQLite ou migre o banco "
+                f"num ambiente com SQLite >= 3.35.")
+    logger.info("Migrando valor_mo/valor_pecas de 'frota_leve' para NUMERIC.")
+    linhas = db.session.execute(text('SELECT id, valor_mo, valor_pecas FROM frota_leve')).fetchall()
+    try:
+        for coluna in ('valor_mo', 'valor_pecas'):
+            db.session.execute(text(f'ALTER TABLE frota_leve ADD COLUMN {coluna}_num NUMERIC(12, 2)'))
+        convertidos = [
+            {'id': linha.id, 'mo': parse_valor_brl(linha.valor_mo), 'pecas': parse_valor_brl(linha.valor_pecas)}
+            for linha in linhas
+        ]
+        if convertidos:
+            atualizar_valores = text('UPDATE frota_leve SET valor_mo_num = :mo, valor_pecas_num = :pecas WHERE id = :id').bindparams(
+                db.bindparam('mo', type_=db.Numeric(12, 2)), db.bindparam('pecas', type_=db.Numeric(12, 2)))
+            db.session.execute(atualizar_valores, convertidos)
+        for coluna in ('valor_mo', 'valor_pecas'):
+            db.session.execute(text(f'ALTER TABLE frota_leve DROP COLUMN {coluna}'))
+            db.session.execute(text(f'ALTER TABLE frota_leve RENAME COLUMN {coluna}_num TO {coluna}'))
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    nao_convertidos = sum(1 for linha, c in zip(linhas, convertidos)
+                          if (linha.valor_mo and c['mo'] is None) or (linha.valor_pecas and c['pecas'] is None))
+    logger.info(f"Migração de valores concluída: {len(linhas)} linhas, {nao_convertidos} com valor não reconhecido.")
+
+# --- Busca textual da Frota Leve ---
+CAMPOS_BUSCA_FROTA_LEVE = ('placa', 'veiculo', 'motorista', 'oficina', 'servico')
+CONFIG_FTS_POSTGRES = 'portuguese_unaccent'  # 'portuguese' + unaccent
+_busca_frota_leve_disponivel = None  # detectado uma vez por processo
+
+def criar_busca_frota_leve():
+    """Cria (idempotente) o índice full-text e o índice de prefixo de placa da frota_leve."""
+    global _busca_frota_leve_disponivel
+    dialeto = db.engine.dialect.name
+    campos = ', '.join(CAMPOS_BUSCA_FROTA_LEVE)
+    if dialeto == 'sqlite':
+        existia = db.session.execute(text(
+            "SELECT 1 FROM sqlite_master WHERE type='table' AND name='frota_leve_fts'")).first()
+        novos = ', '.join(f'new.{c}' for c in CAMPOS_BUSCA_FROTA_LEVE)
+        antigos = ', '.join(f'old.{c}' for c in CAMPOS_BUSCA_FROTA_LEVE)
+        comandos = [
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS frota_leve_fts USING fts5({campos}, content='frota_leve', "
+            "content_rowid='id', tokenize='unicode61 remove_diacritics 2')",
+            f"CREATE TRIGGER IF NOT EXISTS frota_leve_fts_ai AFTER INSERT ON frota_leve BEGIN "
+            f"INSERT INTO frota_leve_fts(rowid, {campos}) VALUES (new.id, {novos}); END",
+            f"CREATE TRIGGER IF NOT EXISTS frota_leve_fts_ad AFTER DELETE ON frota_leve BEGIN "
+            f"INSERT INTO frota_leve_fts(frota_leve_fts, rowid, {campos}) VALUES ('delete', old.id, {antigos}); END",
+            f"CREATE TRIGGER IF NOT EXISTS frota_leve_fts_au AFTER UPDATE ON frota_leve BEGIN "
+            f"INSERT INTO frota_leve_fts(frota_leve_fts, rowid, {campos}) VALUES ('delete', old.id, {antigos}); "
+            f"INSERT INTO frota_leve_fts(rowid, {campos}) VALUES (new.id, {novos}); END",
+            # LIKE 'ABC%' só usa índice no SQLite com collation NOCASE
+            "CREATE INDEX IF NOT EXISTS ix_frota_leve_placa ON frota_leve (placa COLLATE NOCASE)",
+        ]
+        if not existia:
+            comandos.append("INSERT INTO frota_leve_fts(frota_leve_fts) VALUES ('rebuild')")
+    elif dialeto == 'postgresql':
+        documento = " || ' ' || ".join(f"coalesce({c}, '')" for c in CAMPOS_BUSCA_FROTA_LEVE)
+        # Os termos da busca chegam sem acento: o documento também precisa ser indexado sem acento.
+        # unaccent() não é IMMUTABLE e não entra na coluna gerada; vai como dicionário da configuração.
+        comandos = [
+            "CREATE EXTENSION IF NOT EXISTS unaccent",
+            f"DO $$ BEGIN IF NOT EXISTS (SELECT 1 FROM pg_ts_config WHERE cfgname = '{CONFIG_FTS_POSTGRES}') THEN "
+            f"CREATE TEXT SEARCH CONFIGURATION {CONFIG_FTS_POSTGRES} (COPY = portuguese); "
+            f"ALTER TEXT SEARCH CONFIGURATION {CONFIG_FTS_POSTGRES} "
+            f"ALTER MAPPING FOR hword, hword_part, word WITH unaccent, portuguese_stem; END IF; END $$",
+            # coluna criada antes com a configuração 'portuguese' (com acento): recria
+            f"DO $$ BEGIN IF EXISTS (SELECT 1 FROM information_schema.columns WHERE table_name = 'frota_leve' "
+            f"AND column_name = 'busca' AND generation_expression NOT LIKE '%{CONFIG_FTS_POSTGRES}%') THEN "
+            f"ALTER TABLE frota_leve DROP COLUMN busca; END IF; END $$",
+            f"ALTER TABLE frota_leve ADD COLUMN IF NOT EXISTS busca tsvector "
+            f"GENERATED ALWAYS AS (to_tsvector('{CONFIG_FTS_POSTGRES}', {documento})) STORED",
+            "CREATE INDEX IF NOT EXISTS ix_frota_leve_busca ON frota_leve USING GIN (busca)",
+            "CREATE INDEX IF NOT EXISTS ix_frota_leve_placa ON frota_leve (upper(placa) text_pattern_ops)",
+        ]
+    else:
+        logger.info(f"Busca full-text da frota leve não suportada em '{dialeto}'; usando ILIKE.")
+        _busca_frota_leve_disponivel = False
+        return
+    try:
+        for comando in comandos:
+            db.session.execute(text(comando))
+        db.session.commit()
+        _busca_frota_leve_disponivel = True
+        logger.info("Índices de busca da frota leve verificados.")
+    except Exception as e:
+        db.session.rollback()
+        _busca_frota_leve_disponivel = False
+        logger.error(f"Não foi possível criar a busca full-text da frota leve (usando ILIKE): {e}")
+
+def busca_frota_leve_disponivel():
+    global _busca_frota_leve_disponivel
+    if _busca_frota_leve_disponivel is None:
+        dialeto = db.engine.dialect.name
+        if dialeto == 'sqlite':
+            consulta = "SELECT 1 FROM sqlite_master WHERE type='table' AND name='frota_leve_fts'"
+        elif dialeto == 'postgresql':
+            consulta = ("SELECT 1 FROM information_schema.columns "
+                        "WHERE table_name='frota_leve' AND column_name='busca'")
+        else:
+            consulta = None
+        _busca_frota_leve_disponivel = bool(consulta and db.session.execute(text(consulta)).first())
+    return _busca_frota_leve_disponivel
+
+def filtrar_busca_frota_leve(query, termo):
+    """Filtra por prefixo de placa OU pelo índice full-text (todos os termos, por prefixo, sem acento)."""
+    tokens = tokenizar(termo)
+    if not tokens:
+        return query
+    if not busca_frota_leve_disponivel():
+        padrao = f'%{termo}%'
+        return query.filter(db.or_(*(getattr(FrotaLeve, c).ilike(padrao) for c in CAMPOS_BUSCA_FROTA_LEVE)))
+
+    prefixo_placa = re.sub(r'[^A-Za-z0-9-]', '', termo).upper()
+    if db.engine.dialect.name == 'postgresql':
+        filtro_texto = text(f"frota_leve.busca @@ to_tsquery('{CONFIG_FTS_POSTGRES}', :consulta_fts)").bindparams(
+            consulta_fts=' & '.join(f'{t}:*' for t in tokens))
+        filtro_placa = db.func.upper(FrotaLeve.placa).like(f'{prefixo_placa}%')
+    else:
+        filtro_texto = FrotaLeve.id.in_(
+            text("SELECT rowid FROM frota_leve_fts WHERE frota_leve_fts MATCH :consulta_fts").bindparams(
+                consulta_fts=' '.join(f'"{t}"*' for t in tokens)).columns(db.column('rowid', db.Integer)))
+        filtro_placa = FrotaLeve.placa.like(f'{prefixo_placa}%')
+    return query.filter(db.or_(filtro_placa, filtro_texto) if prefixo_placa else filtro_texto)
+
+# --- Sincronização incremental do users.json ---
+ADMINS = {'wilson.santana'}
+CHAVE_SYNC_USUARIOS = 'users_json_sha256'
+TAMANHO_LOTE_UPSERT = 500
+_assinatura_users_json = None  # (mtime_ns, tamanho) do users.json já conferido neste processo
+
+def upsert_em_lote(tabela, linhas, chaves, atualizar):
+    """INSERT ... ON CONFLICT DO UPDATE em lotes (Postgres/SQLite); `atualizar` mapeia coluna -> expressão(excluded)."""
+    if not linhas:
+        return
+    dialeto = db.engine.dialect.name
+    if dialeto in ('postgresql', 'sqlite'):
+        if dialeto == 'postgresql':
+            from sqlalchemy.dialects.postgresql import insert
+        else:
+            from sqlalchemy.dialects.sqlite import insert
+        for inicio in range(0, len(linhas), TAMANHO_LOTE_UPSERT):
+            stmt = insert(tabela).values(linhas[inicio:inicio + TAMANHO_LOTE_UPSERT])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=chaves,
+                set_={coluna: expressao(stmt.excluded) for coluna, expressao in atualizar.items()}
+            )
+            db.session.execute(stmt)
+        return
+
+    # Outros bancos: UPDATE por chave com as mesmas expressões (excluded = valores da linha) e INSERT se não havia
+    for linha in linhas:
+        filtro = [tabela.c[chave] == linha[chave] for chave in chaves]
+        excluded = SimpleNamespace(**{coluna: db.literal(valor, tabela.c[coluna].type) for coluna, valor in linha.items()})
+        valores = {coluna: expressao(excluded) for coluna, expressao in atualizar.items()}
+        if db.session.execute(tabela.update().where(*filtro).values(**valores)).rowcount == 0:
+            db.session.execute(tabela.insert().values(**linha))
+
+def sincronizar_usuarios(forcar=False):
+    """Aplica o users.json na tabela users só quando o conteúdo mudou (hash sha256 guardado em sync_estado).
+
+    Calcula a diferença contra o banco e grava apenas usuários novos ou alterados com upsert em lote.
+    Retorna um dict com 'inseridos', 'atualizados' e 'pulado'.
+    """
+    resultado = {'inseridos': 0, 'atualizados': 0, 'pulado': False}
+    if not os.path.exists(USERS_FILE):
+        logger.warning(f"Arquivo {USERS_FILE} não encontrado. Pulando sincronização de usuários.")
+        resultado['pulado'] = True
+        return resultado
+
+    with open(USERS_FILE, 'rb') as f:
+        conteudo = f.read()
+    hash_atual = hashlib.sha256(conteudo).hexdigest()
+    estado = db.session.get(SyncEstado, CHAVE_SYNC_USUARIOS)
+    if estado and estado.valor == hash_atual and not forcar:
+        logger.info("users.json sem alterações desde a última sincronização. Nada a fazer.")
+        resultado['pulado'] = True
+        return resultado
+
+    logger.info("Iniciando sincronização de usuários do users.json.")
+    with medir('json_load'):
+        js_users = json.loads(conteudo.decode('utf-8'))
+
+    tabela = User.__table__
+    db_users = {
+        linha.username: linha
+        for linha in db.session.execute(
+            db.select(tabela.c.username, tabela.c.password, tabela.c.is_admin, tabela.c.profile_picture)
+        )
+    }
+
+    linhas = []
+    for u_name, u_data in js_users.items():
+        username_lower = u_name.lower()
+        senha_val = u_data.get("senha", "") if isinstance(u_data, dict) else u_data
+        # Foto só é sobrescrita quando o users.json define uma (preserva as enviadas pelo painel)
+        pic_val = u_data.get("profile_picture") if isinstance(u_data, dict) else None
+        is_admin_val = username_lower in ADMINS
+
+        atual = db_users.get(username_lower)
+        if atual is None:
+            resultado['inseridos'] += 1
+            logger.info(f"Novo usuário '{username_lower}' adicionado.")
+        elif atual.password != senha_val or atual.is_admin != is_admin_val or (pic_val and atual.profile_picture != pic_val):
+            resultado['atualizados'] += 1
+            logger.info(f"Usuário '{username_lower}' atualizado.")
+        else:
+            continue
+        linhas.append({'username': username_lower, 'password': senha_val, 'is_admin': is_admin_val, 'profile_picture': pic_val})
+
+    try:
+        upsert_em_lote(tabela, linhas, ['username'], {
+            'password': lambda excluded: excluded.password,
+            'is_admin': lambda excluded: excluded.is_admin,
+            'profile_picture': lambda excluded: db.func.coalesce(excluded.profile_picture, tabela.c.profile_picture),
+        })
+        upsert_em_lote(SyncEstado.__table__, [{
+            'chave': CHAVE_SYNC_USUARIOS, 'valor': hash_atual, 'atualizado_em': saopaulo_tz.localize(datetime.now())
+        }], ['chave'], {
+            'valor': lambda excluded: excluded.valor,
+            'atualizado_em': lambda excluded: excluded.atualizado_em,
+        })
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    logger.info(f"Sincronização de usuários concluída: {resultado['inseridos']} inseridos, {resultado['atualizados']} atualizados.")
+    return resultado
+
+def sincronizar_usuarios_se_alterado():
+    """Checagem barata em runtime: só recalcula o hash quando mtime/tamanho do users.json mudam neste processo."""
+    global _assinatura_users_json
+    try:
+        st = os.stat(USERS_FILE)
+    except OSError:
+        return None
+    assinatura = (st.st_mtime_ns, st.st_size)
+    if assinatura == _assinatura_users_json:
+        return None
+    try:
+        resultado = sincronizar_usuarios()
+    except Exception as e:
+        logger.error(f"Erro ao sincronizar users.json em runtime: {e}")
+        return None
+    _assinatura_users_json = assinatura
+    return resultado
+
 # ... (Suas funções de carregamento de dados como carregar_os_gerente, carregar_prestadores, etc.)
+@cronometrar()
 def carregar_os_gerente(gerente_username):
     caminho_encontrado = None
 
     # Nova lógica: Tenta encontrar o arquivo de OS mapeado no users.json primeiro
     try:
-        with open(USERS_FILE, 'r', encoding='utf-8') as f:
-            users_data = json.load(f)
+        users_data = ler_json(USERS_FILE)
 
         user_info = users_data.get(gerente_username)
         if user_info and user_info.get('arquivo_os'):
@@ -334,43 +739,22 @@ def carregar_os_gerente(gerente_username):
                 caminho_encontrado = caminho_possivel
                 break
         if not caminho_encontrado:
-            for nome_arquivo_dir in os.listdir(MENSAGENS_DIR):
+            for nome_arquivo_dir in listar_json_os(MENSAGENS_DIR):
                 if nome_arquivo_dir.upper().startswith(base_nome_gerente + "_") and nome_arquivo_dir.lower().endswith(".json"):
                     caminho_encontrado = os.path.join(MENSAGENS_DIR, nome_arquivo_dir)
                     break
 
     if not caminho_encontrado: return []
-    
+
     try:
-        with open(caminho_encontrado, encoding="utf-8") as f:
-            dados_json = json.load(f)
+        registros = cache_registros_os.carregar(caminho_encontrado, saopaulo_tz.localize(datetime.now()).date())
     except Exception as e:
         logger.error(f"Erro ao carregar/decodificar JSON {caminho_encontrado} para {gerente_username}: {e}")
         return []
+    os_abertas.set(len(registros), tipo='gerente', usuario=gerente_username)
+    return registros
 
-    lista_resultado_os = []
-    data_hoje = saopaulo_tz.localize(datetime.now()).date()
-    for os_item in dados_json:
-        data_os_str = os_item.get("data") or os_item.get("Data") or ""
-        data_abertura_os = None
-        for fmt_data in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%Y", "%d/%m/%y", "%Y/%m/%d"):
-            try:
-                data_abertura_os = datetime.strptime(data_os_str, fmt_data).date()
-                break
-            except (ValueError, TypeError): continue
-        
-        dias_em_aberto = (data_hoje - data_abertura_os).days if data_abertura_os else 0
-        
-        lista_resultado_os.append({
-            "os": str(os_item.get("os") or os_item.get("OS", "")),
-            "frota": str(os_item.get("frota") or os_item.get("Frota", "")),
-            "data": data_os_str, 
-            "dias": str(dias_em_aberto), 
-            "prestador": str(os_item.get("prestador") or os_item.get("Prestador", "Prestador não definido")),
-            "servico": str(os_item.get("servico") or os_item.get("Servico") or os_item.get("observacao") or os_item.get("Observacao", ""))
-        })
-    return lista_resultado_os
-
+@cronometrar()
 def carregar_prestadores():
     if not os.path.exists(PRESTADORES_FILE):
         logger.warning(f"Arquivo {PRESTADORES_FILE} não encontrado. Criando arquivo vazio.")
@@ -379,8 +763,7 @@ def carregar_prestadores():
             json.dump([], f, ensure_ascii=False, indent=2)
         return []
     try:
-        with open(PRESTADORES_FILE, "r", encoding="utf-8") as f:
-            lista_prestadores = json.load(f)
+        lista_prestadores = ler_json(PRESTADORES_FILE)
         nomes_usuarios = [p.get('usuario', '').lower() for p in lista_prestadores if p.get('usuario')]
         if Counter(nomes_usuarios).most_common(1) and Counter(nomes_usuarios).most_common(1)[0][1] > 1:
             logger.warning(f"Usuários duplicados em {PRESTADORES_FILE}: {Counter(nomes_usuarios)}")
@@ -389,6 +772,7 @@ def carregar_prestadores():
         logger.error(f"Erro ao carregar {PRESTADORES_FILE}: {e}")
         return []
 
+@cronometrar()
 def carregar_manutencao():
     if not os.path.exists(MANUTENCAO_FILE):
         logger.warning(f"Arquivo {MANUTENCAO_FILE} não encontrado. Criando arquivo vazio.")
@@ -397,8 +781,7 @@ def carregar_manutencao():
             json.dump([], f, ensure_ascii=False, indent=2)
         return []
     try:
-        with open(MANUTENCAO_FILE, "r", encoding="utf-8") as f:
-            lista_manutencao = json.load(f)
+        lista_manutencao = ler_json(MANUTENCAO_FILE)
         nomes_usuarios_manut = [p.get('usuario', '').lower() for p in lista_manutencao if p.get('usuario')]
         if Counter(nomes_usuarios_manut).most_common(1) and Counter(nomes_usuarios_manut).most_common(1)[0][1] > 1:
             logger.warning(f"Usuários duplicados em {MANUTENCAO_FILE}: {Counter(nomes_usuarios_manut)}")
@@ -407,32 +790,17 @@ def carregar_manutencao():
         logger.error(f"Erro ao carregar {MANUTENCAO_FILE}: {e}")
         return []
 
-def carregar_os_prestadores(): 
-    lista_prestadores = carregar_prestadores()
-    mapa_os_por_prestador = {}
-    for dados_prestador in lista_prestadores:
-        username_prestador = dados_prestador.get('usuario', '').lower()
-        if not username_prestador or dados_prestador.get('tipo') == 'manutencao': continue
-        
-        nome_arquivo_os = dados_prestador.get('arquivo_os', '')
-        if not nome_arquivo_os:
-            mapa_os_por_prestador[username_prestador] = 0
-            continue
-
-        caminho_arquivo_os = os.path.join(MENSAGENS_PRESTADOR_DIR, nome_arquivo_os)
-        if not os.path.exists(caminho_arquivo_os):
-            mapa_os_por_prestador[username_prestador] = 0
-            continue
-        try:
-            with open(caminho_arquivo_os, 'r', encoding='utf-8') as f_json:
-                lista_os_prestador = json.load(f_json)
-            mapa_os_por_prestador[username_prestador] = len(lista_os_prestador)
-        except Exception as e:
-            logger.error(f"Erro ao carregar OS para {username_prestador} de {caminho_arquivo_os}: {e}")
-            mapa_os_por_prestador[username_prestador] = 0
-            
+@cronometrar()
+def carregar_os_prestadores():
+    """[(usuario, OS no JSON)] dos prestadores, maiores filas primeiro (do estado de carga, sem reler os JSONs)."""
+    atualizar_carga_prestadores()
+    estado = carga_prestadores.estado(saopaulo_tz.localize(datetime.now()).date())
+    mapa_os_por_prestador = {usuario: dados['fila_json'] for usuario, dados in estado.items()}
+    for username_prestador, quantidade_os in mapa_os_por_prestador.items():
+        os_abertas.set(quantidade_os, tipo='prestador', usuario=username_prestador)
     return sorted(mapa_os_por_prestador.items(), key=lambda item_mapa: item_mapa[1], reverse=True)
 
+@cronometrar()
 def carregar_os_manutencao(username_manut):
     usuarios_manutencao = carregar_manutencao()
     dados_usuario_manut = next((p for p in usuarios_manutencao if p.get('usuario', '').lower() == username_manut.lower()), None)
@@ -443,30 +811,14 @@ def carregar_os_manutencao(username_manut):
 
     caminho_os_manut = os.path.join(JSON_DIR, nome_arquivo_os_manut)
     if not os.path.exists(caminho_os_manut): return []
-    
+
     try:
-        with open(caminho_os_manut, 'r', encoding='utf-8') as f_json_manut:
-            lista_os_manut = json.load(f_json_manut)
+        return cache_registros_os.carregar(caminho_os_manut, saopaulo_tz.localize(datetime.now()).date())
     except Exception as e:
         logger.error(f"Erro ao carregar OS de manutenção de {caminho_os_manut}: {e}")
         return []
 
-    data_hoje_manut = saopaulo_tz.localize(datetime.now()).date()
-    for os_item_manut in lista_os_manut:
-        os_item_manut['modelo'] = str(os_item_manut.get('modelo', 'Desconhecido') or 'Desconhecido')
-        data_entrada_os_str = os_item_manut.get('data_entrada') or os_item_manut.get('data') or os_item_manut.get('Data','') 
-        os_item_manut['data_entrada'] = data_entrada_os_str 
-        
-        data_abertura_os_manut = None
-        if data_entrada_os_str:
-            for fmt_dt_manut in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%y", "%Y/%m/%d"):
-                try:
-                    data_abertura_os_manut = datetime.strptime(data_entrada_os_str, fmt_dt_manut).date()
-                    break
-                except (ValueError, TypeError): continue
-        os_item_manut['dias_abertos'] = (data_hoje_manut - data_abertura_os_manut).days if data_abertura_os_manut else 0
-    return lista_os_manut
-
+@cronometrar()
 def carregar_todas_os_pendentes():
     pendentes_db = OSPendente.query.all()
     lista_os_pendentes = []
@@ -482,44 +834,303 @@ def carregar_todas_os_pendentes():
         })
     return lista_os_pendentes
 
+# Valores da coluna prestador que contam como "sem prestador"
+PRESTADORES_NAO_DEFINIDOS = ('nan', '', 'none', 'não definido', 'prestador não definido')
+
+@cronometrar()
 def carregar_os_sem_prestador():
     lista_os_sem_p = []
     data_hoje_sem_p = saopaulo_tz.localize(datetime.now()).date()
 
-    for nome_arquivo_json_gerente in os.listdir(MENSAGENS_DIR):
+    for nome_arquivo_json_gerente in listar_json_os(MENSAGENS_DIR):
         if nome_arquivo_json_gerente.lower().endswith('.json'):
             caminho_arq_gerente = os.path.join(MENSAGENS_DIR, nome_arquivo_json_gerente)
             try:
-                with open(caminho_arq_gerente, 'r', encoding='utf-8') as f_gerente:
-                    dados_os_gerente = json.load(f_gerente)
-                for os_item_g in dados_os_gerente:
-                    nome_prestador = str(os_item_g.get('prestador') or os_item_g.get('Prestador', '')).lower().strip()
-                    if nome_prestador in ('nan', '', 'none', 'não definido', 'prestador não definido'):
-                        servico_str = str(os_item_g.get('servico') or os_item_g.get('Servico') or os_item_g.get('observacao') or os_item_g.get('Observacao', ''))
-                        data_os_g_str = str(os_item_g.get('data') or os_item_g.get('Data', ''))
-                        data_abertura_os_g = None
-                        if data_os_g_str:
-                            for fmt_g in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%y", "%Y/%m/%d"):
-                                try:
-                                    data_abertura_os_g = datetime.strptime(data_os_g_str, fmt_g).date()
-                                    break
-                                except (ValueError,TypeError):
-                                    continue
-
-                        dias_abertos_g = (data_hoje_sem_p - data_abertura_os_g).days if data_abertura_os_g else 0
-                        lista_os_sem_p.append({
-                            'os': str(os_item_g.get('os') or os_item_g.get('OS', '')),
-                            'frota': str(os_item_g.get('frota') or os_item_g.get('Frota', '')),
-                            'data_entrada': data_os_g_str,
-                            'modelo': str(os_item_g.get('modelo') or os_item_g.get('Modelo', 'Desconhecido') or 'Desconhecido'),
-                            'servico': servico_str,
-                            'arquivo_origem': nome_arquivo_json_gerente,
-                            'dias_abertos': dias_abertos_g
-                        })
+                registros = cache_registros_os.carregar(caminho_arq_gerente, data_hoje_sem_p)
             except Exception as e:
                 logger.error(f"Erro ao carregar OS sem prestador de {caminho_arq_gerente}: {e}")
+                continue
+            lista_os_sem_p.extend(r for r in registros if r.prestador.lower().strip() in PRESTADORES_NAO_DEFINIDOS)
     return lista_os_sem_p
 
+# --- Carga dos prestadores (sugestão de atribuição) ---
+CARGA_PRESTADORES_INTERVALO = 10        # segundos entre atualizações do estado (por processo)
+CARGA_PRESTADORES_RESSINCRONIZAR = 600  # recarga completa do banco (os eventos são apagados após EVENTOS_RETENCAO)
+carga_prestadores = CargaPrestadores()
+_estado_carga = {'verificado_em': 0.0, 'sincronizado_em': 0.0, 'ultimo_evento': None}
+_lock_carga = threading.Lock()
+
+def _prestador_da_pendencia(motivo):
+    """'Atribuído ao prestador: Fulano' / 'Reatribuído ao prestador: Fulano' -> 'Fulano'."""
+    _, separador, nome = (motivo or '').partition('ao prestador:')
+    return nome.strip() if separador else None
+
+def _sincronizar_movimentos_carga(hoje):
+    """Recarrega do banco as atribuições pendentes e os fechamentos da janela; devolve o último id de evento."""
+    ultimo_evento = db.session.scalar(db.select(db.func.max(EventoOS.id))) or 0
+    carga_prestadores.limpar_movimentos()
+    for numero, motivo in db.session.execute(db.select(OSPendente.os_numero, OSPendente.status_motivo)):
+        nome = _prestador_da_pendencia(motivo)
+        if nome:
+            carga_prestadores.registrar_atribuicao(numero, nome)
+    inicio = hoje - timedelta(days=carga_prestadores.janela_dias)
+    for numero, responsavel, registrado_em in db.session.execute(
+            db.select(Finalizacao.os_numero, Finalizacao.gerente, Finalizacao.registrado_em)
+            .where(Finalizacao.registrado_em >= datetime(inicio.year, inicio.month, inicio.day))):
+        carga_prestadores.registrar_finalizacao(numero, responsavel.lower(), registrado_em.date() if registrado_em else hoje)
+    return ultimo_evento
+
+def atualizar_carga_prestadores(forcar=False):
+    """Atualiza a carga dos prestadores por incremento: JSONs de fila alterados e eventos novos das OS.
+
+    Roda no máximo a cada CARGA_PRESTADORES_INTERVALO segundos por processo (ou já, com `forcar`).
+    Atribuições e finalizações de todos os workers chegam pela tabela de eventos.
+    """
+    with _lock_carga:
+        agora = time.monotonic()
+        if not forcar and agora - _estado_carga['verificado_em'] < CARGA_PRESTADORES_INTERVALO:
+            return
+        _estado_carga['verificado_em'] = agora
+        hoje = saopaulo_tz.localize(datetime.now()).date()
+        with medir('carga_prestadores'):
+            prestadores = [p for p in carregar_prestadores() if p.get('usuario') and p.get('tipo') != 'manutencao']
+            carga_prestadores.definir_prestadores(
+                [(p['usuario'].lower(), p.get('nome_exibicao') or p['usuario']) for p in prestadores])
+            for p in prestadores:
+                caminho = os.path.join(MENSAGENS_PRESTADOR_DIR, p['arquivo_os']) if p.get('arquivo_os') else None
+                try:
+                    st = os.stat(caminho) if caminho else None
+                except OSError:
+                    st = None
+                assinatura = (st.st_mtime_ns, st.st_size, hoje) if st else None
+                try:
+                    carga_prestadores.atualizar_fila(p['usuario'].lower(), assinatura,
+                                                     lambda c=caminho: cache_registros_os.carregar(c, hoje))
+                except Exception as e:
+                    logger.error(f"Carga: erro ao carregar a fila de {p['usuario']} de {caminho}: {e}")
+
+            try:
+                if _estado_carga['ultimo_evento'] is None or agora - _estado_carga['sincronizado_em'] > CARGA_PRESTADORES_RESSINCRONIZAR:
+                    _estado_carga['ultimo_evento'] = _sincronizar_movimentos_carga(hoje)
+                    _estado_carga['sincronizado_em'] = agora
+                    return
+                eventos = db.session.execute(
+                    db.select(EventoOS.id, EventoOS.tipo, EventoOS.os_numero, EventoOS.dados, EventoOS.criado_em)
+                    .where(EventoOS.id > _estado_carga['ultimo_evento'], EventoOS.tipo.in_(('os_atribuida', 'os_finalizada')))
+                    .order_by(EventoOS.id)).all()
+                for evento in eventos:
+                    dados = json.loads(evento.dados) if evento.dados else {}
+                    if evento.tipo == 'os_atribuida':
+                        carga_prestadores.registrar_atribuicao(evento.os_numero, dados.get('prestador'))
+                    else:
+                        carga_prestadores.registrar_finalizacao(evento.os_numero, (dados.get('por') or '').lower(),
+                                                                evento.criado_em.date() if evento.criado_em else hoje)
+                    _estado_carga['ultimo_evento'] = evento.id
+            except Exception as e:
+                db.session.rollback()
+                _estado_carga['ultimo_evento'] = None  # recarga completa na próxima vez
+                logger.error(f"Carga: erro ao ler atribuições/finalizações: {e}")
+
+# --- Busca server-side (índice invertido sobre as OS abertas e pendentes) ---
+indice_os = IndiceOS([
+    ('gerente', MENSAGENS_DIR, documento_gerente),
+    ('prestador', MENSAGENS_PRESTADOR_DIR, documento_prestador),
+    ('manutencao', JSON_DIR, documento_manutencao),
+], ler_json_os)
+
+def aquecer_cache_os():
+    """Abre o snapshot das OS e monta os registros e o índice de busca a partir dele.
+
+    Com o preload do gunicorn roda no master e os workers já nascem com os caches prontos.
+    """
+    with medir('aquecer_cache_os'):
+        validos = snapshot_os.abrir()
+        if not validos:
+            return 0
+        hoje = saopaulo_tz.localize(datetime.now()).date()
+        for caminho in snapshot_os.arquivos_validos():
+            try:
+                cache_registros_os.carregar(caminho, hoje)
+            except Exception as e:
+                logger.warning(f"Não foi possível aquecer {caminho}: {e}")
+        indice_os.atualizar()
+    logger.info(f"Caches de OS aquecidos com {validos} arquivo(s) do snapshot.")
+    return validos
+
+def atualizar_indice_os():
+    """Atualiza o índice de busca: JSONs alterados desde a última busca e a tabela de pendentes."""
+    indice_os.atualizar()
+    indice_os.atualizar_pendentes([{
+        'os': p.os_numero,
+        'frota': p.frota or '',
+        'servico': p.servico or '',
+        'data': p.status_data,
+        'responsavel': p.status_definido_por,
+        'status_motivo': p.status_motivo,
+    } for p in OSPendente.query.all()])
+
+# --- Eventos ao vivo dos painéis (long-polling em /eventos) ---
+# Cada requisição faz uma consulta à tabela de eventos e volta. Só quando não há nada novo ela
+# pode esperar um pouco, e no máximo EVENTOS_ESPERAS_MAX requisições por processo esperam ao
+# mesmo tempo: as demais voltam na hora e o navegador consulta de novo após EVENTOS_INTERVALO_POLLING.
+EVENTOS_ESPERA_MAXIMA = 10        # segundos que uma consulta sem eventos pode ficar aberta
+EVENTOS_INTERVALO_CONSULTA = 2    # segundos entre consultas durante a espera
+EVENTOS_INTERVALO_POLLING = 15    # segundos até a próxima consulta de quem não conseguiu esperar
+EVENTOS_ESPERAS_MAX = int(os.environ.get('EVENTOS_ESPERAS_MAX', '2'))
+EVENTOS_INTERVALO_INGESTAO = 10   # segundos entre verificações dos JSONs do ETL (por processo)
+EVENTOS_MAX_POR_INGESTAO = 200    # acima disso manda só um evento 'ingestao' (o painel pede para recarregar)
+EVENTOS_RETENCAO = timedelta(days=1)
+CHAVE_SYNC_INGESTAO = 'eventos_ingestao_json'
+_esperas_eventos = threading.BoundedSemaphore(max(EVENTOS_ESPERAS_MAX, 1))
+
+def publicar_eventos(tipo, numeros_os, destino=None, **dados):
+    """Adiciona eventos à sessão atual; vão para os painéis quando quem chamou fizer o commit."""
+    agora = saopaulo_tz.localize(datetime.now())
+    conteudo = json.dumps(dados, ensure_ascii=False) if dados else None
+    linhas = [{'tipo': tipo, 'os_numero': str(n), 'destino': destino, 'dados': conteudo, 'criado_em': agora}
+              for n in numeros_os]
+    if linhas:
+        db.session.execute(EventoOS.__table__.insert(), linhas)
+
+_estado_ingestao = {'verificado_em': 0.0, 'chaves': None, 'limpeza_em': 0.0}
+_lock_ingestao = threading.Lock()
+
+def _destinos_por_arquivo():
+    """{(origem, arquivo): usuário} para endereçar as OS novas do ETL a quem as vê no painel."""
+    destinos = {}
+    for p in carregar_prestadores():
+        if p.get('arquivo_os') and p.get('usuario'):
+            destinos[('prestador', p['arquivo_os'])] = p['usuario'].lower()
+    for m in carregar_manutencao():
+        if m.get('arquivo_os') and m.get('usuario'):
+            destinos[('manutencao', m['arquivo_os'])] = m['usuario'].lower()
+    try:
+        for usuario, info in ler_json(USERS_FILE).items():
+            if isinstance(info, dict) and info.get('arquivo_os'):
+                destinos[('gerente', info['arquivo_os'])] = usuario
+    except Exception as e:
+        logger.warning(f"Eventos: não foi possível ler {USERS_FILE}: {e}")
+    return destinos
+
+def verificar_ingestao_etl():
+    """Publica as OS que entraram/saíram dos JSONs (carga do ETL) desde a última verificação.
+
+    Roda no máximo a cada EVENTOS_INTERVALO_INGESTAO segundos por processo. Entre workers, só quem
+    conseguir trocar a assinatura em sync_estado publica (UPDATE condicional), evitando eventos repetidos.
+    """
+    agora = time.monotonic()
+    if not _lock_ingestao.acquire(blocking=False):
+        return 0
+    try:
+        if agora - _estado_ingestao['verificado_em'] < EVENTOS_INTERVALO_INGESTAO:
+            return 0
+        _estado_ingestao['verificado_em'] = agora
+        indice_os.atualizar()
+        chaves = indice_os.chaves_os()
+        anteriores, _estado_ingestao['chaves'] = _estado_ingestao['chaves'], chaves
+        if anteriores is None or chaves == anteriores:
+            return 0  # primeira verificação do processo só define a base
+
+        assinatura = hashlib.sha256(repr(sorted(chaves)).encode('utf-8')).hexdigest()
+        tabela = SyncEstado.__table__
+        estado = db.session.get(SyncEstado, CHAVE_SYNC_INGESTAO)
+        if estado is None:
+            db.session.add(SyncEstado(chave=CHAVE_SYNC_INGESTAO, valor=assinatura))
+        elif estado.valor == assinatura:
+            return 0  # outro worker já publicou esta carga
+        elif db.session.execute(tabela.update().where(tabela.c.chave == CHAVE_SYNC_INGESTAO, tabela.c.valor == estado.valor)
+                                .values(valor=assinatura, atualizado_em=saopaulo_tz.localize(datetime.now()))).rowcount != 1:
+            db.session.rollback()
+            return 0
+
+        removidas = anteriores - chaves
+        adicionadas = chaves - anteriores
+        if len(removidas) + len(adicionadas) > EVENTOS_MAX_POR_INGESTAO:
+            publicar_eventos('ingestao', [''], adicionadas=len(adicionadas), removidas=len(removidas))
+        else:
+            # Finalizar/atribuir/marcar pendente pelo app tira a OS do JSON e já publicou o próprio evento
+            numeros_removidos = {numero for _, _, numero in removidas}
+            anunciadas = set(db.session.scalars(
+                db.select(EventoOS.os_numero).where(
+                    EventoOS.os_numero.in_(numeros_removidos),
+                    EventoOS.tipo.in_(('os_finalizada', 'os_atribuida', 'os_pendente')),
+                    EventoOS.criado_em >= saopaulo_tz.localize(datetime.now()) - EVENTOS_RETENCAO))) if numeros_removidos else set()
+            destinos = _destinos_por_arquivo()
+            for tipo, mudancas in (('os_removida', removidas), ('os_adicionada', adicionadas)):
+                for origem, arquivo, numero in mudancas:
+                    if tipo == 'os_removida' and numero in anunciadas:
+                        continue
+                    destino = destinos.get((origem, arquivo))
+                    if destino:  # arquivo sem dono conhecido: só o admin e a manutenção (OS de gerente) ficam sabendo
+                        publicar_eventos(tipo, [numero], destino=destino, origem=origem)
+                    if origem == 'gerente':
+                        publicar_eventos(tipo, [numero], destino='@manutencao', origem=origem)
+        if agora - _estado_ingestao['limpeza_em'] > 3600:
+            _estado_ingestao['limpeza_em'] = agora
+            db.session.execute(EventoOS.__table__.delete().where(
+                EventoOS.criado_em < saopaulo_tz.localize(datetime.now()) - EVENTOS_RETENCAO))
+        db.session.commit()
+        logger.info(f"Eventos: carga de JSON detectada ({len(adicionadas)} OS novas, {len(removidas)} removidas).")
+        return len(removidas) + len(adicionadas)
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Eventos: erro ao verificar carga do ETL: {e}")
+        return 0
+    finally:
+        _lock_ingestao.release()
+
+@app.route('/eventos')
+def eventos_os():
+    """Eventos das OS com id maior que `ultimo` (JSON). Sem `ultimo`, só informa o id atual."""
+    if 'manutencao' in session:
+        usuario, perfil = session['manutencao'], 'manutencao'
+    elif 'prestador' in session:
+        usuario, perfil = session['prestador'], 'prestador'
+    elif 'gerente' in session:
+        usuario, perfil = session['gerente'], 'admin' if session.get('is_admin') else 'gerente'
+    else:
+        return ('', 401)
+    destinos_aceitos = {usuario, f'@{perfil}'}
+
+    ultimo_id = request.args.get('ultimo', '')
+    if not ultimo_id.isdigit():
+        ultimo_id = db.session.scalar(db.select(db.func.max(EventoOS.id))) or 0
+        db.session.close()
+        return jsonify(eventos=[], ultimo=ultimo_id, proxima_em=0)
+    ultimo_id = int(ultimo_id)
+
+    def consultar():
+        verificar_ingestao_etl()
+        linhas = db.session.execute(
+            db.select(EventoOS.id, EventoOS.tipo, EventoOS.os_numero, EventoOS.destino, EventoOS.dados)
+            .where(EventoOS.id > ultimo_id).order_by(EventoOS.id).limit(500)).all()
+        db.session.close()  # não segura a conexão do pool durante a espera
+        return linhas
+
+    linhas = consultar()
+    proxima_em = 0
+    if not linhas:
+        if _esperas_eventos.acquire(blocking=False):
+            try:
+                fim = time.monotonic() + EVENTOS_ESPERA_MAXIMA
+                while not linhas and time.monotonic() + EVENTOS_INTERVALO_CONSULTA <= fim:
+                    time.sleep(EVENTOS_INTERVALO_CONSULTA)
+                    linhas = consultar()
+            finally:
+                _esperas_eventos.release()
+        else:
+            proxima_em = EVENTOS_INTERVALO_POLLING * 1000  # vagas de espera ocupadas: polling simples
+
+    eventos = []
+    for evento in linhas:
+        ultimo_id = evento.id
+        if evento.destino and evento.destino not in destinos_aceitos and perfil != 'admin':
+            continue
+        dados = json.loads(evento.dados) if evento.dados else {}
+        dados.update(id=evento.id, tipo=evento.tipo, os=evento.os_numero)
+        eventos.append(dados)
+    return jsonify(eventos=eventos, ultimo=ultimo_id, proxima_em=proxima_em)
+
 # --- Rotas ---
 @app.route('/')
 def index():
@@ -530,7 +1141,8 @@ def login():
     if request.method == 'POST':
         username_form = request.form.get('username', '').strip().lower()
         senha_form = request.form.get('senha', '').strip()
-        
+        sincronizar_usuarios_se_alterado()
+
         user_db = User.query.filter_by(username=username_form).first()
         if user_db and user_db.password == senha_form: 
             login_time_now = saopaulo_tz.localize(datetime.now())
@@ -581,19 +1193,21 @@ def painel():
     os_pendentes_gerente = carregar_os_gerente(session['gerente'])
     finalizadas_gerente = Finalizacao.query.filter_by(gerente=session['gerente']).order_by(Finalizacao.registrado_em.desc()).limit(100).all()
     user_atual = User.query.filter_by(username=session['gerente']).first()
-    caminho_foto_perfil = url_for('static', filename=user_atual.profile_picture) if user_atual and user_atual.profile_picture else None
+    caminho_foto_perfil = url_arquivo(user_atual.profile_picture) if user_atual else None
     
     # Unifica as listas de OS pendentes com a lista principal do gerente
     todas_os_pendentes = carregar_todas_os_pendentes()
     mapa_pendentes = {str(p.get('os') or p.get('OS', '')): p for p in todas_os_pendentes}
 
-    for os in os_pendentes_gerente:
-        os_num = str(os.get('os') or os.get('OS', ''))
-        if os_num in mapa_pendentes:
-            os['status'] = 'Pendente'
-            os['status_motivo'] = mapa_pendentes[os_num].get('status_motivo', '')
-            os['status_definido_por'] = mapa_pendentes[os_num].get('status_definido_por', '')
-            os['status_data'] = mapa_pendentes[os_num].get('status_data', '')
+    # Os registros do cache são compartilhados: as pendentes ganham uma cópia com o status
+    os_pendentes_gerente = [
+        replace(registro, status='Pendente',
+                status_motivo=mapa_pendentes[registro.os].get('status_motivo', ''),
+                status_definido_por=mapa_pendentes[registro.os].get('status_definido_por', ''),
+                status_data=mapa_pendentes[registro.os].get('status_data', ''))
+        if registro.os in mapa_pendentes else registro
+        for registro in os_pendentes_gerente
+    ]
 
     return render_template('painel.html',
                          os_pendentes=os_pendentes_gerente,
@@ -625,14 +1239,17 @@ def upload_profile_picture():
     else:
         foto = request.files['profile_picture']
         if allowed_file(foto.filename):
-            nome_seguro_foto = secure_filename(f"{user_db_entry.username}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{foto.filename.rsplit('.', 1)[1].lower()}")
-            caminho_salvar_foto = os.path.join(app.config['UPLOAD_FOLDER'], nome_seguro_foto)
+            extensao_foto = foto.filename.rsplit('.', 1)[1].lower()
             try:
+                import io
+                from PIL import Image
                 img = Image.open(foto.stream)
                 img.thumbnail((100, 100)) 
-                img.save(caminho_salvar_foto)
-                
-                user_db_entry.profile_picture = f"uploads/{nome_seguro_foto}"
+                buffer_foto = io.BytesIO()
+                img.save(buffer_foto, format=Image.registered_extensions().get(f'.{extensao_foto}', 'PNG'))
+
+                # Mesma foto enviada de novo (ou por outro usuário) reaproveita o blob; a antiga sai no GC
+                user_db_entry.profile_picture = armazem_blobs.gravar_bytes(buffer_foto.getvalue(), extensao_foto)
                 db.session.commit()
                 flash('Foto de perfil atualizada!', 'success')
             except Exception as e:
@@ -667,27 +1284,7 @@ def painel_prestador():
             logger.warning(f"Arquivo OS {caminho_arq_os_prest} não encontrado.")
         else:
             try:
-                with open(caminho_arq_os_prest, 'r', encoding='utf-8') as f_os_prest:
-                    os_list_raw_prest = json.load(f_os_prest)
-                data_hoje_prest = saopaulo_tz.localize(datetime.now()).date()
-                for os_item_raw_prest in os_list_raw_prest:
-                    item_proc_prest = dict(os_item_raw_prest) # Cria cópia
-                    data_os_str_prest = item_proc_prest.get('data_entrada') or item_proc_prest.get('data') or item_proc_prest.get('Data', '')
-                    item_proc_prest['data_entrada'] = data_os_str_prest
-                    item_proc_prest['modelo'] = str(item_proc_prest.get('modelo') or item_proc_prest.get('Modelo') or 'Desconhecido')
-                    
-                    dias_abertos_calc_prest = 0
-                    if data_os_str_prest:
-                        data_abertura_obj_prest = None
-                        for fmt_prest in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%y", "%Y/%m/%d"):
-                            try:
-                                data_abertura_obj_prest = datetime.strptime(data_os_str_prest, fmt_prest).date()
-                                break
-                            except (ValueError, TypeError): continue
-                        if data_abertura_obj_prest: dias_abertos_calc_prest = (data_hoje_prest - data_abertura_obj_prest).days
-                        else: logger.warning(f"Parse de data falhou para OS {item_proc_prest.get('os','?')} data: '{data_os_str_prest}'")
-                    item_proc_prest['dias_abertos'] = dias_abertos_calc_prest
-                    lista_os_do_prestador.append(item_proc_prest)
+                lista_os_do_prestador = cache_registros_os.carregar(caminho_arq_os_prest, saopaulo_tz.localize(datetime.now()).date())
             except Exception as e:
                 logger.error(f"Erro processando OS de {caminho_arq_os_prest}: {e}")
                 flash("Erro ao carregar OS.", 'danger')
@@ -712,39 +1309,25 @@ def painel_manutencao():
 
     lista_os_manutencao = carregar_os_manutencao(session['manutencao'])
     lista_os_sem_p_manut = carregar_os_sem_prestador()
+    atualizar_carga_prestadores()
+    hoje_manut = saopaulo_tz.localize(datetime.now()).date()
+    estado_carga = carga_prestadores.estado(hoje_manut)
+    sugestoes_prestador = carga_prestadores.sugerir(lista_os_sem_p_manut, hoje_manut)  # guardadas até a carga mudar
     
     ordenar_por = request.args.get('ordenar', 'data_desc')
-    if lista_os_manutencao: 
-        try:
-            def sort_key_date(x):
-                try:
-                    return datetime.strptime(x['data_entrada'], '%d/%m/%Y') if x.get('data_entrada') else datetime.min.date()
-                except ValueError: # Tenta outros formatos se o primeiro falhar
-                    for fmt_sort in ("%Y-%m-%d", "%d-%m-%y", "%Y/%m/%d"):
-                        try:
-                            return datetime.strptime(x['data_entrada'], fmt_sort) if x.get('data_entrada') else datetime.min.date()
-                        except ValueError:
-                            continue
-                    return datetime.min.date() # Fallback se nenhum formato funcionar
-
-            if ordenar_por == 'data_asc':
-                lista_os_manutencao.sort(key=sort_key_date)
-            elif ordenar_por == 'data_desc':
-                lista_os_manutencao.sort(key=sort_key_date, reverse=True)
-            elif ordenar_por == 'frota':
-                lista_os_manutencao.sort(key=lambda x: str(x.get('frota','')))
-        except Exception as e_sort: # Captura exceção mais genérica durante a ordenação
-             logger.warning(f"Erro ao ordenar OS de manutenção: {e_sort}")
-
+    if ordenar_por in ('data_asc', 'data_desc'):
+        lista_os_manutencao = sorted(lista_os_manutencao, key=lambda r: r.data_abertura or date.min, reverse=ordenar_por == 'data_desc')
+    elif ordenar_por == 'frota':
+        lista_os_manutencao = sorted(lista_os_manutencao, key=lambda r: r.frota)
 
     finalizadas_todas = Finalizacao.query.order_by(Finalizacao.registrado_em.desc()).limit(100).all()
     
     foto_perfil_manut = None
     user_manut_db_entry = User.query.filter_by(username=session['manutencao']).first()
     if user_manut_db_entry and user_manut_db_entry.profile_picture:
-        foto_perfil_manut = url_for('static', filename=user_manut_db_entry.profile_picture)
+        foto_perfil_manut = url_arquivo(user_manut_db_entry.profile_picture)
     elif dados_usuario_manut_atual.get('profile_picture'): 
-        foto_perfil_manut = url_for('static', filename=dados_usuario_manut_atual['profile_picture'])
+        foto_perfil_manut = url_arquivo(dados_usuario_manut_atual['profile_picture'])
 
     return render_template('painel_manutencao.html', 
                          nome=dados_usuario_manut_atual.get('nome_exibicao', session['manutencao'].capitalize()),
@@ -755,11 +1338,56 @@ def painel_manutencao():
                          finalizadas=finalizadas_todas,
                          ordenar_atual=ordenar_por, 
                          prestadores_disponiveis=carregar_prestadores(),
+                         carga_prestadores=estado_carga,
+                         sugestoes_prestador=sugestoes_prestador,
+                         janela_carga_dias=carga_prestadores.janela_dias,
                          profile_picture=foto_perfil_manut,
                          now=datetime.now(saopaulo_tz), 
                          today_date=datetime.now(saopaulo_tz).strftime('%Y-%m-%d'),
                          manutencao=session.get('manutencao'))
 
+def _registrar_evidencia(finalizacao_id, nome_original, resultado, erro):
+    """Grava na finalização o resultado do processamento (roda na thread da fila de evidências)."""
+    with app.app_context():
+        try:
+            if erro is None:
+                valores = {
+                    'evidencia': armazem_blobs.gravar_arquivo(os.path.join(EVIDENCIAS_DIR, resultado['arquivo'])),
+                    'evidencia_miniatura': armazem_blobs.gravar_arquivo(os.path.join(EVIDENCIAS_DIR, resultado['miniatura'])),
+                    'evidencia_status': STATUS_PRONTA,
+                }
+            else:
+                valores = {'evidencia': nome_original, 'evidencia_status': STATUS_ERRO}
+            db.session.execute(Finalizacao.__table__.update()
+                               .where(Finalizacao.__table__.c.id == finalizacao_id).values(**valores))
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            logger.error(f"Erro ao registrar evidência da finalização {finalizacao_id}: {e}")
+        finally:
+            db.session.remove()
+
+def enfileirar_evidencia(finalizacao_id, nome_original):
+    nome_base = nome_original.rsplit('_original', 1)[0]
+    return fila_evidencias.enviar(
+        os.path.join(EVIDENCIAS_DIR, nome_original), EVIDENCIAS_DIR, nome_base,
+        lambda resultado, erro: _registrar_evidencia(finalizacao_id, nome_original, resultado, erro))
+
+@app.cli.command('processar-evidencias')
+def processar_evidencias_command():
+    """Reprocessa evidências que ficaram pendentes ou com erro (ex.: worker reiniciado no meio)."""
+    pendentes = db.session.execute(db.select(Finalizacao.id, Finalizacao.evidencia).where(
+        Finalizacao.evidencia_status.in_([STATUS_PROCESSANDO, STATUS_ERRO]))).all()
+    enviadas = 0
+    for finalizacao_id, nome_original in pendentes:
+        if nome_original and os.path.exists(os.path.join(EVIDENCIAS_DIR, nome_original)):
+            enfileirar_evidencia(finalizacao_id, nome_original)
+            enviadas += 1
+        else:
+            logger.warning(f"Evidência da finalização {finalizacao_id} não encontrada: {nome_original}")
+    fila_evidencias.aguardar()
+    click.echo(f"{enviadas} de {len(pendentes)} evidência(s) pendente(s) reprocessada(s).")
+
 @app.route('/finalizar_os/<os_numero_str>', methods=['POST'])
 def finalizar_os(os_numero_str): 
     responsavel_login = session.get('gerente') or session.get('prestador') or session.get('manutencao')
@@ -774,7 +1402,7 @@ def finalizar_os(os_numero_str):
     # Lógica para encontrar a OS e o diretório correspondente
     if 'gerente' in session:
         lista_os_gerente = carregar_os_gerente(session['gerente'])
-        dados_os_para_finalizar = next((os_item for os_item in lista_os_gerente if str(os_item.get('os')) == os_numero_str), None)
+        dados_os_para_finalizar = next((registro for registro in lista_os_gerente if registro.os == os_numero_str), None)
         diretorio_json_os = MENSAGENS_DIR 
     elif 'prestador' in session:
         dados_prestador = next((p for p in carregar_prestadores() if p.get('usuario','').lower() == session['prestador']), None)
@@ -790,11 +1418,8 @@ def finalizar_os(os_numero_str):
     # Se dados_os_para_finalizar não foi encontrado, tenta ler do arquivo específico
     if caminho_arquivo_json_os and os.path.exists(caminho_arquivo_json_os) and not dados_os_para_finalizar:
         try: 
-            with open(caminho_arquivo_json_os, 'r', encoding='utf-8') as f_json_os_fin:
-                lista_os_json = json.load(f_json_os_fin)
-            dados_os_para_finalizar = next((item for item in lista_os_json if str(item.get('os') or item.get('OS', '')) == os_numero_str), None)
-            if dados_os_para_finalizar:
-                dados_os_para_finalizar['data_entrada'] = dados_os_para_finalizar.get('data_entrada') or dados_os_para_finalizar.get('data') or dados_os_para_finalizar.get('Data','')
+            registros = cache_registros_os.carregar(caminho_arquivo_json_os, saopaulo_tz.localize(datetime.now()).date())
+            dados_os_para_finalizar = next((registro for registro in registros if registro.os == os_numero_str), None)
         except Exception as e_read: 
             logger.error(f"Erro ao ler {caminho_arquivo_json_os} em finalizar_os: {e_read}")
 
@@ -819,16 +1444,7 @@ def finalizar_os(os_numero_str):
             if 'gerente' in session: return redirect(url_for('painel'))
             return redirect(url_for('login'))
 
-        data_abertura_os_obj = None
-        if dados_os_para_finalizar:
-            data_abertura_os_str = dados_os_para_finalizar.get('data_entrada') or dados_os_para_finalizar.get('data')
-            if data_abertura_os_str:
-                for fmt_abertura in ("%d/%m/%Y", "%Y-%m-%d", "%d-%m-%y", "%Y/%m/%d"):
-                    try:
-                        data_abertura_os_obj = datetime.strptime(data_abertura_os_str, fmt_abertura).date()
-                        break
-                    except (ValueError, TypeError): 
-                        continue
+        data_abertura_os_obj = dados_os_para_finalizar.data_abertura
         
         try:
             # Tentar parsear a data de finalização em múltiplos formatos
@@ -851,14 +1467,18 @@ def finalizar_os(os_numero_str):
             else:
                 nome_arquivo_evidencia = None
                 if arquivo_evidencia and allowed_file(arquivo_evidencia.filename):
-                    subpasta_evidencias = os.path.join(app.config['UPLOAD_FOLDER'], 'evidencias')
-                    os.makedirs(subpasta_evidencias, exist_ok=True)
-                    nome_arquivo_evidencia = secure_filename(f"ev_{os_numero_str}_{responsavel_login}_{datetime.now().strftime('%Y%m%d%H%M%S')}.{arquivo_evidencia.filename.rsplit('.',1)[1].lower()}")
+                    os.makedirs(EVIDENCIAS_DIR, exist_ok=True)
+                    nome_base_evidencia = secure_filename(f"ev_{os_numero_str}_{responsavel_login}_{datetime.now().strftime('%Y%m%d%H%M%S')}")
+                    nome_arquivo_evidencia = f"{nome_base_evidencia}_original.{arquivo_evidencia.filename.rsplit('.',1)[1].lower()}"
                     try:
-                        arquivo_evidencia.save(os.path.join(subpasta_evidencias, nome_arquivo_evidencia))
+                        # O upload já chega em arquivo temporário (Werkzeug); aqui só é copiado em blocos
+                        with medir('evidencia_salvar'):
+                            arquivo_evidencia.save(os.path.join(EVIDENCIAS_DIR, nome_arquivo_evidencia))
                     except Exception as e_save:
                         logger.error(f"Erro ao salvar evidência: {e_save}")
                         nome_arquivo_evidencia = None 
+                elif arquivo_evidencia and arquivo_evidencia.filename:
+                    flash(f'Evidência ignorada: formato não permitido. Use: {", ".join(sorted(ALLOWED_EXTENSIONS))}.', 'warning')
 
                 nova_finalizacao = Finalizacao(
                     os_numero=os_numero_str, 
@@ -866,7 +1486,10 @@ def finalizar_os(os_numero_str):
                     data_fin=data_finalizacao_formatada_db,
                     hora_fin=hora_finalizacao_form, 
                     observacoes=observacoes_form,
-                    registrado_em=saopaulo_tz.localize(datetime.now())
+                    registrado_em=saopaulo_tz.localize(datetime.now()),
+                    evidencia=nome_arquivo_evidencia,
+                    evidencia_status=STATUS_PROCESSANDO if nome_arquivo_evidencia else None,
+                    data_abertura=data_abertura_os_obj,
                 )
                 db.session.add(nova_finalizacao)
 
@@ -875,7 +1498,10 @@ def finalizar_os(os_numero_str):
                 if pendente_a_remover:
                     db.session.delete(pendente_a_remover)
 
+                publicar_eventos('os_finalizada', [os_numero_str], por=responsavel_login)
                 db.session.commit()
+                if nome_arquivo_evidencia:
+                    enfileirar_evidencia(nova_finalizacao.id, nome_arquivo_evidencia)
                 
                 # Garante que a OS seja removida de todos os diretórios relevantes
                 removidos_gerente = remover_os_de_todos_json(MENSAGENS_DIR, os_numero_str)
@@ -885,6 +1511,7 @@ def finalizar_os(os_numero_str):
                 if removidos_todos:
                     flash(f'OS {os_numero_str} removida de: {", ".join(removidos_todos)}', 'info')
 
+                os_finalizadas_total.inc(origem='gerente' if 'gerente' in session else 'prestador' if 'prestador' in session else 'manutencao')
                 flash(f'OS {os_numero_str} finalizada e registrada!', 'success')
         except ValueError as ve:
             logger.error(f"Erro de formato de data ao finalizar OS {os_numero_str}: {ve}. Data recebida: {data_finalizacao_form}")
@@ -904,6 +1531,119 @@ def finalizar_os(os_numero_str):
     return redirect(url_for('login'))
 
 
+def _os_abertas_do_responsavel():
+    """OS abertas do usuário logado: ({numero: RegistroOS}, diretório do JSON dele)."""
+    itens, diretorio = [], None
+    if 'gerente' in session:
+        itens, diretorio = carregar_os_gerente(session['gerente']), MENSAGENS_DIR
+    elif 'prestador' in session:
+        dados_prestador = next((p for p in carregar_prestadores() if p.get('usuario', '').lower() == session['prestador']), None)
+        if dados_prestador and dados_prestador.get('arquivo_os'):
+            diretorio = MENSAGENS_PRESTADOR_DIR
+            caminho = os.path.join(diretorio, dados_prestador['arquivo_os'])
+            if os.path.exists(caminho):
+                try:
+                    itens = cache_registros_os.carregar(caminho, saopaulo_tz.localize(datetime.now()).date())
+                except Exception as e:
+                    logger.error(f"Erro ao ler {caminho} na finalização em lote: {e}")
+    elif 'manutencao' in session:
+        itens, diretorio = carregar_os_manutencao(session['manutencao']), JSON_DIR
+    return {registro.os: registro for registro in itens}, diretorio
+
+@app.route('/finalizar_os_em_lote', methods=['POST'])
+def finalizar_os_em_lote():
+    """Finaliza várias OS com a mesma data/hora: uma transação no banco e cada JSON regravado uma vez."""
+    responsavel_login = session.get('gerente') or session.get('prestador') or session.get('manutencao')
+    if not responsavel_login:
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+    painel_destino = 'painel_prestador' if 'prestador' in session else 'painel_manutencao' if 'manutencao' in session else 'painel'
+
+    numeros_selecionados = list(dict.fromkeys(n.strip() for n in request.form.getlist('os_numeros') if n.strip()))
+    data_finalizacao_form = request.form.get('data_finalizacao')
+    hora_finalizacao_form = request.form.get('hora_finalizacao')
+    observacoes_form = request.form.get('observacoes', '')
+    if not numeros_selecionados:
+        flash('Selecione ao menos uma OS para finalizar.', 'warning')
+        return redirect(url_for(painel_destino))
+    if not data_finalizacao_form or not hora_finalizacao_form:
+        flash('Data e hora de finalização são obrigatórias.', 'danger')
+        return redirect(url_for(painel_destino))
+    data_finalizacao_obj = None
+    for fmt_finalizacao in ("%Y-%m-%d", "%d/%m/%Y"):
+        try:
+            data_finalizacao_obj = datetime.strptime(data_finalizacao_form, fmt_finalizacao).date()
+            break
+        except (ValueError, TypeError):
+            continue
+    if not data_finalizacao_obj:
+        flash(f'Formato de data de finalização inválido. Recebido: "{data_finalizacao_form}". Esperado: DD/MM/YYYY ou YYYY-MM-DD.', 'danger')
+        return redirect(url_for(painel_destino))
+
+    with medir('finalizar_os_em_lote'):
+        abertas, diretorio_usuario = _os_abertas_do_responsavel()
+        nao_encontradas, data_invalida, a_finalizar = [], [], []
+        for numero in numeros_selecionados:
+            if numero not in abertas:
+                nao_encontradas.append(numero)
+                continue
+            data_abertura = abertas[numero].data_abertura
+            if data_abertura and data_finalizacao_obj < data_abertura:
+                data_invalida.append(f"{numero} (aberta em {data_abertura.strftime('%d/%m/%Y')})")
+                continue
+            a_finalizar.append(numero)
+
+        ja_finalizadas = set()
+        if a_finalizar:
+            ja_finalizadas = set(db.session.scalars(
+                db.select(Finalizacao.os_numero).where(Finalizacao.os_numero.in_(a_finalizar))))
+            a_finalizar = [n for n in a_finalizar if n not in ja_finalizadas]
+
+        if a_finalizar:
+            registrado_em = saopaulo_tz.localize(datetime.now())
+            data_finalizacao_formatada_db = data_finalizacao_obj.strftime('%d/%m/%Y')
+            try:
+                db.session.execute(Finalizacao.__table__.insert(), [{
+                    'os_numero': numero,
+                    'gerente': responsavel_login,
+                    'data_fin': data_finalizacao_formatada_db,
+                    'hora_fin': hora_finalizacao_form,
+                    'observacoes': observacoes_form,
+                    'registrado_em': registrado_em,
+                    'status_pimns': False,
+                    'data_abertura': abertas[numero].data_abertura,
+                } for numero in a_finalizar])
+                db.session.execute(OSPendente.__table__.delete().where(OSPendente.os_numero.in_(a_finalizar)))
+                publicar_eventos('os_finalizada', a_finalizar, por=responsavel_login)
+                db.session.commit()
+            except Exception as e_commit:
+                db.session.rollback()
+                logger.error(f"Erro DB ao finalizar em lote {len(a_finalizar)} OS: {e_commit}")
+                flash('Erro ao registrar as finalizações. Nenhuma OS foi finalizada; verifique os logs.', 'danger')
+                return redirect(url_for(painel_destino))
+            os_finalizadas_total.inc(len(a_finalizar), origem='gerente' if 'gerente' in session else 'prestador' if 'prestador' in session else 'manutencao')
+            flash(f'{len(a_finalizar)} OS finalizada(s) e registrada(s)!', 'success')
+
+        # As já finalizadas antes também saem dos JSONs (ainda estavam na lista do usuário)
+        remover_dos_json = a_finalizar + sorted(ja_finalizadas)
+        if remover_dos_json:
+            diretorios = [MENSAGENS_DIR, MENSAGENS_PRESTADOR_DIR]
+            if diretorio_usuario and diretorio_usuario not in diretorios:
+                diretorios.append(diretorio_usuario)
+            arquivos_alterados = set()
+            for diretorio in diretorios:
+                arquivos_alterados.update(remover_varias_os_de_todos_json(diretorio, remover_dos_json))
+            if arquivos_alterados:
+                flash(f'OS removidas de: {", ".join(sorted(arquivos_alterados))}', 'info')
+
+    if data_invalida:
+        flash(f'Data de finalização anterior à abertura, não finalizadas: {", ".join(data_invalida)}', 'danger')
+    if nao_encontradas:
+        flash(f'OS não encontradas nos seus registros: {", ".join(nao_encontradas)}', 'warning')
+    if ja_finalizadas:
+        flash(f'OS já finalizadas anteriormente: {", ".join(sorted(ja_finalizadas))}', 'info')
+    return redirect(url_for(painel_destino))
+
 @app.route('/marcar_pendente/<os_numero>', methods=['POST'])
 def marcar_pendente(os_numero):
     if 'prestador' not in session:
@@ -927,8 +1667,7 @@ def marcar_pendente(os_numero):
     os_details = None
     lista_os = []
     try:
-        with open(caminho_arquivo_os, 'r', encoding='utf-8') as f:
-            lista_os = json.load(f)
+        lista_os = ler_json(caminho_arquivo_os)
 
         for os_item in lista_os:
             if str(os_item.get('os') or os_item.get('OS', '')) == os_numero:
@@ -963,12 +1702,12 @@ def marcar_pendente(os_numero):
             )
             db.session.add(nova_pendencia)
 
+        publicar_eventos('os_pendente', [os_numero], motivo=motivo, por=session.get('prestador_nome', prestador_username))
         db.session.commit()
 
         # 3. Remover do arquivo JSON após sucesso no DB
         lista_os_atualizada = [item for item in lista_os if str(item.get('os') or item.get('OS', '')) != os_numero]
-        with open(caminho_arquivo_os, 'w', encoding='utf-8') as f:
-            json.dump(lista_os_atualizada, f, ensure_ascii=False, indent=2)
+        salvar_json(caminho_arquivo_os, lista_os_atualizada)
 
         flash(f'OS {os_numero} marcada como pendente e movida da sua lista ativa.', 'success')
 
@@ -980,38 +1719,37 @@ def marcar_pendente(os_numero):
     return redirect(url_for('painel_prestador'))
 
 
-@app.route('/atribuir_prestador/<os_numero_str>', methods=['POST'])
-def atribuir_prestador(os_numero_str):
-    if 'manutencao' not in session:
-        flash('Acesso negado.', 'danger')
-        return redirect(url_for('login'))
-
-    responsavel_atribuicao = session['manutencao']
+def _prestador_destino_do_form():
+    """Nome de exibição do prestador escolhido no formulário de atribuição (ou None, com flash do erro)."""
     # O nome do prestador agora pode ser um novo nome ou um usuário existente
     prestador_selecionado = request.form.get('prestador_usuario', '').strip()
     novo_prestador_nome = request.form.get('novo_prestador', '').strip()
 
-    username_prestador_final = None
-    nome_exibicao_prestador = None
-
     if novo_prestador_nome:
         # Lógica para um novo prestador (não o salva, apenas usa o nome)
-        username_prestador_final = novo_prestador_nome.lower().replace(" ", "_")
-        nome_exibicao_prestador = novo_prestador_nome
-    elif prestador_selecionado:
+        return novo_prestador_nome
+    if prestador_selecionado:
         # Lógica para um prestador existente
         dados_prestador_destino = next((p for p in carregar_prestadores() if p.get('usuario', '').lower() == prestador_selecionado.lower()), None)
         if dados_prestador_destino:
-            username_prestador_final = dados_prestador_destino.get('usuario')
-            nome_exibicao_prestador = dados_prestador_destino.get('nome_exibicao', username_prestador_final)
-        else:
-            flash(f'Prestador selecionado "{prestador_selecionado}" não foi encontrado.', 'danger')
-            return redirect(url_for('painel_manutencao'))
-    else:
-        flash('Selecione um prestador ou digite um novo nome.', 'danger')
+            return dados_prestador_destino.get('nome_exibicao', dados_prestador_destino.get('usuario'))
+        flash(f'Prestador selecionado "{prestador_selecionado}" não foi encontrado.', 'danger')
+        return None
+    flash('Selecione um prestador ou digite um novo nome.', 'danger')
+    return None
+
+@app.route('/atribuir_prestador/<os_numero_str>', methods=['POST'])
+def atribuir_prestador(os_numero_str):
+    if 'manutencao' not in session:
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+
+    responsavel_atribuicao = session['manutencao']
+    nome_exibicao_prestador = _prestador_destino_do_form()
+    if not nome_exibicao_prestador:
         return redirect(url_for('painel_manutencao'))
 
-    os_alvo = next((os_item for os_item in carregar_os_sem_prestador() if str(os_item.get('os')) == os_numero_str), None)
+    os_alvo = next((registro for registro in carregar_os_sem_prestador() if registro.os == os_numero_str), None)
 
     if not os_alvo:
         flash(f'OS {os_numero_str} não encontrada ou já foi atribuída.', 'warning')
@@ -1028,9 +1766,9 @@ def atribuir_prestador(os_numero_str):
         else:
             # Cria uma nova pendência
             nova_pendencia = OSPendente(
-                os_numero=os_alvo.get('os'),
-                frota=os_alvo.get('frota'),
-                servico=os_alvo.get('servico'),
+                os_numero=os_alvo.os,
+                frota=os_alvo.frota,
+                servico=os_alvo.servico,
                 status_motivo=f"Atribuído ao prestador: {nome_exibicao_prestador}",
                 status_definido_por=responsavel_atribuicao,
                 status_data=datetime.now(saopaulo_tz).strftime('%d/%m/%Y %H:%M')
@@ -1042,7 +1780,9 @@ def atribuir_prestador(os_numero_str):
         if removidos:
             logger.info(f"OS {os_numero_str} removida do arquivo de origem: {', '.join(removidos)}")
 
+        publicar_eventos('os_atribuida', [os_numero_str], prestador=nome_exibicao_prestador)
         db.session.commit()
+        atualizar_carga_prestadores(forcar=True)
         flash(f'OS {os_numero_str} atribuída a "{nome_exibicao_prestador}" e enviada para pendências do Admin.', 'success')
 
     except Exception as e:
@@ -1052,9 +1792,195 @@ def atribuir_prestador(os_numero_str):
 
     return redirect(url_for('painel_manutencao'))
 
+@app.route('/atribuir_prestador_em_lote', methods=['POST'])
+def atribuir_prestador_em_lote():
+    """Atribui várias OS sem prestador de uma vez: uma consulta ao índice, um upsert e uma regravação por arquivo.
+
+    Com `distribuir=1` cada OS vai para o prestador sugerido pela carga atual (lote balanceado).
+    """
+    if 'manutencao' not in session:
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+
+    responsavel_atribuicao = session['manutencao']
+    numeros_selecionados = list(dict.fromkeys(n.strip() for n in request.form.getlist('os_numeros') if n.strip()))
+    if not numeros_selecionados:
+        flash('Selecione ao menos uma OS para atribuir.', 'warning')
+        return redirect(url_for('painel_manutencao'))
+    distribuir = request.form.get('distribuir') == '1'
+    nome_exibicao_prestador = None
+    if not distribuir:
+        nome_exibicao_prestador = _prestador_destino_do_form()
+        if not nome_exibicao_prestador:
+            return redirect(url_for('painel_manutencao'))
+
+    with medir('atribuir_prestador_em_lote'):
+        atualizar_indice_os()
+        documentos = indice_os.documentos_por_os(numeros_selecionados, origem='gerente')
+        os_alvo, arquivos_por_os = {}, {}
+        for numero in numeros_selecionados:
+            sem_prestador = [d for d in documentos.get(numero, []) if d['prestador'].lower().strip() in PRESTADORES_NAO_DEFINIDOS]
+            if sem_prestador:
+                os_alvo[numero] = sem_prestador[0]
+                arquivos_por_os[numero] = {d['arquivo'] for d in sem_prestador}
+        nao_encontradas = [n for n in numeros_selecionados if n not in os_alvo]
+
+        if os_alvo and distribuir:
+            atualizar_carga_prestadores()
+            hoje = saopaulo_tz.localize(datetime.now()).date()
+            estado_carga = carga_prestadores.estado(hoje)
+            plano = carga_prestadores.distribuir([r for r in carregar_os_sem_prestador() if r.os in os_alvo], hoje, estado_carga)
+            destinos = {numero: estado_carga[usuario]['nome'] for numero, usuario in plano.items()}
+            if not destinos:
+                flash('Nenhum prestador disponível para distribuir as OS.', 'danger')
+                return redirect(url_for('painel_manutencao'))
+            nao_encontradas += [n for n in os_alvo if n not in destinos]
+            os_alvo = {n: d for n, d in os_alvo.items() if n in destinos}
+        else:
+            destinos = dict.fromkeys(os_alvo, nome_exibicao_prestador)
+
+        if os_alvo:
+            status_data = datetime.now(saopaulo_tz).strftime('%d/%m/%Y %H:%M')
+            os_por_prestador = {}
+            for numero in os_alvo:
+                os_por_prestador.setdefault(destinos[numero], []).append(numero)
+            try:
+                for nome_prestador, numeros in os_por_prestador.items():
+                    linhas = [{
+                        'os_numero': numero,
+                        'frota': os_alvo[numero]['frota'],
+                        'servico': os_alvo[numero]['servico'],
+                        'status_motivo': f"Atribuído ao prestador: {nome_prestador}",
+                        'status_definido_por': responsavel_atribuicao,
+                        'status_data': status_data,
+                    } for numero in numeros]
+                    motivo_reatribuicao = f"Reatribuído ao prestador: {nome_prestador}"
+                    upsert_em_lote(OSPendente.__table__, linhas, ['os_numero'], {
+                        'status_motivo': lambda excluded, motivo=motivo_reatribuicao: db.literal(motivo),
+                        'status_definido_por': lambda excluded: excluded.status_definido_por,
+                        'status_data': lambda excluded: excluded.status_data,
+                    })
+                    publicar_eventos('os_atribuida', numeros, prestador=nome_prestador)
+                db.session.commit()
+            except Exception as e:
+                db.session.rollback()
+                logger.error(f"Erro ao atribuir {len(os_alvo)} OS em lote para pendências: {e}")
+                flash('Ocorreu um erro ao processar a atribuição. Nenhuma OS foi atribuída.', 'danger')
+                return redirect(url_for('painel_manutencao'))
+
+            # Remove as OS dos arquivos de origem dos gerentes (cada arquivo regravado uma vez)
+            arquivos_origem = set().union(*arquivos_por_os.values())
+            removidas = remover_varias_os_de_todos_json(MENSAGENS_DIR, os_alvo, arquivos=arquivos_origem)
+            if removidas:
+                logger.info(f"Atribuição em lote: OS removidas de {', '.join(sorted(removidas))}")
+            atualizar_carga_prestadores(forcar=True)
+            if distribuir:
+                resumo = ', '.join(f'{len(numeros)} para "{nome}"' for nome, numeros in sorted(os_por_prestador.items()))
+                flash(f'{len(os_alvo)} OS distribuída(s) pela carga dos prestadores ({resumo}) e enviada(s) para pendências do Admin.', 'success')
+            else:
+                flash(f'{len(os_alvo)} OS atribuída(s) a "{nome_exibicao_prestador}" e enviada(s) para pendências do Admin.', 'success')
+
+    if nao_encontradas:
+        flash(f'OS não encontradas ou já atribuídas: {", ".join(nao_encontradas)}', 'warning')
+    return redirect(url_for('painel_manutencao'))
+
+@app.route('/blobs/<chave>')
+def servir_blob(chave):
+    """Serve um blob; o conteúdo de uma chave nunca muda, então o cache é imutável e de longa duração."""
+    if not armazem_blobs.existe(chave):
+        return ('', 404)
+    resposta = send_file(armazem_blobs.caminho(chave), max_age=BLOBS_MAX_AGE, conditional=True, etag=chave.split('.')[0])
+    resposta.cache_control.public = True
+    resposta.cache_control.immutable = True
+    return resposta
+
+def _referencias_uploads():
+    """Valores de upload referenciados no banco (fotos de perfil e evidências)."""
+    referencias = set(db.session.scalars(db.select(User.profile_picture).where(User.profile_picture.isnot(None))))
+    for evidencia, miniatura in db.session.execute(db.select(Finalizacao.evidencia, Finalizacao.evidencia_miniatura)
+                                                   .where(Finalizacao.evidencia.isnot(None))):
+        referencias.update((evidencia, miniatura))
+    referencias.discard(None)
+    return referencias
+
+@app.cli.command('gc-blobs')
+@click.option('--simular', is_flag=True, help='Só lista o que seria removido.')
+@click.option('--carencia-horas', default=24, show_default=True, help='Não remove blobs mais novos que isso.')
+def gc_blobs_command(simular, carencia_horas):
+    """Remove do armazém os blobs que nenhuma foto de perfil ou finalização referencia."""
+    referenciados = {r for r in _referencias_uploads() if eh_chave_blob(r)}
+    removidos, tamanho = armazem_blobs.coletar_lixo(referenciados, carencia_horas * 3600, simular=simular)
+    click.echo(f"{'Seriam removidos' if simular else 'Removidos'} {removidos} blob(s), {tamanho / (1024 * 1024):.1f} MB. "
+               f"{len(referenciados)} referenciado(s).")
+
+@app.cli.command('snapshot-os')
+def snapshot_os_command():
+    """Gera o snapshot consolidado das OS a partir dos JSONs atuais (o OS_unificado.py gera a cada carga)."""
+    quantidade = gerar_snapshot_os(SNAPSHOT_OS_FILE, DATA_DIR)
+    click.echo(f"Snapshot com {quantidade} arquivo(s) gravado em {SNAPSHOT_OS_FILE}.")
+
+@app.cli.command('exportar-snapshot-os')
+@click.option('--destino', required=True, type=click.Path(file_okay=False), help='pasta onde recriar os JSONs por usuário')
+def exportar_snapshot_os_command(destino):
+    """Exportação compatível: recria mensagens_por_gerente/, mensagens_por_prestador/ e static/json/ a partir do snapshot."""
+    quantidade = snapshot_os.exportar_json(destino)
+    click.echo(f"{quantidade} arquivo(s) JSON exportados para {destino}.")
+
+@app.cli.command('migrar-uploads')
+def migrar_uploads_command():
+    """Move para o armazém de blobs as fotos de perfil e evidências antigas (nomes com data/hora) referenciadas no banco."""
+    migradas, faltando = 0, 0
+    for usuario in User.query.filter(User.profile_picture.isnot(None)).all():
+        if eh_chave_blob(usuario.profile_picture):
+            continue
+        caminho = os.path.join('static', usuario.profile_picture)
+        if os.path.exists(caminho):
+            usuario.profile_picture = armazem_blobs.gravar_arquivo(caminho, mover=False)
+            migradas += 1
+        else:
+            faltando += 1
+    for finalizacao in Finalizacao.query.filter(Finalizacao.evidencia_status == STATUS_PRONTA).all():
+        for coluna in ('evidencia', 'evidencia_miniatura'):
+            valor = getattr(finalizacao, coluna)
+            if not valor or eh_chave_blob(valor):
+                continue
+            caminho = os.path.join(EVIDENCIAS_DIR, valor)
+            if os.path.exists(caminho):
+                setattr(finalizacao, coluna, armazem_blobs.gravar_arquivo(caminho, mover=False))
+                migradas += 1
+            else:
+                faltando += 1
+    db.session.commit()
+    click.echo(f"{migradas} arquivo(s) copiados para o armazém de blobs; {faltando} referência(s) sem arquivo. "
+               f"Os originais continuam em {UPLOAD_FOLDER} e podem ser apagados depois de conferir.")
+
 # ##########################################################################
 # ROTA PARA A NOVA TELA DE RELATÓRIOS
 # ##########################################################################
+@app.route('/buscar')
+def buscar():
+    if not (session.get('is_admin') or session.get('manutencao')):
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+    consulta = request.args.get('q', '').strip()
+    resultado = None
+    if consulta:
+        atualizar_indice_os()
+        resultado = indice_os.buscar(consulta, origem=request.args.get('origem') or None,
+                                     pagina=request.args.get('pagina', 1, type=int),
+                                     por_pagina=request.args.get('por_pagina', 20, type=int))
+    return render_template('buscar.html', consulta=consulta, origem=request.args.get('origem', ''),
+                           resultado=resultado, now=datetime.now(saopaulo_tz))
+
+@app.route('/api/buscar')
+def api_buscar():
+    if not (session.get('is_admin') or session.get('manutencao')):
+        return jsonify({'erro': 'Acesso negado'}), 403
+    atualizar_indice_os()
+    return jsonify(indice_os.buscar(request.args.get('q', ''), origem=request.args.get('origem') or None,
+                                    pagina=request.args.get('pagina', 1, type=int),
+                                    por_pagina=request.args.get('por_pagina', 20, type=int)))
+
 @app.route('/relatorios')
 def relatorios():
     if not session.get('is_admin'):
@@ -1139,8 +2065,7 @@ def gerar_relatorio():
         return redirect(url_for('relatorios'))
 
     try:
-        with open(json_path, 'r', encoding='utf-8') as f:
-            data = json.load(f)
+        data = ler_json(json_path)
     except Exception as e:
         flash(f"Erro ao ler ou processar o arquivo de dados: {e}", 'danger')
         logger.error(f"Erro ao ler JSON {json_path}: {e}", exc_info=True)
@@ -1165,6 +2090,85 @@ def gerar_relatorio():
 # ##########################################################################
 # FUNÇÃO admin_panel ATUALIZADA
 # ##########################################################################
+def calcular_intervalo_periodo(periodo, data_inicio=None, data_fim=None):
+    """Intervalo (inicio, fim) com fuso de São Paulo para os filtros de período do admin.
+
+    Datas explícitas têm prioridade sobre `periodo` (todos/diario/semanal/mensal/anual).
+    Retorna (None, None, datas_invalidas) quando não há filtro.
+    """
+    from dateutil.parser import parse
+
+    if data_inicio and data_fim:
+        try:
+            inicio = saopaulo_tz.localize(parse(data_inicio).replace(hour=0, minute=0, second=0, microsecond=0))
+            fim = saopaulo_tz.localize(parse(data_fim).replace(hour=23, minute=59, second=59, microsecond=999999))
+            return inicio, fim, False
+        except ValueError:
+            return None, None, True
+
+    inicio, fim = None, None
+    hoje_tz = saopaulo_tz.localize(datetime.now())
+    if periodo == 'diario':
+        inicio = hoje_tz.replace(hour=0, minute=0, second=0, microsecond=0)
+        fim = hoje_tz.replace(hour=23, minute=59, second=59, microsecond=999999)
+    elif periodo == 'semanal':
+        inicio = (hoje_tz - timedelta(days=hoje_tz.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
+        fim = (inicio + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=999999)
+    elif periodo == 'mensal':
+        inicio = hoje_tz.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        if inicio.month == 12:
+            fim = inicio.replace(year=inicio.year + 1, month=1, day=1) - timedelta(microseconds=1)
+        else:
+            fim = inicio.replace(month=inicio.month + 1, day=1) - timedelta(microseconds=1)
+        fim = fim.replace(hour=23, minute=59, second=59, microsecond=999999)
+    elif periodo == 'anual':
+        inicio = hoje_tz.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
+        fim = hoje_tz.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
+    return inicio, fim, False
+
+# --- Análise do backlog (aging das abertas e tempo até o fechamento) ---
+def _os_abertas_para_analise():
+    """(hoje, [(gerente, RegistroOS)]) de todos os JSONs de gerente."""
+    hoje = saopaulo_tz.localize(datetime.now()).date()
+    registros = []
+    for nome_arquivo in sorted(listar_json_os(MENSAGENS_DIR)):
+        caminho = os.path.join(MENSAGENS_DIR, nome_arquivo)
+        try:
+            itens = cache_registros_os.carregar(caminho, hoje)
+        except Exception as e:
+            logger.warning(f"Análise: não foi possível ler {caminho}: {e}")
+            continue
+        gerente = os.path.splitext(nome_arquivo)[0].replace('_', ' ').title()
+        registros.extend((gerente, registro) for registro in itens)
+    return hoje, registros
+
+def _finalizacoes_para_analise():
+    return db.session.execute(db.select(Finalizacao.gerente, Finalizacao.data_fin, Finalizacao.data_abertura)).all()
+
+def _assinaturas_analise():
+    """(JSONs de gerente + dia, finalizações no banco): a análise só é refeita quando uma delas muda."""
+    abertas = [saopaulo_tz.localize(datetime.now()).date()]
+    for nome_arquivo in sorted(listar_json_os(MENSAGENS_DIR)):
+        try:
+            st = os.stat(os.path.join(MENSAGENS_DIR, nome_arquivo))
+        except OSError:
+            continue
+        abertas.append((nome_arquivo, st.st_mtime_ns, st.st_size))
+    fechadas = tuple(db.session.execute(db.select(db.func.count(Finalizacao.id), db.func.max(Finalizacao.id))).one())
+    return tuple(abertas), fechadas
+
+analise_os = AnaliseOS(_os_abertas_para_analise, _finalizacoes_para_analise, PRESTADORES_NAO_DEFINIDOS)
+
+@app.route('/admin/analise_os')
+def admin_analise_os():
+    if not session.get('is_admin'):
+        flash('Acesso negado', 'danger')
+        return redirect(url_for('login'))
+    if not analise_os_disponivel():
+        flash('Análise indisponível: instale pandas e numpy (requirements.txt).', 'warning')
+        return redirect(url_for('admin_panel'))
+    return render_template('analise_os.html', resumo=analise_os.resumo(*_assinaturas_analise()))
+
 @app.route('/admin')
 def admin_panel():
     if not session.get('is_admin'):
@@ -1176,40 +2180,16 @@ def admin_panel():
     data_fim = request.args.get('data_fim')
 
     query_finalizadas = Finalizacao.query.order_by(Finalizacao.registrado_em.desc())
-    
-    inicio_periodo_filtro, fim_periodo_filtro = None, None 
-    if data_inicio and data_fim: 
-        try:
-            inicio_periodo_filtro = saopaulo_tz.localize(parse(data_inicio).replace(hour=0, minute=0, second=0, microsecond=0))
-            fim_periodo_filtro = saopaulo_tz.localize(parse(data_fim).replace(hour=23, minute=59, second=59, microsecond=999999))
-            query_finalizadas = query_finalizadas.filter(Finalizacao.registrado_em.between(inicio_periodo_filtro, fim_periodo_filtro))
-        except ValueError:
-            flash('Datas inválidas para filtro de OS Finalizadas. Usando todas as OS.', 'warning')
-            inicio_periodo_filtro, fim_periodo_filtro = None, None 
-    elif periodo != 'todos':
-        hoje_tz = saopaulo_tz.localize(datetime.now())
-        if periodo == 'diario':
-            inicio_periodo_filtro = hoje_tz.replace(hour=0, minute=0, second=0, microsecond=0)
-            fim_periodo_filtro = hoje_tz.replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo == 'semanal':
-            inicio_periodo_filtro = (hoje_tz - timedelta(days=hoje_tz.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
-            fim_periodo_filtro = (inicio_periodo_filtro + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo == 'mensal':
-            inicio_periodo_filtro = hoje_tz.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            if inicio_periodo_filtro.month == 12:
-                fim_periodo_filtro = inicio_periodo_filtro.replace(year=inicio_periodo_filtro.year + 1, month=1, day=1) - timedelta(microseconds=1)
-            else:
-                fim_periodo_filtro = inicio_periodo_filtro.replace(month=inicio_periodo_filtro.month + 1, day=1) - timedelta(microseconds=1)
-            fim_periodo_filtro = fim_periodo_filtro.replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo == 'anual':
-            inicio_periodo_filtro = hoje_tz.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            fim_periodo_filtro = hoje_tz.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
-        
-        if not (inicio_periodo_filtro and fim_periodo_filtro): 
-            inicio_periodo_filtro, fim_periodo_filtro = None, None 
-        else:
-            query_finalizadas = query_finalizadas.filter(Finalizacao.registrado_em.between(inicio_periodo_filtro, fim_periodo_filtro))
-    
+
+    inicio_periodo_filtro, fim_periodo_filtro, datas_invalidas = calcular_intervalo_periodo(periodo, data_inicio, data_fim)
+    if datas_invalidas:
+        flash('Datas inválidas para filtro de OS Finalizadas. Usando todas as OS.', 'warning')
+    if inicio_periodo_filtro and fim_periodo_filtro:
+        query_finalizadas = query_finalizadas.filter(Finalizacao.registrado_em.between(inicio_periodo_filtro, fim_periodo_filtro))
+    filtro_pimns = request.args.get('pimns', '')
+    if filtro_pimns == 'pendente':
+        query_finalizadas = query_finalizadas.filter(Finalizacao.status_pimns.is_(False))
+
     total_os = query_finalizadas.count() 
     finalizadas = query_finalizadas.limit(100).all() 
     
@@ -1298,52 +2278,101 @@ def admin_panel():
                          periodo=periodo, 
                          data_inicio=data_inicio, 
                          data_fim=data_fim,
+                         filtro_pimns=filtro_pimns,
                          os_pendentes_todas=os_pendentes_todas
                          )
 # ##########################################################################
 # FIM DA FUNÇÃO admin_panel ATUALIZADA
 # ##########################################################################
 
+# --- Exportação em massa (CSV/XLSX em streaming) ---
+CONJUNTOS_EXPORTACAO = ('finalizadas', 'pendentes', 'frota_leve')
+EXPORTACAO_YIELD_PER = 1000  # linhas buscadas do banco por vez
+
+def _linhas_exportacao(conjunto, inicio, fim):
+    """(título, cabeçalho, consulta) de cada conjunto exportável; a consulta é lida com yield_per."""
+    if conjunto == 'finalizadas':
+        consulta = db.select(Finalizacao.os_numero, Finalizacao.gerente, Finalizacao.data_fin, Finalizacao.hora_fin,
+                             Finalizacao.observacoes, Finalizacao.registrado_em, Finalizacao.status_pimns
+                             ).order_by(Finalizacao.registrado_em.desc())
+        if inicio and fim:
+            consulta = consulta.where(Finalizacao.registrado_em.between(inicio, fim))
+        cabecalho = ['OS', 'Responsável', 'Data Fin.', 'Hora Fin.', 'Observações', 'Registrado Em', 'PIMNS']
+        return 'OS Finalizadas', cabecalho, consulta
+    if conjunto == 'pendentes':
+        consulta = db.select(OSPendente.os_numero, OSPendente.frota, OSPendente.servico, OSPendente.status_motivo,
+                             OSPendente.status_definido_por, OSPendente.status_data).order_by(OSPendente.os_numero)
+        cabecalho = ['OS', 'Frota', 'Serviço', 'Motivo', 'Definido por', 'Data']
+        return 'OS Pendentes', cabecalho, consulta
+    consulta = db.select(FrotaLeve.placa, FrotaLeve.veiculo, FrotaLeve.motorista, FrotaLeve.oficina, FrotaLeve.servico,
+                         FrotaLeve.situacao, FrotaLeve.entrada, FrotaLeve.saida, FrotaLeve.valor_mo, FrotaLeve.valor_pecas,
+                         FrotaLeve.aprovado_por, FrotaLeve.fechado_com, FrotaLeve.obs).order_by(FrotaLeve.id.desc())
+    if inicio and fim:
+        # entrada é texto 'AAAA-MM-DD' (input date)
+        consulta = consulta.where(FrotaLeve.entrada.between(inicio.strftime('%Y-%m-%d'), fim.strftime('%Y-%m-%d')))
+    cabecalho = ['Placa', 'Veículo', 'Motorista', 'Oficina', 'Serviço', 'Situação', 'Entrada', 'Saída',
+                 'Valor M.O', 'Valor Peças', 'Aprovado por', 'Fechado com', 'Observações']
+    return 'Frota Leve', cabecalho, consulta
+
+@app.route('/exportar/<conjunto>')
+def exportar_em_massa(conjunto):
+    if not session.get('is_admin'):
+        flash('Acesso negado', 'danger')
+        return redirect(url_for('login'))
+    if conjunto not in CONJUNTOS_EXPORTACAO:
+        flash('Exportação desconhecida.', 'warning')
+        return redirect(url_for('relatorios'))
+
+    formato = 'xlsx' if request.args.get('formato') == 'xlsx' else 'csv'
+    if formato == 'xlsx':
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            flash('Exportação XLSX indisponível (openpyxl não instalado). Use CSV.', 'warning')
+            return redirect(url_for('relatorios'))
+
+    inicio, fim, datas_invalidas = calcular_intervalo_periodo(
+        request.args.get('periodo', 'todos'), request.args.get('data_inicio'), request.args.get('data_fim'))
+    if datas_invalidas:
+        flash('Datas inválidas para exportação.', 'warning')
+        return redirect(url_for('relatorios'))
+
+    titulo, cabecalho, consulta = _linhas_exportacao(conjunto, inicio, fim)
+
+    def linhas():
+        with medir(f'exportar_{conjunto}_{formato}'):
+            for linha in db.session.execute(consulta.execution_options(yield_per=EXPORTACAO_YIELD_PER)):
+                yield tuple(linha)
+
+    nome_arquivo = f"{conjunto}_{datetime.now(saopaulo_tz).strftime('%Y%m%d_%H%M%S')}.{formato}"
+    logger.info(f"Exportação {nome_arquivo} iniciada por {session.get('gerente')}.")
+    return app.response_class(
+        stream_with_context(gerar_exportacao(formato, cabecalho, linhas(), titulo)),
+        mimetype=MIMETYPES_EXPORTACAO[formato],
+        headers={'Content-Disposition': f'attachment; filename={nome_arquivo}'},
+    )
+
 @app.route('/exportar_os_finalizadas')
 def exportar_os_finalizadas():
     if not session.get('is_admin'):
         flash('Acesso negado', 'danger')
         return redirect(url_for('login'))
 
+    from dateutil.parser import parse
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfgen import canvas
+
     periodo_export = request.args.get('periodo', 'todos')
     data_inicio_export_str = request.args.get('data_inicio')
     data_fim_export_str = request.args.get('data_fim')
 
     query_export = Finalizacao.query.order_by(Finalizacao.registrado_em.desc())
 
-    inicio_export, fim_export = None, None 
-    if data_inicio_export_str and data_fim_export_str:
-        try:
-            inicio_export = saopaulo_tz.localize(parse(data_inicio_export_str).replace(hour=0, minute=0, second=0, microsecond=0))
-            fim_export = saopaulo_tz.localize(parse(data_fim_export_str).replace(hour=23, minute=59, second=59, microsecond=999999))
-            query_export = query_export.filter(Finalizacao.registrado_em.between(inicio_export, fim_export))
-        except ValueError:
-            flash('Datas inválidas para exportação. Exportando todas as OS.', 'warning')
-            inicio_export, fim_export = None, None
-    elif periodo_export != 'todos':
-        hoje_tz_export = saopaulo_tz.localize(datetime.now())
-        if periodo_export == 'diario':
-            inicio_export = hoje_tz_export.replace(hour=0, minute=0, second=0, microsecond=0)
-            fim_export = hoje_tz_export.replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo_export == 'semanal':
-            inicio_export = (hoje_tz_export - timedelta(days=hoje_tz_export.weekday())).replace(hour=0, minute=0, second=0, microsecond=0)
-            fim_export = (inicio_export + timedelta(days=6)).replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo_export == 'mensal':
-            inicio_export = hoje_tz_export.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
-            if inicio_export.month == 12: fim_export = inicio_export.replace(year=inicio_export.year + 1, month=1, day=1) - timedelta(microseconds=1)
-            else: fim_export = inicio_export.replace(month=inicio_export.month + 1, day=1) - timedelta(microseconds=1)
-            fim_export = fim_export.replace(hour=23, minute=59, second=59, microsecond=999999)
-        elif periodo_export == 'anual':
-            inicio_export = hoje_tz_export.replace(month=1, day=1, hour=0, minute=0, second=0, microsecond=0)
-            fim_export = hoje_tz_export.replace(month=12, day=31, hour=23, minute=59, second=59, microsecond=999999)
-        
-        if not (inicio_export and fim_export): inicio_export, fim_export = None, None
-        else: query_export = query_export.filter(Finalizacao.registrado_em.between(inicio_export, fim_export))
+    inicio_export, fim_export, datas_invalidas = calcular_intervalo_periodo(periodo_export, data_inicio_export_str, data_fim_export_str)
+    if datas_invalidas:
+        flash('Datas inválidas para exportação. Exportando todas as OS.', 'warning')
+    if inicio_export and fim_export:
+        query_export = query_export.filter(Finalizacao.registrado_em.between(inicio_export, fim_export))
 
     lista_finalizadas_para_export = query_export.all()
     if not lista_finalizadas_para_export:
@@ -1353,78 +2382,79 @@ def exportar_os_finalizadas():
     nome_arquivo_pdf = f'relatorio_os_finalizadas_{datetime.now(saopaulo_tz).strftime("%Y%m%d_%H%M%S")}.pdf'
     caminho_pdf_salvo = os.path.join(BASE_DIR, nome_arquivo_pdf)
     
-    canvas_pdf = canvas.Canvas(caminho_pdf_salvo, pagesize=A4)
-    largura_a4, altura_a4 = A4
-
-    titulo_relatorio_periodo = periodo_export.capitalize()
-    if data_inicio_export_str and data_fim_export_str: 
-        try: titulo_relatorio_periodo = f"{parse(data_inicio_export_str).strftime('%d/%m/%Y')} a {parse(data_fim_export_str).strftime('%d/%m/%Y')}"
-        except ValueError: titulo_relatorio_periodo = "Período Personalizado"
-    elif inicio_export and fim_export: 
-        titulo_relatorio_periodo = f"{inicio_export.strftime('%d/%m/%Y')} a {fim_export.strftime('%d/%m/%Y')}"
+    with medir('pdf_os_finalizadas'):
+        canvas_pdf = canvas.Canvas(caminho_pdf_salvo, pagesize=A4)
+        largura_a4, altura_a4 = A4
+
+        titulo_relatorio_periodo = periodo_export.capitalize()
+        if data_inicio_export_str and data_fim_export_str: 
+            try: titulo_relatorio_periodo = f"{parse(data_inicio_export_str).strftime('%d/%m/%Y')} a {parse(data_fim_export_str).strftime('%d/%m/%Y')}"
+            except ValueError: titulo_relatorio_periodo = "Período Personalizado"
+        elif inicio_export and fim_export: 
+            titulo_relatorio_periodo = f"{inicio_export.strftime('%d/%m/%Y')} a {fim_export.strftime('%d/%m/%Y')}"
     
-    num_pagina_atual = 1
-    def desenhar_cabecalho_rodape_pdf(canv, num_pag):
-        canv.setFont("Helvetica-Bold", 14)
-        canv.drawCentredString(largura_a4 / 2, altura_a4 - 50, f"Relatório de OS Finalizadas ({titulo_relatorio_periodo})")
-        canv.setFont("Helvetica", 8)
-        canv.drawRightString(largura_a4 - 40, 30, f"Página {num_pag}")
-        canv.drawString(40, 30, f"Exportado em: {datetime.now(saopaulo_tz).strftime('%d/%m/%Y %H:%M:%S')}")
-
-    desenhar_cabecalho_rodape_pdf(canvas_pdf, str(num_pagina_atual))
-    pos_y_linha = altura_a4 - 85
+        num_pagina_atual = 1
+        def desenhar_cabecalho_rodape_pdf(canv, num_pag):
+            canv.setFont("Helvetica-Bold", 14)
+            canv.drawCentredString(largura_a4 / 2, altura_a4 - 50, f"Relatório de OS Finalizadas ({titulo_relatorio_periodo})")
+            canv.setFont("Helvetica", 8)
+            canv.drawRightString(largura_a4 - 40, 30, f"Página {num_pag}")
+            canv.drawString(40, 30, f"Exportado em: {datetime.now(saopaulo_tz).strftime('%d/%m/%Y %H:%M:%S')}")
+
+        desenhar_cabecalho_rodape_pdf(canvas_pdf, str(num_pagina_atual))
+        pos_y_linha = altura_a4 - 85
     
-    canvas_pdf.setFont("Helvetica-Bold", 9)
-    detalhes_colunas_pdf = [('OS', 50), ('Responsável', 100), ('Data Fin.', 60), ('Hora Fin.', 50), ('Observações', 180), ('Registrado Em', 110)]
-    pos_x_col = 40
-    for nome_col, largura_col in detalhes_colunas_pdf:
-        canvas_pdf.drawString(pos_x_col, pos_y_linha, nome_col)
-        pos_x_col += largura_col
-    pos_y_linha -= 6
-    canvas_pdf.line(35, pos_y_linha, largura_a4 - 35, pos_y_linha)
-    pos_y_linha -= 10
-    canvas_pdf.setFont("Helvetica", 8)
-
-    for os_finalizada_item in lista_finalizadas_para_export:
-        if pos_y_linha < 60: 
-            canvas_pdf.showPage()
-            num_pagina_atual += 1
-            desenhar_cabecalho_rodape_pdf(canvas_pdf, str(num_pagina_atual))
-            pos_y_linha = altura_a4 - 85 
-            canvas_pdf.setFont("Helvetica-Bold", 9)
-            pos_x_cabecalho_nova_pag = 40
-            for nome_col_h, largura_col_h in detalhes_colunas_pdf:
-                canvas_pdf.drawString(pos_x_cabecalho_nova_pag, pos_y_linha, nome_col_h)
-                pos_x_cabecalho_nova_pag += largura_col_h
-            pos_y_linha -= 6
-            canvas_pdf.line(35, pos_y_linha, largura_a4 - 35, pos_y_linha)
-            pos_y_linha -= 10
-            canvas_pdf.setFont("Helvetica", 8)
-
-        pos_x_atual_dado = 40
-        texto_obs_pdf = (os_finalizada_item.observacoes or '')
-        linhas_obs_pdf = [texto_obs_pdf[i:i+45] for i in range(0, len(texto_obs_pdf), 45)] 
+        canvas_pdf.setFont("Helvetica-Bold", 9)
+        detalhes_colunas_pdf = [('OS', 50), ('Responsável', 100), ('Data Fin.', 60), ('Hora Fin.', 50), ('Observações', 180), ('Registrado Em', 110)]
+        pos_x_col = 40
+        for nome_col, largura_col in detalhes_colunas_pdf:
+            canvas_pdf.drawString(pos_x_col, pos_y_linha, nome_col)
+            pos_x_col += largura_col
+        pos_y_linha -= 6
+        canvas_pdf.line(35, pos_y_linha, largura_a4 - 35, pos_y_linha)
+        pos_y_linha -= 10
+        canvas_pdf.setFont("Helvetica", 8)
+
+        for os_finalizada_item in lista_finalizadas_para_export:
+            if pos_y_linha < 60: 
+                canvas_pdf.showPage()
+                num_pagina_atual += 1
+                desenhar_cabecalho_rodape_pdf(canvas_pdf, str(num_pagina_atual))
+                pos_y_linha = altura_a4 - 85 
+                canvas_pdf.setFont("Helvetica-Bold", 9)
+                pos_x_cabecalho_nova_pag = 40
+                for nome_col_h, largura_col_h in detalhes_colunas_pdf:
+                    canvas_pdf.drawString(pos_x_cabecalho_nova_pag, pos_y_linha, nome_col_h)
+                    pos_x_cabecalho_nova_pag += largura_col_h
+                pos_y_linha -= 6
+                canvas_pdf.line(35, pos_y_linha, largura_a4 - 35, pos_y_linha)
+                pos_y_linha -= 10
+                canvas_pdf.setFont("Helvetica", 8)
+
+            pos_x_atual_dado = 40
+            texto_obs_pdf = (os_finalizada_item.observacoes or '')
+            linhas_obs_pdf = [texto_obs_pdf[i:i+45] for i in range(0, len(texto_obs_pdf), 45)] 
         
-        dados_linha_pdf = [
-            str(os_finalizada_item.os_numero), str(os_finalizada_item.gerente), str(os_finalizada_item.data_fin), str(os_finalizada_item.hora_fin),
-            linhas_obs_pdf[0] if linhas_obs_pdf else '', 
-            format_datetime(os_finalizada_item.registrado_em) if os_finalizada_item.registrado_em else "N/A"
-        ]
+            dados_linha_pdf = [
+                str(os_finalizada_item.os_numero), str(os_finalizada_item.gerente), str(os_finalizada_item.data_fin), str(os_finalizada_item.hora_fin),
+                linhas_obs_pdf[0] if linhas_obs_pdf else '', 
+                format_datetime(os_finalizada_item.registrado_em) if os_finalizada_item.registrado_em else "N/A"
+            ]
         
-        altura_linha_pdf = 12 + ((len(linhas_obs_pdf) - 1) * 9 if len(linhas_obs_pdf) > 1 else 0)
-        pos_y_temp_pdf = pos_y_linha
-        for idx_dado, (_, largura_col_dado) in enumerate(detalhes_colunas_pdf):
-            if detalhes_colunas_pdf[idx_dado][0] == 'Observações':
-                offset_y_obs = 0
-                for linha_obs_item in linhas_obs_pdf:
-                    canvas_pdf.drawString(pos_x_atual_dado, pos_y_temp_pdf - offset_y_obs, linha_obs_item)
-                    offset_y_obs += 9
-            else:
-                 canvas_pdf.drawString(pos_x_atual_dado, pos_y_temp_pdf, dados_linha_pdf[idx_dado])
-            pos_x_atual_dado += largura_col_dado
-        pos_y_linha -= altura_linha_pdf
+            altura_linha_pdf = 12 + ((len(linhas_obs_pdf) - 1) * 9 if len(linhas_obs_pdf) > 1 else 0)
+            pos_y_temp_pdf = pos_y_linha
+            for idx_dado, (_, largura_col_dado) in enumerate(detalhes_colunas_pdf):
+                if detalhes_colunas_pdf[idx_dado][0] == 'Observações':
+                    offset_y_obs = 0
+                    for linha_obs_item in linhas_obs_pdf:
+                        canvas_pdf.drawString(pos_x_atual_dado, pos_y_temp_pdf - offset_y_obs, linha_obs_item)
+                        offset_y_obs += 9
+                else:
+                     canvas_pdf.drawString(pos_x_atual_dado, pos_y_temp_pdf, dados_linha_pdf[idx_dado])
+                pos_x_atual_dado += largura_col_dado
+            pos_y_linha -= altura_linha_pdf
             
-    canvas_pdf.save()
+        canvas_pdf.save()
     try:
         return send_file(caminho_pdf_salvo, as_attachment=True, download_name=nome_arquivo_pdf, mimetype='application/pdf')
     finally:
@@ -1437,6 +2467,9 @@ def exportar_os_finalizadas():
 # ##########################################################################
 def create_pdf_styles():
     """Cria e retorna os estilos de parágrafo para o PDF."""
+    from reportlab.lib import colors
+    from reportlab.lib.styles import getSampleStyleSheet, ParagraphStyle
+
     styles = getSampleStyleSheet()
     title_style = ParagraphStyle(
         'TitleCustom',
@@ -1472,6 +2505,7 @@ def create_pdf_styles():
     )
     return title_style, subtitle_style, header_style, cell_style
 
+@cronometrar('pdf_os_abertas')
 def gerar_relatorio_os_abertas_compacto(data, report_title, output_path):
     """
     Gera o relatório em PDF de forma compacta e organizada.
@@ -1480,6 +2514,11 @@ def gerar_relatorio_os_abertas_compacto(data, report_title, output_path):
         logger.warning(f"Tentativa de gerar relatório para '{report_title}' sem dados.")
         return None
 
+    from reportlab.lib import colors
+    from reportlab.lib.pagesizes import A4, landscape
+    from reportlab.lib.units import cm
+    from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle, Spacer
+
     doc = SimpleDocTemplate(
         output_path,
         pagesize=landscape(A4),
@@ -1600,11 +2639,42 @@ def logout():
     flash(f'{nome_exibicao_logout} desconectado(a) com sucesso.', 'info')
     return redirect(url_for('login'))
 
-with app.app_context():
+@app.cli.command('init-db')
+def init_db_command():
+    """Cria/migra as tabelas e sincroniza o users.json. Rodar uma vez por deploy: `flask --app app init-db`."""
+    init_db()
+
+@app.cli.command('sincronizar-usuarios')
+@click.option('--forcar', is_flag=True, help='Sincroniza mesmo que o hash do users.json não tenha mudado.')
+def sincronizar_usuarios_command(forcar):
+    """Aplica alterações do users.json sem reiniciar: `flask --app app sincronizar-usuarios`."""
+    resultado = sincronizar_usuarios(forcar=forcar)
+    click.echo(f"Inseridos: {resultado['inseridos']}, atualizados: {resultado['atualizados']}"
+               f"{' (sem alterações)' if resultado['pulado'] else ''}")
+
+@app.route('/admin/sincronizar_usuarios', methods=['POST'])
+def admin_sincronizar_usuarios():
+    if not session.get('is_admin'):
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+    try:
+        resultado = sincronizar_usuarios(forcar=request.form.get('forcar') == '1')
+        if resultado['pulado']:
+            flash('users.json sem alterações desde a última sincronização.', 'info')
+        else:
+            flash(f"Usuários sincronizados: {resultado['inseridos']} novos, {resultado['atualizados']} atualizados.", 'success')
+    except Exception as e:
+        logger.error(f"Erro ao sincronizar usuários pelo painel: {e}", exc_info=True)
+        flash('Erro ao sincronizar usuários.', 'danger')
+    return redirect(url_for('admin_panel'))
+
+# O init_db não roda mais no import (cada worker do gunicorn repetia o create_all e a sincronização).
+# INIT_DB_AO_IMPORTAR=1 restaura o comportamento antigo para ambientes sem etapa de release.
+if os.environ.get('INIT_DB_AO_IMPORTAR') == '1':
     init_db()
 
 # === ROTAS FROTA LEVE ===
-FROTA_LEVE_FILE = os.path.join(BASE_DIR, 'frota_leve.json')
+FROTA_LEVE_FILE = os.path.join(DATA_DIR, 'frota_leve.json')
 
 @app.route('/frota-leve')
 def frota_leve():
@@ -1627,18 +2697,15 @@ def frota_leve():
         query = query.filter(FrotaLeve.entrada <= data_fim)
 
     if search_query:
-        query = query.filter(
-            (FrotaLeve.placa.ilike(f'%{search_query}%')) |
-            (FrotaLeve.veiculo.ilike(f'%{search_query}%')) |
-            (FrotaLeve.motorista.ilike(f'%{search_query}%')) |
-            (FrotaLeve.oficina.ilike(f'%{search_query}%')) |
-            (FrotaLeve.servico.ilike(f'%{search_query}%'))
-        )
+        query = filtrar_busca_frota_leve(query, search_query)
 
-    manutencoes = query.order_by(FrotaLeve.id.desc()).all()
+    pagina = request.args.get('pagina', 1, type=int)
+    por_pagina = min(request.args.get('por_pagina', 50, type=int), 200)
+    paginacao = query.order_by(FrotaLeve.id.desc()).paginate(page=pagina, per_page=por_pagina, error_out=False)
 
     return render_template('frota_leve.html',
-                           manutencoes=manutencoes,
+                           manutencoes=paginacao.items,
+                           paginacao=paginacao,
                            filtro_atual=filtro,
                            search_query=search_query,
                            data_inicio=data_inicio,
@@ -1660,8 +2727,8 @@ def nova_manutencao_frota_leve():
             situacao=request.form['situacao'],
             entrada=request.form['entrada'],
             saida=request.form['saida'],
-            valor_mo=request.form['valor_mo'],
-            valor_pecas=request.form['valor_pecas'],
+            valor_mo=parse_valor_brl(request.form['valor_mo']),
+            valor_pecas=parse_valor_brl(request.form['valor_pecas']),
             aprovado_por=request.form['aprovado_por'],
             cotacao1=request.form.get('cotacao1', ''),
             cotacao2=request.form.get('cotacao2', ''),
@@ -1693,8 +2760,8 @@ def editar_manutencao_frota_leve(id):
         manutencao.situacao = request.form['situacao']
         manutencao.entrada = request.form['entrada']
         manutencao.saida = request.form['saida']
-        manutencao.valor_mo = request.form['valor_mo']
-        manutencao.valor_pecas = request.form['valor_pecas']
+        manutencao.valor_mo = parse_valor_brl(request.form['valor_mo'])
+        manutencao.valor_pecas = parse_valor_brl(request.form['valor_pecas'])
         manutencao.aprovado_por = request.form['aprovado_por']
         manutencao.cotacao1 = request.form.get('cotacao1', '')
         manutencao.cotacao2 = request.form.get('cotacao2', '')
@@ -1720,24 +2787,160 @@ def apagar_manutencao_frota_leve(id):
     flash("Manutenção apagada com sucesso!", "success")
     return redirect(url_for("frota_leve"))
 
-@app.route("/frota-leve/finalizar/<int:index>", methods=["POST"])
-def finalizar_manutencao_frota_leve(index):
+@app.route("/frota-leve/finalizar/<int:id>", methods=["POST"])
+def finalizar_manutencao_frota_leve(id):
     if not session.get("is_admin"):
         return redirect("/login")
 
-    with open(FROTA_LEVE_FILE, "r", encoding="utf-8") as f:
-        dados = json.load(f)
+    # Um único UPDATE pela chave primária (antes: regravação do frota_leve.json inteiro por índice da lista)
+    complemento_obs = "\nFinalização: " + request.form.get("obs_fim", "")
+    atualizados = FrotaLeve.query.filter_by(id=id).update({
+        FrotaLeve.situacao: "Finalizado",
+        FrotaLeve.saida: request.form["data_fim"],
+        FrotaLeve.hora_fim: request.form["hora_fim"],
+        FrotaLeve.obs: db.func.coalesce(FrotaLeve.obs, "") + complemento_obs,
+    }, synchronize_session=False)
+    db.session.commit()
+    if not atualizados:
+        flash("Manutenção não encontrada.", "warning")
+    else:
+        flash("Manutenção finalizada com sucesso!", "success")
+    return redirect(url_for("frota_leve"))
 
-    if 0 <= index < len(dados):
-        dados[index]["situacao"] = "Finalizado"
-        dados[index]["saida"] = request.form["data_fim"]
-        dados[index]["hora_fim"] = request.form["hora_fim"]
-        dados[index]["obs"] += "\nFinalização: " + request.form.get("obs_fim", "")
+@app.cli.command('importar-frota-leve')
+@click.option('--arquivo', default=None, help='JSON de origem (padrão: frota_leve.json do diretório de dados).')
+def importar_frota_leve_command(arquivo):
+    """Importa uma única vez o frota_leve.json legado para a tabela frota_leve (ignora registros já existentes)."""
+    arquivo = arquivo or FROTA_LEVE_FILE
+    if not os.path.exists(arquivo):
+        click.echo(f"Arquivo {arquivo} não encontrado.")
+        return
+    registros = ler_json(arquivo)
+    colunas = {c.name for c in FrotaLeve.__table__.columns} - {'id'}
+    existentes = {
+        (linha.placa, linha.entrada, linha.servico)
+        for linha in db.session.execute(db.select(FrotaLeve.placa, FrotaLeve.entrada, FrotaLeve.servico))
+    }
+    linhas = []
+    for registro in registros:
+        linha = {coluna: registro.get(coluna) for coluna in colunas}
+        linha['email_fiscal_enviado'] = bool(linha.get('email_fiscal_enviado'))
+        linha['valor_mo'] = parse_valor_brl(linha.get('valor_mo'))
+        linha['valor_pecas'] = parse_valor_brl(linha.get('valor_pecas'))
+        chave = (linha.get('placa'), linha.get('entrada'), linha.get('servico'))
+        if chave in existentes:
+            continue
+        existentes.add(chave)
+        linhas.append(linha)
+    if linhas:
+        db.session.execute(FrotaLeve.__table__.insert(), linhas)
+        db.session.commit()
+    click.echo(f"{len(linhas)} manutenção(ões) importada(s); {len(registros) - len(linhas)} já existiam.")
+
+AGRUPAMENTOS_GASTOS_FROTA_LEVE = {
+    'veiculo': ('Veículo', lambda: [FrotaLeve.placa, FrotaLeve.veiculo]),
+    'oficina': ('Oficina', lambda: [FrotaLeve.oficina]),
+    'mes': ('Mês', lambda: [db.func.substr(FrotaLeve.entrada, 1, 7)]),
+}
+
+def consultar_gastos_frota_leve(agrupamento, data_inicio='', data_fim=''):
+    """Totais de mão de obra e peças agrupados no banco (GROUP BY) por veículo, oficina ou mês de entrada."""
+    colunas = AGRUPAMENTOS_GASTOS_FROTA_LEVE[agrupamento][1]()
+    total_mo = db.func.coalesce(db.func.sum(FrotaLeve.valor_mo), 0)
+    total_pecas = db.func.coalesce(db.func.sum(FrotaLeve.valor_pecas), 0)
+    consulta = db.select(*colunas, db.func.count(FrotaLeve.id), total_mo, total_pecas).group_by(*colunas)
+    if data_inicio:
+        consulta = consulta.where(FrotaLeve.entrada >= data_inicio)
+    if data_fim:
+        consulta = consulta.where(FrotaLeve.entrada <= data_fim)
+    consulta = consulta.order_by((total_mo + total_pecas).desc())
+
+    linhas = []
+    for linha in db.session.execute(consulta):
+        *chave, quantidade, mo, pecas = linha
+        mo, pecas = Decimal(mo or 0), Decimal(pecas or 0)
+        linhas.append({
+            'grupo': ' — '.join(str(c) for c in chave if c) or 'Não informado',
+            'quantidade': quantidade,
+            'valor_mo': mo,
+            'valor_pecas': pecas,
+            'total': mo + pecas,
+        })
+    return linhas
 
-        with open(FROTA_LEVE_FILE, "w", encoding="utf-8") as f:
-            json.dump(dados, f, ensure_ascii=False, indent=4)
+@app.route('/frota-leve/gastos')
+def gastos_frota_leve():
+    if not session.get('is_admin'):
+        return redirect('/login')
 
-    return redirect("/frota-leve")
+    agrupamento = request.args.get('agrupamento', 'veiculo')
+    if agrupamento not in AGRUPAMENTOS_GASTOS_FROTA_LEVE:
+        agrupamento = 'veiculo'
+    data_inicio = request.args.get('data_inicio', '')
+    data_fim = request.args.get('data_fim', '')
+    formato = request.args.get('formato', 'html')
+    rotulo = AGRUPAMENTOS_GASTOS_FROTA_LEVE[agrupamento][0]
+    linhas = consultar_gastos_frota_leve(agrupamento, data_inicio, data_fim)
+    totais = {
+        'quantidade': sum(l['quantidade'] for l in linhas),
+        'valor_mo': sum((l['valor_mo'] for l in linhas), Decimal('0')),
+        'valor_pecas': sum((l['valor_pecas'] for l in linhas), Decimal('0')),
+        'total': sum((l['total'] for l in linhas), Decimal('0')),
+    }
+    nome_base = f"gastos_frota_leve_{agrupamento}_{datetime.now(saopaulo_tz).strftime('%Y%m%d_%H%M%S')}"
+
+    if formato == 'csv':
+        import csv
+        import io
+        saida = io.StringIO()
+        escritor = csv.writer(saida, delimiter=';')
+        escritor.writerow([rotulo, 'Manutenções', 'Mão de obra', 'Peças', 'Total'])
+        for l in linhas + [dict(totais, grupo='TOTAL')]:
+            escritor.writerow([neutralizar_formula(l['grupo']), l['quantidade'], f"{l['valor_mo']:.2f}".replace('.', ','),
+                               f"{l['valor_pecas']:.2f}".replace('.', ','), f"{l['total']:.2f}".replace('.', ',')])
+        return app.response_class('\ufeff' + saida.getvalue(), mimetype='text/csv',
+                                  headers={'Content-Disposition': f'attachment; filename={nome_base}.csv'})
+
+    if formato == 'pdf':
+        import io
+        from reportlab.lib import colors
+        from reportlab.lib.pagesizes import A4
+        from reportlab.lib.units import cm
+        from reportlab.platypus import Paragraph, SimpleDocTemplate, Table, TableStyle, Spacer
+        from xml.sax.saxutils import escape  # Paragraph interpreta marcação: placa/oficina/datas vêm do usuário
+
+        with medir('pdf_gastos_frota_leve'):
+            buffer_pdf = io.BytesIO()
+            doc = SimpleDocTemplate(buffer_pdf, pagesize=A4, rightMargin=1*cm, leftMargin=1*cm, topMargin=1*cm, bottomMargin=1.5*cm)
+            title_style, subtitle_style, header_style, cell_style = create_pdf_styles()
+            periodo = escape(f"{data_inicio or 'início'} a {data_fim or 'hoje'}")
+            elements = [
+                Paragraph(f"Gastos da Frota Leve por {escape(rotulo)}", title_style),
+                Paragraph(f"Período: {periodo} • Gerado em {datetime.now(saopaulo_tz).strftime('%d/%m/%Y %H:%M')}", subtitle_style),
+                Spacer(1, 6),
+            ]
+            rows = [[Paragraph(escape(h), header_style) for h in (rotulo, 'Manutenções', 'Mão de obra', 'Peças', 'Total')]]
+            for l in linhas + [dict(totais, grupo=None)]:
+                grupo = '<b>TOTAL</b>' if l['grupo'] is None else escape(l['grupo'])
+                rows.append([Paragraph(grupo, cell_style), Paragraph(str(l['quantidade']), cell_style),
+                             Paragraph(escape(moeda_brl(l['valor_mo'])), cell_style), Paragraph(escape(moeda_brl(l['valor_pecas'])), cell_style),
+                             Paragraph(escape(moeda_brl(l['total'])), cell_style)])
+            table = Table(rows, colWidths=[7*cm, 2.5*cm, 3.2*cm, 3.2*cm, 3.1*cm], repeatRows=1)
+            table.setStyle(TableStyle([
+                ("BACKGROUND", (0, 0), (-1, 0), colors.HexColor("#0F172A")),
+                ("VALIGN", (0, 0), (-1, -1), "TOP"),
+                ("GRID", (0, 0), (-1, -1), 0.25, colors.HexColor("#E5E7EB")),
+                ("BACKGROUND", (0, -1), (-1, -1), colors.HexColor("#F8FAFC")),
+                ("PADDING", (0, 0), (-1, -1), 4),
+            ]))
+            elements.append(table)
+            doc.build(elements)
+            buffer_pdf.seek(0)
+        return send_file(buffer_pdf, as_attachment=True, download_name=f'{nome_base}.pdf', mimetype='application/pdf')
+
+    return render_template('frota_leve_gastos.html', linhas=linhas, totais=totais, rotulo=rotulo,
+                           agrupamento=agrupamento, agrupamentos=AGRUPAMENTOS_GASTOS_FROTA_LEVE,
+                           data_inicio=data_inicio, data_fim=data_fim, now=datetime.now(saopaulo_tz))
 
 @app.route("/frota-leve/marcar-email/<int:id>", methods=["POST"])
 def marcar_email_fiscal(id):
@@ -1766,9 +2969,166 @@ def update_pimns_status(os_id):
 
     return redirect(url_for("admin_panel"))
 
+TAMANHO_LOTE_PIMNS = 500  # limite de parâmetros por IN (SQLite aceita ~999)
+
+def _numeros_os_informados(texto, arquivo_csv):
+    """Números de OS colados (separados por espaço, vírgula, ';' ou linha) ou vindos de um CSV exportado do PIMS."""
+    numeros = re.findall(r'\d+', texto or '')
+    if arquivo_csv and arquivo_csv.filename:
+        import csv
+        import io
+        conteudo = arquivo_csv.stream.read().decode('utf-8-sig', errors='replace')
+        leitor = csv.reader(io.StringIO(conteudo), delimiter=';' if conteudo.count(';') > conteudo.count(',') else ',')
+        linhas = list(leitor)
+        indice_coluna = 0
+        if linhas:
+            cabecalho = [c.strip().lower() for c in linhas[0]]
+            for nome in ('os', 'os_numero', 'numero', 'número', 'nº os', 'ordem de serviço'):
+                if nome in cabecalho:
+                    indice_coluna = cabecalho.index(nome)
+                    linhas = linhas[1:]
+                    break
+        for linha in linhas:
+            if len(linha) > indice_coluna:
+                numeros.extend(re.findall(r'\d+', linha[indice_coluna]))
+    return list(dict.fromkeys(numeros))  # remove repetidos mantendo a ordem
+
+@app.route("/pimns/atualizar_em_lote", methods=["POST"])
+def atualizar_pimns_em_lote():
+    if not session.get("is_admin"):
+        flash("Acesso negado.", "danger")
+        return redirect(url_for("login"))
+
+    novo_status = request.form.get("status", "1") == "1"
+    ids = list(dict.fromkeys(int(i) for i in request.form.getlist("ids") if str(i).isdigit()))
+    numeros = _numeros_os_informados(request.form.get("numeros", ""), request.files.get("arquivo"))
+    if not ids and not numeros:
+        flash("Nenhuma OS informada para atualizar o PIMNS.", "warning")
+        return redirect(request.referrer or url_for("admin_panel"))
 
+    # Resolve ids e números para um conjunto único de registros: a mesma linha selecionada e colada conta uma vez
+    encontrados_ids, encontrados_numeros, alvo, atualizadas = set(), set(), set(), 0
+    tabela = Finalizacao.__table__
+    try:
+        for inicio in range(0, len(ids), TAMANHO_LOTE_PIMNS):
+            encontrados_ids.update(db.session.execute(
+                db.select(tabela.c.id).where(tabela.c.id.in_(ids[inicio:inicio + TAMANHO_LOTE_PIMNS]))).scalars())
+        alvo.update(encontrados_ids)
+        for inicio in range(0, len(numeros), TAMANHO_LOTE_PIMNS):
+            for id_registro, os_numero in db.session.execute(
+                    db.select(tabela.c.id, tabela.c.os_numero).where(tabela.c.os_numero.in_(numeros[inicio:inicio + TAMANHO_LOTE_PIMNS]))):
+                encontrados_numeros.add(os_numero)
+                alvo.add(id_registro)
+        ids_alvo = sorted(alvo)
+        for inicio in range(0, len(ids_alvo), TAMANHO_LOTE_PIMNS):
+            resultado = db.session.execute(tabela.update().where(tabela.c.id.in_(ids_alvo[inicio:inicio + TAMANHO_LOTE_PIMNS]))
+                                           .values(status_pimns=novo_status))
+            atualizadas += resultado.rowcount
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        logger.error(f"Erro na atualização em lote do PIMNS: {e}", exc_info=True)
+        flash("Erro ao atualizar o status PIMNS em lote.", "danger")
+        return redirect(request.referrer or url_for("admin_panel"))
+
+    nao_encontrados = [str(i) for i in ids if i not in encontrados_ids] + [n for n in numeros if n not in encontrados_numeros]
+    logger.info(f"PIMNS em lote por {session.get('gerente')}: {len(alvo)} registros encontrados, "
+                f"{len(nao_encontrados)} não encontrados, {atualizadas} {'marcados' if novo_status else 'desmarcados'}.")
+    flash(f"PIMNS {'marcado' if novo_status else 'desmarcado'} em {atualizadas} registro(s) encontrado(s); "
+          f"{len(nao_encontrados)} não encontrado(s).",
+          "success" if not nao_encontrados else "warning")
+    if nao_encontrados:
+        amostra = ', '.join(nao_encontrados[:20])
+        flash(f"Não encontradas: {amostra}{' …' if len(nao_encontrados) > 20 else ''}", "info")
+    return redirect(request.referrer or url_for("admin_panel"))
+
+
+def reconciliar_pimns(aplicar=True):
+    """Cruza a situação das OS no PIMS (os_status_pims.json do ETL) com as finalizações do app.
+
+    Marca status_pimns nas finalizações cujas OS o PIMS já fechou (UPDATE em lote) e aponta as
+    divergências nos dois sentidos. Com aplicar=False só calcula (simulação).
+    """
+    if not os.path.exists(PIMS_STATUS_FILE):
+        raise FileNotFoundError(f"{PIMS_STATUS_FILE} não encontrado. Rode o OS_unificado.py para gerá-lo.")
+    dados_pims = ler_json(PIMS_STATUS_FILE)
+    fechadas_pims = {str(n).strip() for n in dados_pims.get('os_fechadas', [])}
+    abertas_pims = {str(n).strip() for n in dados_pims.get('os_abertas', [])}
+
+    with medir('reconciliacao_pimns'):
+        marcadas, nao_marcadas = set(), set()
+        for os_numero, status in db.session.execute(db.select(Finalizacao.os_numero, Finalizacao.status_pimns)):
+            (marcadas if status else nao_marcadas).add(os_numero.strip())
+        finalizadas_app = marcadas | nao_marcadas
+        atualizar_indice_os()
+        abertas_app = indice_os.numeros_os() - finalizadas_app
+
+        a_marcar = sorted(nao_marcadas & fechadas_pims)
+        resultado = {
+            'gerado_em_pims': dados_pims.get('gerado_em', ''),
+            'total_fechadas_pims': len(fechadas_pims),
+            'total_abertas_pims': len(abertas_pims),
+            'a_marcar': a_marcar,
+            # Finalizadas no app, mas o PIMS ainda mostra a OS aberta
+            'finalizadas_abertas_no_pims': sorted(finalizadas_app & abertas_pims),
+            # Finalizadas no app e sem registro no PIMS (fora do período da consulta ou número divergente)
+            'finalizadas_sem_registro_pims': sorted(finalizadas_app - fechadas_pims - abertas_pims),
+            # Fechadas no PIMS, mas ainda abertas (JSON/pendentes) no app
+            'fechadas_pims_abertas_no_app': sorted(abertas_app & fechadas_pims),
+            'marcadas': 0,
+            'aplicado': False,
+        }
+
+    if aplicar and a_marcar:
+        tabela = Finalizacao.__table__
+        try:
+            for inicio in range(0, len(a_marcar), TAMANHO_LOTE_PIMNS):
+                lote = a_marcar[inicio:inicio + TAMANHO_LOTE_PIMNS]
+                resultado['marcadas'] += db.session.execute(
+                    tabela.update().where(tabela.c.os_numero.in_(lote), tabela.c.status_pimns.is_(False))
+                    .values(status_pimns=True)).rowcount
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+        resultado['aplicado'] = True
+    logger.info(f"Reconciliação PIMNS ({'aplicada' if resultado['aplicado'] else 'simulação'}): "
+                f"{len(a_marcar)} OS a marcar, {resultado['marcadas']} registros marcados, "
+                f"{len(resultado['finalizadas_abertas_no_pims'])} finalizadas abertas no PIMS, "
+                f"{len(resultado['fechadas_pims_abertas_no_app'])} fechadas no PIMS abertas no app.")
+    return resultado
+
+@app.cli.command('reconciliar-pimns')
+@click.option('--simular', is_flag=True, help='Só mostra o que seria marcado, sem gravar.')
+def reconciliar_pimns_command(simular):
+    """Marca status_pimns a partir do os_status_pims.json do ETL e lista as divergências."""
+    resultado = reconciliar_pimns(aplicar=not simular)
+    click.echo(f"Situação PIMS de {resultado['gerado_em_pims'] or '?'}: {resultado['total_fechadas_pims']} fechadas, "
+               f"{resultado['total_abertas_pims']} abertas.")
+    click.echo(f"OS a marcar: {len(resultado['a_marcar'])} (registros marcados: {resultado['marcadas']})")
+    for chave, descricao in (('finalizadas_abertas_no_pims', 'Finalizadas no app e abertas no PIMS'),
+                             ('finalizadas_sem_registro_pims', 'Finalizadas no app sem registro no PIMS'),
+                             ('fechadas_pims_abertas_no_app', 'Fechadas no PIMS e abertas no app')):
+        lista = resultado[chave]
+        click.echo(f"{descricao}: {len(lista)}{' -> ' + ', '.join(lista[:30]) if lista else ''}{' …' if len(lista) > 30 else ''}")
+
+@app.route('/admin/reconciliacao_pimns', methods=['GET', 'POST'])
+def admin_reconciliacao_pimns():
+    if not session.get('is_admin'):
+        flash('Acesso negado.', 'danger')
+        return redirect(url_for('login'))
+    aplicar = request.method == 'POST'
+    try:
+        resultado = reconciliar_pimns(aplicar=aplicar)
+    except FileNotFoundError as e:
+        flash(str(e), 'warning')
+        return redirect(url_for('admin_panel'))
+    if aplicar:
+        flash(f"Reconciliação aplicada: {resultado['marcadas']} registro(s) marcados no PIMNS.", 'success')
+    return render_template('reconciliacao_pimns.html', resultado=resultado, now=datetime.now(saopaulo_tz))
 
 if __name__ == '__main__':
+    init_db()
     app.run(host='0.0.0.0',
            port=int(os.environ.get('PORT', 10000)),
            debug=True)
@@ -0,0 +1,64 @@
+import logging
+import os
+import sqlite3
+
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+# Postgres: pool por worker (o total de conexões é workers x (DB_POOL_SIZE + DB_MAX_OVERFLOW))
+DB_POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', '5'))
+DB_MAX_OVERFLOW = int(os.environ.get('DB_MAX_OVERFLOW', '10'))
+DB_POOL_TIMEOUT = int(os.environ.get('DB_POOL_TIMEOUT', '30'))
+DB_POOL_RECYCLE = int(os.environ.get('DB_POOL_RECYCLE', '1800'))   # < timeout de ociosidade do servidor/proxy
+DB_POOL_PRE_PING = os.environ.get('DB_POOL_PRE_PING', '1') != '0'
+# SQLite: WAL deixa leitores e um escritor trabalharem juntos; busy_timeout espera o lock em vez de falhar
+SQLITE_JOURNAL_MODE = os.environ.get('SQLITE_JOURNAL_MODE', 'WAL').upper()
+SQLITE_SYNCHRONOUS = os.environ.get('SQLITE_SYNCHRONOUS', 'NORMAL').upper()
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get('SQLITE_BUSY_TIMEOUT_MS', '15000'))
+
+
+def normalizar_database_url(url):
+    """O Render/Heroku fornecem 'postgres://', que o SQLAlchemy 2 não aceita mais."""
+    if url and url.startswith('postgres://'):
+        return 'postgresql://' + url[len('postgres://'):]
+    return url
+
+
+def opcoes_engine(url):
+    """SQLALCHEMY_ENGINE_OPTIONS conforme o banco da URL."""
+    if url.startswith('sqlite'):
+        # Espera pelo lock no nível do driver também (segundos); os PRAGMAs vêm no evento 'connect'
+        return {'connect_args': {'timeout': SQLITE_BUSY_TIMEOUT_MS / 1000}}
+    return {
+        'pool_size': DB_POOL_SIZE,
+        'max_overflow': DB_MAX_OVERFLOW,
+        'pool_timeout': DB_POOL_TIMEOUT,
+        'pool_recycle': DB_POOL_RECYCLE,
+        'pool_pre_ping': DB_POOL_PRE_PING,
+    }
+
+
+def _aplicar_pragmas_sqlite(dbapi_connection, connection_record):
+    if not isinstance(dbapi_connection, sqlite3.Connection):
+        return
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f'PRAGMA busy_timeout = {SQLITE_BUSY_TIMEOUT_MS}')
+        if SQLITE_JOURNAL_MODE:
+            cursor.execute(f'PRAGMA journal_mode = {SQLITE_JOURNAL_MODE}')
+        if SQLITE_SYNCHRONOUS:
+            cursor.execute(f'PRAGMA synchronous = {SQLITE_SYNCHRONOUS}')
+    except sqlite3.Error as e:
+        # Ex.: banco somente leitura não troca o journal_mode; segue com o padrão do arquivo
+        logger.warning(f"Não foi possível aplicar os PRAGMAs do SQLite: {e}")
+    finally:
+        cursor.close()
+
+
+def registrar_pragmas_sqlite():
+    """Aplica journal_mode, synchronous e busy_timeout a cada nova conexão SQLite do processo."""
+    if not event.contains(Engine, 'connect', _aplicar_pragmas_sqlite):
+        event.listen(Engine, 'connect', _aplicar_pragmas_sqlite)
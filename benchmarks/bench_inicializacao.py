@@ -0,0 +1,70 @@
+"""
+Mede o custo de boot de um worker: tempo de `import app` em processos novos
+(o que cada worker do gunicorn paga) e, à parte, o tempo do `init_db`.
+
+Uso:
+    python benchmarks/bench_inicializacao.py --repeticoes 10
+    python benchmarks/bench_inicializacao.py --importtime   # maiores módulos via -X importtime
+"""
+import argparse
+import os
+import subprocess
+import sys
+import tempfile
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from instrumentacao import percentil  # noqa: E402
+
+CODIGO_IMPORT = "import time; t = time.perf_counter(); import app; print(time.perf_counter() - t)"
+CODIGO_INIT_DB = "import time, app; t = time.perf_counter(); app.init_db(); print(time.perf_counter() - t)"
+
+
+def _executar(codigo, ambiente, repeticoes):
+    tempos = []
+    for _ in range(repeticoes):
+        saida = subprocess.run([sys.executable, '-c', codigo], cwd=RAIZ, env=ambiente,
+                               capture_output=True, text=True, check=True)
+        tempos.append(float(saida.stdout.strip().splitlines()[-1]) * 1000)
+    return sorted(tempos)
+
+
+def _maiores_modulos(ambiente, quantidade):
+    saida = subprocess.run([sys.executable, '-X', 'importtime', '-c', 'import app'], cwd=RAIZ, env=ambiente,
+                           capture_output=True, text=True, check=True)
+    modulos = []
+    for linha in saida.stderr.splitlines():
+        if not linha.startswith('import time:') or '|' not in linha:
+            continue
+        partes = [p.strip() for p in linha[len('import time:'):].split('|')]
+        if partes[1].isdigit():
+            modulos.append((int(partes[1]), partes[2]))
+    return sorted(modulos, reverse=True)[:quantidade]
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark de inicialização (import do app e init_db).')
+    parser.add_argument('--repeticoes', type=int, default=10)
+    parser.add_argument('--importtime', action='store_true', help='lista os módulos mais caros no import')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='osm_boot_') as dir_trabalho:
+        ambiente = dict(os.environ,
+                        DATABASE_URL=f"sqlite:///{os.path.join(dir_trabalho, 'boot.db')}",
+                        LOG_LEVEL='WARNING')
+        tempos_import = _executar(CODIGO_IMPORT, ambiente, args.repeticoes)
+        tempos_init_db = _executar(CODIGO_INIT_DB, ambiente, args.repeticoes)
+
+        print(f"import app  p50 {percentil(tempos_import, 50):8.1f} ms  p95 {percentil(tempos_import, 95):8.1f} ms")
+        print(f"init_db     p50 {percentil(tempos_init_db, 50):8.1f} ms  p95 {percentil(tempos_init_db, 95):8.1f} ms"
+              "  (roda uma vez por deploy: flask --app app init-db)")
+
+        if args.importtime:
+            print("\nMódulos mais caros no import (cumulativo, ms):")
+            for microssegundos, modulo in _maiores_modulos(ambiente, 15):
+                print(f"  {microssegundos / 1000:8.1f}  {modulo}")
+
+
+if __name__ == '__main__':
+    main()
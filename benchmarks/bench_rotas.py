@@ -0,0 +1,200 @@
+"""
+Benchmark das rotas Flask sobre dados sintéticos em escala (1×, 10×, 100× produção).
+
+Gera os dados com `dados_sinteticos.py`, sobe a aplicação real apontando para eles
+(OS_MANAGER_DATA_DIR + SQLite temporário) e mede cada rota pelo test client.
+
+Uso:
+    python benchmarks/bench_rotas.py --escala 10 --repeticoes 20 --salvar
+    python benchmarks/bench_rotas.py --escala 10 --comparar benchmarks/baselines/rotas_escala_10.json
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DIR_BASELINES = os.path.join(RAIZ, 'benchmarks', 'baselines')
+sys.path.insert(0, RAIZ)
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from dados_sinteticos import gerar_dados  # noqa: E402
+from instrumentacao import percentil  # noqa: E402
+
+
+def preparar_app(manifesto, dir_trabalho):
+    """Importa o app apontando para os dados sintéticos e popula as finalizações."""
+    os.environ['OS_MANAGER_DATA_DIR'] = manifesto['destino']
+    os.environ['DATABASE_URL'] = f"sqlite:///{os.path.join(dir_trabalho, 'bench.db')}"
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+    import app as modulo_app
+    modulo_app.app.config['SESSION_COOKIE_SECURE'] = False
+    with modulo_app.app.app_context():
+        modulo_app.init_db()
+        db = modulo_app.db
+        for inicio in range(0, len(manifesto['finalizacoes']), 5000):
+            db.session.execute(modulo_app.Finalizacao.__table__.insert(), manifesto['finalizacoes'][inicio:inicio + 5000])
+        db.session.commit()
+    return modulo_app
+
+
+def _login(modulo_app, usuario, senha):
+    cliente = modulo_app.app.test_client()
+    resposta = cliente.post('/login', data={'username': usuario, 'senha': senha})
+    if resposta.status_code != 302:
+        raise RuntimeError(f"Login de {usuario} falhou (status {resposta.status_code}).")
+    return cliente
+
+
+def medir(nome, chamadas):
+    """Executa cada chamada (uma requisição) e devolve as estatísticas de latência em ms."""
+    duracoes = []
+    erros = 0
+    for chamada in chamadas:
+        inicio = time.perf_counter()
+        resposta = chamada()
+        duracoes.append((time.perf_counter() - inicio) * 1000)
+        if resposta.status_code >= 400:
+            erros += 1
+    if not duracoes:
+        return None
+    ordenadas = sorted(duracoes)
+    total_s = sum(duracoes) / 1000
+    resultado = {
+        'n': len(duracoes),
+        'erros': erros,
+        'media_ms': round(sum(duracoes) / len(duracoes), 2),
+        'p50_ms': round(percentil(ordenadas, 50), 2),
+        'p95_ms': round(percentil(ordenadas, 95), 2),
+        'max_ms': round(ordenadas[-1], 2),
+        'req_por_s': round(len(duracoes) / total_s, 2) if total_s else 0.0,
+    }
+    print(f"  {nome:<28} p50 {resultado['p50_ms']:>9.2f} ms  p95 {resultado['p95_ms']:>9.2f} ms  "
+          f"{resultado['req_por_s']:>8.2f} req/s  erros {erros}")
+    return resultado
+
+
+def executar(manifesto, modulo_app, repeticoes, periodo_export):
+    senha = manifesto['senha_padrao']
+    gerente = next(iter(manifesto['os_por_gerente']))
+    prestador = next(iter(manifesto['os_por_prestador']))
+    manutencao = manifesto['usuarios_manutencao'][0]
+
+    cliente_admin = _login(modulo_app, *manifesto['admin'])
+    cliente_gerente = _login(modulo_app, gerente, senha)
+    cliente_prestador = _login(modulo_app, prestador, senha)
+    cliente_manutencao = _login(modulo_app, manutencao, senha)
+    cliente_anonimo = modulo_app.app.test_client()
+
+    # OS consumidas pelas rotas que alteram dados (uma OS diferente por repetição)
+    alvos_finalizar = [(p, numero) for p, numeros in manifesto['os_por_prestador'].items() for numero in numeros][:repeticoes]
+    clientes_prestadores = {p: _login(modulo_app, p, senha) for p in {p for p, _ in alvos_finalizar}}
+    alvos_atribuir = manifesto['os_sem_prestador'][:repeticoes]
+    hoje = datetime.now().strftime('%Y-%m-%d')
+
+    rotas = {
+        'login': [lambda: cliente_anonimo.post('/login', data={'username': gerente, 'senha': senha})] * repeticoes,
+        'painel': [lambda: cliente_gerente.get('/painel')] * repeticoes,
+        'painel_prestador': [lambda: cliente_prestador.get('/painel_prestador')] * repeticoes,
+        'painel_manutencao': [lambda: cliente_manutencao.get('/painel_manutencao')] * repeticoes,
+        'admin_panel': [lambda: cliente_admin.get('/admin')] * repeticoes,
+        'gerar_relatorio': [lambda: cliente_admin.get(f'/gerar_relatorio?username={gerente}')] * repeticoes,
+        'exportar_os_finalizadas': [lambda: cliente_admin.get(f'/exportar_os_finalizadas?periodo={periodo_export}')] * repeticoes,
+        'finalizar_os': [
+            (lambda p=p, numero=numero: clientes_prestadores[p].post(
+                f'/finalizar_os/{numero}', data={'data_finalizacao': hoje, 'hora_finalizacao': '17:30', 'observacoes': 'bench'}))
+            for p, numero in alvos_finalizar
+        ],
+        'atribuir_prestador': [
+            (lambda numero=numero: cliente_manutencao.post(f'/atribuir_prestador/{numero}', data={'prestador_usuario': prestador}))
+            for numero in alvos_atribuir
+        ],
+    }
+
+    resultados = {}
+    for nome, chamadas in rotas.items():
+        resultado = medir(nome, chamadas)
+        if resultado:
+            resultados[nome] = resultado
+    return resultados
+
+
+def _commit_atual():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=RAIZ, capture_output=True, text=True).stdout.strip()
+    except OSError:
+        return ''
+
+
+def comparar(resultados, caminho_baseline, tolerancia):
+    """Compara o p50 de cada rota com o baseline salvo; retorna a lista de regressões."""
+    with open(caminho_baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressoes = []
+    print(f"\nComparação com {caminho_baseline} (commit {baseline.get('commit', '?')}):")
+    for nome, atual in resultados.items():
+        anterior = baseline.get('rotas', {}).get(nome)
+        if not anterior or not anterior.get('p50_ms'):
+            continue
+        razao = atual['p50_ms'] / anterior['p50_ms']
+        marcador = 'REGRESSÃO' if razao > 1 + tolerancia else ('melhora' if razao < 1 - tolerancia else 'ok')
+        print(f"  {nome:<28} {anterior['p50_ms']:>9.2f} -> {atual['p50_ms']:>9.2f} ms  ({razao:5.2f}x)  {marcador}")
+        if marcador == 'REGRESSÃO':
+            regressoes.append(nome)
+    return regressoes
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark das rotas com dados sintéticos.')
+    parser.add_argument('--escala', type=float, default=1.0)
+    parser.add_argument('--repeticoes', type=int, default=20)
+    parser.add_argument('--semente', type=int, default=42)
+    parser.add_argument('--periodo-export', default='mensal', help='periodo usado em exportar_os_finalizadas')
+    parser.add_argument('--salvar', nargs='?', const='', default=None,
+                        help='salva o resultado como baseline (padrão: benchmarks/baselines/rotas_escala_<N>.json)')
+    parser.add_argument('--comparar', help='baseline JSON para comparar')
+    parser.add_argument('--tolerancia', type=float, default=0.2, help='aumento relativo do p50 aceito (padrão 20%%)')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix='osm_bench_') as dir_trabalho:
+        destino = os.path.join(dir_trabalho, 'dados')
+        inicio = time.perf_counter()
+        manifesto = gerar_dados(destino, args.escala, args.semente)
+        print(f"Dados sintéticos (escala {args.escala}) gerados em {time.perf_counter() - inicio:.1f}s.")
+
+        modulo_app = preparar_app(manifesto, dir_trabalho)
+        print(f"Executando {args.repeticoes} repetições por rota:")
+        resultados = executar(manifesto, modulo_app, args.repeticoes, args.periodo_export)
+
+    saida = {
+        'escala': args.escala,
+        'repeticoes': args.repeticoes,
+        'semente': args.semente,
+        'commit': _commit_atual(),
+        'python': platform.python_version(),
+        'gerado_em': datetime.now().isoformat(timespec='seconds'),
+        'rotas': resultados,
+    }
+
+    if args.salvar is not None:
+        caminho = args.salvar or os.path.join(DIR_BASELINES, f"rotas_escala_{args.escala:g}.json")
+        os.makedirs(os.path.dirname(caminho), exist_ok=True)
+        with open(caminho, 'w', encoding='utf-8') as f:
+            json.dump(saida, f, ensure_ascii=False, indent=2)
+        print(f"\nBaseline salvo em {caminho}")
+
+    if args.comparar:
+        regressoes = comparar(resultados, args.comparar, args.tolerancia)
+        if regressoes:
+            print(f"\n{len(regressoes)} rota(s) com regressão: {', '.join(regressoes)}")
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
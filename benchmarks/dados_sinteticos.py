@@ -0,0 +1,180 @@
+"""
+Gera um conjunto de dados sintético com a mesma estrutura dos arquivos de produção
+(mensagens_por_gerente, mensagens_por_prestador, static/json, users.json,
+prestadores.json, manutencao.json) em uma escala configurável.
+
+Uso:
+    python benchmarks/dados_sinteticos.py --destino /tmp/osm_dados --escala 10
+"""
+import argparse
+import json
+import os
+import random
+from datetime import datetime, timedelta
+
+# Volume de produção usado como escala 1 (levantado dos arquivos do repositório)
+PRODUCAO = {
+    'gerentes': 38,
+    'os_por_gerente': 5,
+    'arquivos_prestador': 103,
+    'prestadores_com_login': 23,
+    'os_por_prestador': 4,
+    'usuarios_manutencao': 2,
+    'os_por_manutencao': 34,
+    'finalizacoes': 2000,
+}
+PROPORCAO_SEM_PRESTADOR = 0.3
+SENHA_PADRAO = '1234'
+ADMIN_USUARIO = 'wilson.santana'
+ADMIN_SENHA = 'admin321'
+
+MODELOS = ['TRATOR JOHN DEERE 6110J', 'ADUBADEIRA DCCO 10500', 'GATOR JOHN DEERE', 'PULVERIZADOR JACTO',
+           'CAMINHAO VW 24.280', 'ROCADEIRA BALDAN', 'PA CARREGADEIRA CAT 924']
+SERVICOS = ['Trocar cabeçote do filtro', 'Verificar arranque', 'Verificar vazamento da TDP',
+            'Pneu dianteiro furado', 'Revisão de 500 horas', 'Soldar suporte do implemento',
+            'Verificar aquecimento excessivo do motor', 'Trocar mangueira hidráulica']
+FAZENDAS = ['Faz Nova Manhã', 'Fazenda São Paulo', 'Pecuária', 'Faz Santa Rita', 'Faz Boa Vista']
+
+
+def _escalar(chave, escala):
+    return max(1, int(round(PRODUCAO[chave] * escala)))
+
+
+def _salvar(caminho, dados):
+    os.makedirs(os.path.dirname(caminho), exist_ok=True)
+    with open(caminho, 'w', encoding='utf-8') as f:
+        json.dump(dados, f, ensure_ascii=False, indent=2)
+
+
+def gerar_dados(destino, escala=1.0, semente=42):
+    """Cria a árvore de dados em `destino` e retorna um manifesto com usuários, OS e finalizações."""
+    rnd = random.Random(semente)
+    hoje = datetime.now()
+    proximo_numero_os = [200000]
+
+    def nova_os():
+        proximo_numero_os[0] += 1
+        return str(proximo_numero_os[0])
+
+    def data_aleatoria():
+        return (hoje - timedelta(days=rnd.randint(0, 240))).strftime('%d/%m/%Y')
+
+    def servico_aleatorio():
+        return f"{rnd.choice(SERVICOS)} - ({rnd.choice(FAZENDAS)})"
+
+    # --- Prestadores ---
+    nomes_prestadores = [f"PRESTADOR SINTETICO {i:05d}" for i in range(_escalar('arquivos_prestador', escala))]
+    prestadores_json = []
+    os_por_prestador = {}
+    for i, nome in enumerate(nomes_prestadores):
+        arquivo = nome.replace(' ', '_') + '.json'
+        registros = []
+        for _ in range(rnd.randint(1, 2 * PRODUCAO['os_por_prestador'])):
+            frota = str(rnd.randint(100, 9999))
+            registros.append({
+                'frota': frota,
+                'cd_equipamento': frota,
+                'modelo': rnd.choice(MODELOS),
+                'os': nova_os(),
+                'data_entrada': data_aleatoria(),
+                'servico': servico_aleatorio(),
+            })
+        _salvar(os.path.join(destino, 'mensagens_por_prestador', arquivo), registros)
+        if i < _escalar('prestadores_com_login', escala):
+            usuario = f"prest{i:05d}"
+            prestadores_json.append({'usuario': usuario, 'nome_exibicao': nome.title(), 'senha': SENHA_PADRAO, 'arquivo_os': arquivo})
+            os_por_prestador[usuario] = [r['os'] for r in registros]
+    _salvar(os.path.join(destino, 'prestadores.json'), prestadores_json)
+
+    # --- Gerentes ---
+    users_json = {ADMIN_USUARIO: {'senha': ADMIN_SENHA, 'tipo': 'admin'}}
+    os_por_gerente = {}
+    os_sem_prestador = []
+    for i in range(_escalar('gerentes', escala)):
+        usuario = f"gerente.{i:05d}"
+        users_json[usuario] = {'senha': SENHA_PADRAO, 'tipo': 'gerente'}
+        registros = []
+        for _ in range(rnd.randint(1, 2 * PRODUCAO['os_por_gerente'])):
+            sem_prestador = rnd.random() < PROPORCAO_SEM_PRESTADOR
+            registro = {
+                'frota': str(rnd.randint(100, 9999)),
+                'os': nova_os(),
+                'data': data_aleatoria(),
+                'prestador': 'nan' if sem_prestador else rnd.choice(nomes_prestadores),
+                'servico': servico_aleatorio(),
+            }
+            registros.append(registro)
+            if sem_prestador:
+                os_sem_prestador.append(registro['os'])
+        _salvar(os.path.join(destino, 'mensagens_por_gerente', usuario.upper().replace('.', '_') + '.json'), registros)
+        os_por_gerente[usuario] = [r['os'] for r in registros]
+    _salvar(os.path.join(destino, 'users.json'), users_json)
+
+    # --- Manutenção ---
+    manutencao_json = []
+    for i in range(PRODUCAO['usuarios_manutencao']):
+        usuario = f"manut{i}"
+        arquivo = f"relatorio_{usuario}.json"
+        registros = []
+        for _ in range(_escalar('os_por_manutencao', escala)):
+            registros.append({
+                'solicitante': f"GERENTE {rnd.randint(0, 999):05d}",
+                'frota': str(rnd.randint(100, 9999)),
+                'modelo': rnd.choice(MODELOS),
+                'os': nova_os(),
+                'data_entrada': data_aleatoria(),
+                'previsao_saida': '---',
+                'prestador': rnd.choice(nomes_prestadores),
+                'servico': servico_aleatorio(),
+                'liberado_por': usuario.title(),
+            })
+        _salvar(os.path.join(destino, 'static', 'json', arquivo), registros)
+        manutencao_json.append({'usuario': usuario, 'senha': SENHA_PADRAO, 'nome_exibicao': usuario.title(),
+                                'arquivo_os': arquivo, 'tipo': 'manutencao'})
+    _salvar(os.path.join(destino, 'manutencao.json'), manutencao_json)
+
+    # --- Finalizações (inseridas no banco pelo benchmark) ---
+    responsaveis = list(os_por_gerente) + list(os_por_prestador)
+    finalizacoes = []
+    for _ in range(_escalar('finalizacoes', escala)):
+        registrado_em = hoje - timedelta(days=rnd.randint(0, 365), minutes=rnd.randint(0, 1440))
+        finalizacoes.append({
+            'os_numero': str(rnd.randint(100000, 199999)),
+            'gerente': rnd.choice(responsaveis),
+            'data_fin': registrado_em.strftime('%d/%m/%Y'),
+            'hora_fin': registrado_em.strftime('%H:%M'),
+            'observacoes': servico_aleatorio(),
+            'registrado_em': registrado_em,
+            'status_pimns': rnd.random() < 0.5,
+        })
+
+    return {
+        'destino': destino,
+        'escala': escala,
+        'semente': semente,
+        'admin': (ADMIN_USUARIO, ADMIN_SENHA),
+        'senha_padrao': SENHA_PADRAO,
+        'os_por_gerente': os_por_gerente,
+        'os_por_prestador': os_por_prestador,
+        'os_sem_prestador': os_sem_prestador,
+        'usuarios_manutencao': [m['usuario'] for m in manutencao_json],
+        'finalizacoes': finalizacoes,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Gera dados sintéticos de OS em escala configurável.')
+    parser.add_argument('--destino', required=True)
+    parser.add_argument('--escala', type=float, default=1.0)
+    parser.add_argument('--semente', type=int, default=42)
+    args = parser.parse_args()
+
+    manifesto = gerar_dados(args.destino, args.escala, args.semente)
+    total_os = sum(len(v) for v in manifesto['os_por_gerente'].values())
+    print(f"Dados gerados em '{args.destino}' (escala {args.escala}): {len(manifesto['os_por_gerente'])} gerentes, "
+          f"{total_os} OS de gerentes, {len(manifesto['os_sem_prestador'])} OS sem prestador, "
+          f"{len(manifesto['finalizacoes'])} finalizações.")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import hashlib
+import logging
+import os
+import re
+import threading
+import time
+
+from instrumentacao import medir
+
+logger = logging.getLogger(__name__)
+
+TAMANHO_BLOCO = 1024 * 1024
+_RE_CHAVE = re.compile(r'^[0-9a-f]{64}\.[a-z0-9]{1,5}$')
+
+
+def eh_chave_blob(valor):
+    return bool(valor) and bool(_RE_CHAVE.match(valor))
+
+
+class ArmazemBlobs:
+    """Arquivos endereçados pelo conteúdo: a chave é '<sha256>.<extensão>' e o caminho é '<2 primeiros>/<chave>'.
+
+    Conteúdo igual grava um único arquivo (dedup); como o arquivo de uma chave nunca muda, ele pode ser
+    servido com cache imutável. O que não é mais referenciado é removido por `coletar_lixo`.
+    """
+
+    def __init__(self, diretorio):
+        self.diretorio = diretorio
+
+    def caminho(self, chave):
+        if not eh_chave_blob(chave):
+            raise ValueError(f"Chave de blob inválida: {chave!r}")
+        return os.path.join(self.diretorio, chave[:2], chave)
+
+    def existe(self, chave):
+        return eh_chave_blob(chave) and os.path.exists(self.caminho(chave))
+
+    def _caminho_temp(self):
+        return os.path.join(self.diretorio, f".{os.getpid()}.{threading.get_ident()}.{time.monotonic_ns()}.tmp")
+
+    def _publicar(self, caminho_temp, digest, extensao):
+        chave = f"{digest}.{extensao.lower().lstrip('.')}"
+        destino = self.caminho(chave)
+        if os.path.exists(destino):
+            os.remove(caminho_temp)  # já existe: só reaproveita
+            os.utime(destino)        # renova a carência do GC para esta nova referência
+        else:
+            os.makedirs(os.path.dirname(destino), exist_ok=True)
+            os.replace(caminho_temp, destino)
+        return chave
+
+    def gravar_bytes(self, dados, extensao):
+        with medir('blob_gravar'):
+            os.makedirs(self.diretorio, exist_ok=True)
+            caminho_temp = self._caminho_temp()
+            with open(caminho_temp, 'wb') as f:
+                f.write(dados)
+            return self._publicar(caminho_temp, hashlib.sha256(dados).hexdigest(), extensao)
+
+    def gravar_arquivo(self, caminho_origem, extensao=None, mover=True):
+        """Guarda um arquivo já em disco (lido em blocos); com mover=True o original deixa de existir."""
+        extensao = extensao or os.path.splitext(caminho_origem)[1]
+        with medir('blob_gravar'):
+            os.makedirs(self.diretorio, exist_ok=True)
+            caminho_temp = self._caminho_temp()
+            sha = hashlib.sha256()
+            with open(caminho_origem, 'rb') as origem:
+                if mover:
+                    for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                        sha.update(bloco)
+                else:
+                    with open(caminho_temp, 'wb') as copia:
+                        for bloco in iter(lambda: origem.read(TAMANHO_BLOCO), b''):
+                            sha.update(bloco)
+                            copia.write(bloco)
+            if mover:
+                os.replace(caminho_origem, caminho_temp)
+            return self._publicar(caminho_temp, sha.hexdigest(), extensao)
+
+    def chaves(self):
+        """(chave, mtime) de todos os blobs gravados."""
+        try:
+            subpastas = list(os.scandir(self.diretorio))
+        except OSError:
+            return
+        for subpasta in subpastas:
+            if not subpasta.is_dir():
+                continue
+            for entrada in os.scandir(subpasta.path):
+                if eh_chave_blob(entrada.name):
+                    yield entrada.name, entrada.stat().st_mtime
+
+    def coletar_lixo(self, referenciadas, carencia_segundos=24 * 3600, simular=False):
+        """Remove os blobs fora de `referenciadas` mais antigos que a carência (evita apagar upload ainda sem commit).
+
+        Retorna (quantidade, bytes) removidos (ou que seriam, com simular=True).
+        """
+        limite = time.time() - carencia_segundos
+        removidos, bytes_removidos = 0, 0
+        for chave, mtime in list(self.chaves()):
+            if chave in referenciadas or mtime > limite:
+                continue
+            caminho = self.caminho(chave)
+            try:
+                tamanho = os.path.getsize(caminho)
+                if not simular:
+                    os.remove(caminho)
+            except OSError as e:
+                logger.warning(f"GC de blobs: não foi possível remover {caminho}: {e}")
+                continue
+            removidos += 1
+            bytes_removidos += tamanho
+        return removidos, bytes_removidos
@@ -8,7 +8,10 @@ export FLASK_APP=app.py
 pip install --upgrade pip
 pip install -r requirements.txt
 
-# 3) Inicializa e aplica migrations (sem erro se já inicializado)
+# 3) Cria/migra as tabelas e sincroniza o users.json (uma vez por deploy, fora do boot dos workers)
+flask init-db
+
+# 4) Inicializa e aplica migrations (sem erro se já inicializado)
 flask db init 2>/dev/null || true
 flask db migrate -m "Inicial: criar tabelas"
 flask db upgrade
@@ -0,0 +1,260 @@
+import bisect
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+
+from instrumentacao import medir
+
+logger = logging.getLogger(__name__)
+
+# Campos indexados de cada OS (os demais ficam só para exibição)
+CAMPOS_INDEXADOS = ('os', 'frota', 'modelo', 'servico', 'prestador', 'solicitante', 'responsavel')
+POR_PAGINA_PADRAO = 20
+POR_PAGINA_MAXIMO = 100
+_RE_TOKEN = re.compile(r'[a-z0-9]+')
+
+
+def normalizar(texto):
+    """Minúsculas e sem acentos ('Revisão' -> 'revisao')."""
+    decomposto = unicodedata.normalize('NFKD', str(texto or ''))
+    return ''.join(c for c in decomposto if not unicodedata.combining(c)).lower()
+
+
+def tokenizar(texto):
+    return _RE_TOKEN.findall(normalizar(texto))
+
+
+def _campo(item, *nomes, padrao=''):
+    for nome in nomes:
+        valor = item.get(nome)
+        if valor not in (None, ''):
+            return str(valor)
+    return padrao
+
+
+def _nome_do_arquivo(arquivo):
+    return os.path.splitext(arquivo)[0].replace('_', ' ')
+
+
+def documento_gerente(item, arquivo):
+    return {
+        'os': _campo(item, 'os', 'OS'),
+        'frota': _campo(item, 'frota', 'Frota'),
+        'modelo': _campo(item, 'modelo', 'Modelo'),
+        'data': _campo(item, 'data', 'Data'),
+        'prestador': _campo(item, 'prestador', 'Prestador'),
+        'servico': _campo(item, 'servico', 'Servico', 'observacao', 'Observacao'),
+        'responsavel': _nome_do_arquivo(arquivo),
+    }
+
+
+def documento_prestador(item, arquivo):
+    return {
+        'os': _campo(item, 'os', 'OS'),
+        'frota': _campo(item, 'frota', 'Frota'),
+        'modelo': _campo(item, 'modelo', 'Modelo'),
+        'data': _campo(item, 'data_entrada', 'data', 'Data'),
+        'prestador': _nome_do_arquivo(arquivo),
+        'servico': _campo(item, 'servico', 'Servico'),
+        'responsavel': _nome_do_arquivo(arquivo),
+    }
+
+
+def documento_manutencao(item, arquivo):
+    return {
+        'os': _campo(item, 'os', 'OS'),
+        'frota': _campo(item, 'frota', 'Frota'),
+        'modelo': _campo(item, 'modelo', 'Modelo'),
+        'data': _campo(item, 'data_entrada', 'data', 'Data'),
+        'prestador': _campo(item, 'prestador', 'Prestador'),
+        'servico': _campo(item, 'servico', 'Servico'),
+        'solicitante': _campo(item, 'solicitante'),
+        'responsavel': _campo(item, 'liberado_por', padrao=_nome_do_arquivo(arquivo)),
+    }
+
+
+class IndiceOS:
+    """Índice invertido em memória sobre as OS abertas (JSONs) e pendentes (banco).
+
+    Cada fonte é um diretório de JSONs; só os arquivos cujo (mtime, tamanho) mudou são
+    reindexados. As pendentes são trocadas em bloco quando o conteúdo delas muda.
+    """
+
+    def __init__(self, fontes, ler_json):
+        # fontes: lista de (origem, diretorio, funcao_documento)
+        self.fontes = fontes
+        self.ler_json = ler_json
+        self._lock = threading.RLock()
+        self._documentos = {}            # id -> documento
+        self._postings = {}              # token -> set(ids)
+        self._ids_por_arquivo = {}       # (origem, arquivo) -> [ids]
+        self._assinaturas = {}           # (origem, arquivo) -> (mtime_ns, tamanho)
+        self._assinatura_pendentes = None
+        self._vocabulario = []           # tokens ordenados (busca por prefixo)
+        self._vocabulario_sujo = False
+        self._proximo_id = 0
+
+    # --- Manutenção do índice ---
+    def _adicionar(self, chave, documento):
+        doc_id = self._proximo_id
+        self._proximo_id += 1
+        self._documentos[doc_id] = documento
+        self._ids_por_arquivo.setdefault(chave, []).append(doc_id)
+        tokens = set()
+        for campo in CAMPOS_INDEXADOS:
+            tokens.update(tokenizar(documento.get(campo)))
+        for token in tokens:
+            ids = self._postings.get(token)
+            if ids is None:
+                self._postings[token] = ids = set()
+                self._vocabulario_sujo = True
+            ids.add(doc_id)
+
+    def _remover_arquivo(self, chave):
+        for doc_id in self._ids_por_arquivo.pop(chave, []):
+            documento = self._documentos.pop(doc_id)
+            for campo in CAMPOS_INDEXADOS:
+                for token in tokenizar(documento.get(campo)):
+                    ids = self._postings.get(token)
+                    if ids is not None:
+                        ids.discard(doc_id)
+                        if not ids:
+                            del self._postings[token]
+                            self._vocabulario_sujo = True
+        self._assinaturas.pop(chave, None)
+
+    def atualizar(self):
+        """Reindexa apenas os arquivos novos/alterados e descarta os removidos. Retorna quantos mudaram."""
+        alterados = 0
+        with self._lock, medir('busca_atualizar'):
+            vistos = set()
+            for origem, diretorio, funcao_documento in self.fontes:
+                try:
+                    entradas = list(os.scandir(diretorio))
+                except OSError:
+                    entradas = []
+                for entrada in entradas:
+                    if not entrada.name.lower().endswith('.json'):
+                        continue
+                    chave = (origem, entrada.name)
+                    vistos.add(chave)
+                    try:
+                        st = entrada.stat()
+                    except OSError:
+                        continue
+                    assinatura = (st.st_mtime_ns, st.st_size)
+                    if self._assinaturas.get(chave) == assinatura:
+                        continue
+                    try:
+                        dados = self.ler_json(entrada.path)
+                    except Exception as e:
+                        # Arquivo sendo regravado: mantém a versão anterior e tenta na próxima busca
+                        logger.warning(f"Busca: não foi possível ler {entrada.path}: {e}")
+                        continue
+                    self._remover_arquivo(chave)
+                    for item in dados if isinstance(dados, list) else []:
+                        if isinstance(item, dict):
+                            documento = funcao_documento(item, entrada.name)
+                            documento['origem'] = origem
+                            documento['arquivo'] = entrada.name
+                            self._adicionar(chave, documento)
+                    self._assinaturas[chave] = assinatura
+                    alterados += 1
+            for chave in [c for c in self._assinaturas if c not in vistos]:
+                self._remover_arquivo(chave)
+                alterados += 1
+        return alterados
+
+    def atualizar_pendentes(self, documentos):
+        """Troca as OS pendentes (vindas do banco) só quando o conteúdo muda."""
+        assinatura = hash(tuple(tuple(sorted(d.items())) for d in documentos))
+        with self._lock:
+            if assinatura == self._assinatura_pendentes:
+                return False
+            chave = ('pendente', '')
+            self._remover_arquivo(chave)
+            for documento in documentos:
+                documento['origem'] = 'pendente'
+                documento['arquivo'] = ''
+                self._adicionar(chave, documento)
+            self._assinatura_pendentes = assinatura
+            return True
+
+    # --- Consulta ---
+    def _ids_do_termo(self, termo):
+        """Todos os documentos com algum token que começa por `termo`."""
+        if self._vocabulario_sujo:
+            self._vocabulario = sorted(self._postings)
+            self._vocabulario_sujo = False
+        ids = set()
+        posicao = bisect.bisect_left(self._vocabulario, termo)
+        while posicao < len(self._vocabulario) and self._vocabulario[posicao].startswith(termo):
+            ids |= self._postings[self._vocabulario[posicao]]
+            posicao += 1
+        return ids
+
+    def buscar(self, consulta, origem=None, pagina=1, por_pagina=POR_PAGINA_PADRAO):
+        """Busca E (todos os termos, por prefixo, sem acento) com paginação."""
+        inicio = time.perf_counter()
+        termos = tokenizar(consulta)
+        por_pagina = max(1, min(int(por_pagina or POR_PAGINA_PADRAO), POR_PAGINA_MAXIMO))
+        pagina = max(1, int(pagina or 1))
+        with self._lock, medir('busca_consulta'):
+            if termos:
+                conjuntos = sorted((self._ids_do_termo(t) for t in termos), key=len)
+                ids = set(conjuntos[0])
+                for conjunto in conjuntos[1:]:
+                    ids &= conjunto
+                    if not ids:
+                        break
+            else:
+                ids = set()
+            documentos = [self._documentos[i] for i in ids]
+        if origem:
+            documentos = [d for d in documentos if d['origem'] == origem]
+        documentos.sort(key=lambda d: (d['os'].zfill(12), d['origem']), reverse=True)
+        total = len(documentos)
+        inicio_pagina = (pagina - 1) * por_pagina
+        return {
+            'consulta': consulta,
+            'origem': origem or '',
+            'total': total,
+            'pagina': pagina,
+            'por_pagina': por_pagina,
+            'paginas': (total + por_pagina - 1) // por_pagina,
+            'resultados': documentos[inicio_pagina:inicio_pagina + por_pagina],
+            'tempo_ms': round((time.perf_counter() - inicio) * 1000, 2),
+        }
+
+    def documentos_por_os(self, numeros, origem=None):
+        """{número: [documentos]} das OS pedidas, pelo índice (sem reler os JSONs)."""
+        encontrados = {}
+        with self._lock:
+            for numero in {str(n) for n in numeros}:
+                tokens = tokenizar(numero)
+                if len(tokens) == 1:
+                    candidatos = (self._documentos[i] for i in self._postings.get(tokens[0], ()))
+                else:
+                    candidatos = self._documentos.values()
+                for documento in candidatos:
+                    if documento['os'] == numero and (origem is None or documento['origem'] == origem):
+                        encontrados.setdefault(numero, []).append(dict(documento))
+        return encontrados
+
+    def numeros_os(self, origens=None):
+        """Conjunto dos números de OS indexados (opcionalmente só de algumas origens)."""
+        with self._lock:
+            return {d['os'] for d in self._documentos.values() if d['os'] and (origens is None or d['origem'] in origens)}
+
+    def chaves_os(self, origens=None):
+        """Conjunto de (origem, arquivo, número) de todas as OS indexadas vindas de JSON."""
+        with self._lock:
+            return {(d['origem'], d['arquivo'], d['os']) for d in self._documentos.values()
+                    if d['os'] and d['arquivo'] and (origens is None or d['origem'] in origens)}
+
+    def estatisticas(self):
+        with self._lock:
+            return {'documentos': len(self._documentos), 'tokens': len(self._postings), 'arquivos': len(self._assinaturas)}
@@ -0,0 +1,195 @@
+import logging
+import os
+import threading
+from datetime import timedelta
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+JANELA_FECHAMENTOS_DIAS = int(os.environ.get('CARGA_JANELA_FECHAMENTOS_DIAS', '14'))  # taxa de fechamento recente
+TAXA_MINIMA = 0.1           # OS/dia: prestador sem fechamentos recentes não fica com pontuação infinita
+AGING_REFERENCIA_DIAS = 30  # idade média da fila que dobra a pontuação
+PESO_AFINIDADE_FROTA = 0.75  # prestador que já tem OS da mesma frota na fila (uma ida só ao equipamento)
+
+
+def _chave_nome(nome):
+    return ' '.join(str(nome or '').lower().split())
+
+
+class _Carga:
+    __slots__ = ('usuario', 'nome', 'os_json', 'frotas', 'soma_dias', 'fechamentos')
+
+    def __init__(self, usuario, nome):
+        self.usuario, self.nome = usuario, nome
+        self.os_json = frozenset()   # OS no JSON do prestador
+        self.frotas = frozenset()
+        self.soma_dias = 0
+        self.fechamentos = {}        # os -> data da finalização (janela recente)
+
+
+class CargaPrestadores:
+    """Fila, idade média e taxa de fechamento recente de cada prestador, mantidas em memória.
+
+    Tudo é atualizado por incremento: a fila de um prestador só é refeita quando o JSON dele muda
+    (`atualizar_fila`), e atribuições/finalizações entram uma a uma (`registrar_*`, alimentados pelos
+    eventos das OS). As sugestões só leem esse estado e ficam guardadas até ele mudar (`versao`).
+    """
+
+    def __init__(self, janela_dias=JANELA_FECHAMENTOS_DIAS):
+        self.janela_dias = janela_dias
+        self._lock = threading.RLock()
+        self._cargas = {}          # usuario -> _Carga
+        self._por_nome = {}        # nome de exibição/usuário normalizado -> usuario
+        self._assinaturas = {}     # usuario -> assinatura do JSON da fila
+        self._atribuidas = {}      # os -> usuario (atribuídas no app, ainda fora do JSON do prestador)
+        self.versao = 0            # muda a cada alteração do estado; invalida as sugestões guardadas
+        self._sugestoes = None     # (chave, {os: usuario}) da última chamada de sugerir
+
+    # --- Estado ---
+    def definir_prestadores(self, prestadores):
+        """(usuario, nome de exibição) dos prestadores que podem receber OS; mantém o estado dos que continuam."""
+        with self._lock:
+            cargas, por_nome = {}, {}
+            mudou = False
+            for usuario, nome in prestadores:
+                carga = self._cargas.get(usuario)
+                if carga is None:
+                    carga, mudou = _Carga(usuario, nome), True
+                elif carga.nome != nome:
+                    carga.nome, mudou = nome, True
+                cargas[usuario] = carga
+                por_nome[_chave_nome(usuario)] = usuario
+                por_nome[_chave_nome(nome)] = usuario
+            if mudou or len(cargas) != len(self._cargas):
+                self.versao += 1
+            self._cargas, self._por_nome = cargas, por_nome
+            self._assinaturas = {u: a for u, a in self._assinaturas.items() if u in cargas}
+
+    def usuario_do_prestador(self, nome):
+        return self._por_nome.get(_chave_nome(nome))
+
+    def atualizar_fila(self, usuario, assinatura, carregar):
+        """Refaz a fila do prestador com `carregar()` (RegistroOS) só se a assinatura do JSON mudou."""
+        with self._lock:
+            carga = self._cargas.get(usuario)
+            if carga is None or self._assinaturas.get(usuario) == assinatura:
+                return False
+        registros = carregar() if assinatura is not None else ()
+        with self._lock:
+            carga.os_json = frozenset(r.os for r in registros)
+            carga.frotas = frozenset(r.frota for r in registros if r.frota)
+            carga.soma_dias = sum(r.dias_abertos for r in registros)
+            self._assinaturas[usuario] = assinatura
+            self.versao += 1
+        return True
+
+    def registrar_atribuicao(self, numero_os, nome_prestador):
+        with self._lock:
+            usuario = self.usuario_do_prestador(nome_prestador)
+            if self._atribuidas.get(numero_os) == usuario:
+                return
+            if usuario is None:
+                self._atribuidas.pop(numero_os, None)  # reatribuída a alguém fora da lista
+            else:
+                self._atribuidas[numero_os] = usuario
+            self.versao += 1
+
+    def registrar_finalizacao(self, numero_os, usuario, dia):
+        """OS finalizada por `usuario` em `dia` (conta na taxa se ele for prestador); sai das atribuídas."""
+        with self._lock:
+            self._atribuidas.pop(numero_os, None)
+            carga = self._cargas.get(usuario)
+            if carga is not None and dia is not None:
+                carga.fechamentos[numero_os] = dia
+            self.versao += 1
+
+    def limpar_movimentos(self):
+        """Descarta atribuições e fechamentos (antes de recarregá-los do banco); as filas dos JSONs continuam."""
+        with self._lock:
+            for carga in self._cargas.values():
+                carga.fechamentos.clear()
+            self._atribuidas.clear()
+            self.versao += 1
+
+    # --- Leitura ---
+    def _filas(self):
+        atribuidas = {}
+        for numero, usuario in self._atribuidas.items():
+            carga = self._cargas.get(usuario)
+            if carga is not None and numero not in carga.os_json:
+                atribuidas[usuario] = atribuidas.get(usuario, 0) + 1
+        return atribuidas
+
+    def estado(self, hoje):
+        """{usuario: {'nome', 'fila', 'fila_json', 'atribuidas', 'soma_dias', 'media_dias', 'fechamentos', 'taxa_dia', 'frotas'}}."""
+        inicio = hoje - timedelta(days=self.janela_dias)
+        with self._lock:
+            atribuidas = self._filas()
+            resultado = {}
+            for usuario, carga in self._cargas.items():
+                for numero in [n for n, dia in carga.fechamentos.items() if dia < inicio]:
+                    del carga.fechamentos[numero]
+                    self.versao += 1
+                fila_json = len(carga.os_json)
+                resultado[usuario] = {
+                    'nome': carga.nome,
+                    'fila': fila_json + atribuidas.get(usuario, 0),
+                    'fila_json': fila_json,
+                    'atribuidas': atribuidas.get(usuario, 0),
+                    'soma_dias': carga.soma_dias,
+                    'media_dias': round(carga.soma_dias / fila_json, 1) if fila_json else 0.0,
+                    'fechamentos': len(carga.fechamentos),
+                    'taxa_dia': len(carga.fechamentos) / self.janela_dias,
+                    'frotas': carga.frotas,
+                }
+            return resultado
+
+    @staticmethod
+    def pontuacao(dados, extra=0, dias_extra=0, frota=None):
+        """Dias estimados para a fila (com mais `extra` OS, somando `dias_extra` de idade) andar, pesados pela idade média.
+
+        Menor é melhor.
+        """
+        dias_para_atender = (dados['fila'] + extra + 1) / max(dados['taxa_dia'], TAXA_MINIMA)
+        com_idade = dados['fila_json'] + extra
+        media_dias = (dados['soma_dias'] + dias_extra) / com_idade if com_idade else 0
+        valor = dias_para_atender * (1 + media_dias / AGING_REFERENCIA_DIAS)
+        if frota and frota in dados['frotas']:
+            valor *= PESO_AFINIDADE_FROTA
+        return valor
+
+    def sugerir(self, registros, hoje, estado=None):
+        """{os: usuario} com o prestador de menor pontuação para cada OS, olhando cada uma isoladamente.
+
+        O cálculo é O(OS x prestadores): sem `estado` explícito, o resultado é reaproveitado enquanto
+        o estado (`versao`), o dia e as OS não mudam.
+        """
+        chave = None
+        if estado is None:
+            with self._lock:
+                estado = self.estado(hoje)
+                chave = (self.versao, hoje, tuple((r.os, r.frota) for r in registros))
+                guardadas = self._sugestoes
+            if guardadas is not None and guardadas[0] == chave:
+                return guardadas[1]
+        if not estado:
+            return {}
+        sugestoes = {r.os: min(estado, key=lambda u: (self.pontuacao(estado[u], frota=r.frota), u)) for r in registros}
+        if chave is not None:
+            self._sugestoes = (chave, sugestoes)
+        return sugestoes
+
+    def distribuir(self, registros, hoje, estado=None):
+        """{os: usuario} balanceado para um lote: as mais antigas escolhem primeiro e cada OS entra na fila simulada."""
+        estado = self.estado(hoje) if estado is None else estado
+        if not estado:
+            return {}
+        extra = dict.fromkeys(estado, 0)
+        dias_extra = dict.fromkeys(estado, 0)
+        plano = {}
+        for r in sorted(registros, key=lambda r: r.dias_abertos, reverse=True):
+            usuario = min(estado, key=lambda u: (self.pontuacao(estado[u], extra[u], dias_extra[u], r.frota), u))
+            plano[r.os] = usuario
+            extra[usuario] += 1
+            dias_extra[usuario] += r.dias_abertos
+        return plano
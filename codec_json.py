@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import threading
+
+try:
+    import orjson
+except ImportError:  # sem orjson: json da stdlib (mais lento, mesmo resultado)
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+# Compacto por padrão (arquivos ~metade do tamanho); JSON_PRETTY=1 grava indentado para depuração
+JSON_PRETTY = os.environ.get('JSON_PRETTY', '0') == '1'
+
+
+def loads(conteudo):
+    if orjson is not None:
+        try:
+            return orjson.loads(conteudo)
+        except orjson.JSONDecodeError:
+            pass  # ex.: NaN gravado pelo json da stdlib em arquivos antigos; a stdlib aceita
+    if isinstance(conteudo, (bytes, bytearray, memoryview)):
+        conteudo = bytes(conteudo).decode('utf-8')
+    return json.loads(conteudo)
+
+
+def _padrao(valor):
+    """Escalares do numpy/pandas (o ETL monta os registros a partir de DataFrames)."""
+    if hasattr(valor, 'item'):
+        return valor.item()
+    raise TypeError(f"Tipo não serializável em JSON: {type(valor).__name__}")
+
+
+def dumps(dados, pretty=None):
+    """Serializa para bytes UTF-8 (sem escapar acentos)."""
+    pretty = JSON_PRETTY if pretty is None else pretty
+    if orjson is not None:
+        opcoes = orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY | (orjson.OPT_INDENT_2 if pretty else 0)
+        return orjson.dumps(dados, default=_padrao, option=opcoes)
+    if pretty:
+        return json.dumps(dados, ensure_ascii=False, indent=2, default=_padrao).encode('utf-8')
+    return json.dumps(dados, ensure_ascii=False, separators=(',', ':'), default=_padrao).encode('utf-8')
+
+
+def carregar(caminho):
+    with open(caminho, 'rb') as f:
+        return loads(f.read())
+
+
+def gravar_atomico(caminho, conteudo):
+    caminho_temp = f"{caminho}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(caminho_temp, 'wb') as f:
+        f.write(conteudo)
+    os.replace(caminho_temp, caminho)
+
+
+def salvar(caminho, dados, pretty=None):
+    """Grava num arquivo temporário e troca de uma vez (quem lê nunca vê o arquivo pela metade)."""
+    gravar_atomico(caminho, dumps(dados, pretty))
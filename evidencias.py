@@ -0,0 +1,98 @@
+import logging
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from instrumentacao import medir
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+LADO_MAXIMO = int(os.environ.get('EVIDENCIA_LADO_MAXIMO', '1920'))
+LADO_MINIATURA = int(os.environ.get('EVIDENCIA_LADO_MINIATURA', '320'))
+QUALIDADE = int(os.environ.get('EVIDENCIA_QUALIDADE', '80'))
+TRABALHADORES = int(os.environ.get('EVIDENCIA_TRABALHADORES', '2'))
+
+STATUS_PROCESSANDO = 'processando'
+STATUS_PRONTA = 'pronta'
+STATUS_ERRO = 'erro'
+
+
+def _formato_saida():
+    from PIL import features
+    return ('WEBP', 'webp') if features.check('webp') else ('JPEG', 'jpg')
+
+
+def processar_evidencia(caminho_original, pasta_destino, nome_base):
+    """Gera a imagem final (lado máximo LADO_MAXIMO) e a miniatura, sem EXIF, e apaga o original.
+
+    A orientação do EXIF é aplicada nos pixels antes de descartá-lo. Retorna
+    {'arquivo', 'miniatura', 'bytes_original', 'bytes_final'} com os nomes relativos a `pasta_destino`.
+    """
+    from PIL import Image, ImageOps
+
+    formato, extensao = _formato_saida()
+    nome_final = f"{nome_base}.{extensao}"
+    nome_miniatura = f"{nome_base}_mini.{extensao}"
+    bytes_original = os.path.getsize(caminho_original)
+    with medir('evidencia_processar'):
+        with Image.open(caminho_original) as imagem:
+            imagem.seek(0)  # GIF animado: só o primeiro quadro
+            imagem = ImageOps.exif_transpose(imagem)
+            imagem = imagem.convert('RGBA' if formato == 'WEBP' and 'A' in imagem.getbands() else 'RGB')
+            imagem.thumbnail((LADO_MAXIMO, LADO_MAXIMO), Image.LANCZOS)
+            # Nenhum 'exif' é passado ao save: os metadados (GPS, aparelho...) não vão para o arquivo final
+            _salvar_atomico(imagem, os.path.join(pasta_destino, nome_final), formato)
+            imagem.thumbnail((LADO_MINIATURA, LADO_MINIATURA), Image.LANCZOS)
+            _salvar_atomico(imagem, os.path.join(pasta_destino, nome_miniatura), formato)
+    os.remove(caminho_original)
+    return {
+        'arquivo': nome_final,
+        'miniatura': nome_miniatura,
+        'bytes_original': bytes_original,
+        'bytes_final': os.path.getsize(os.path.join(pasta_destino, nome_final)),
+    }
+
+
+def _salvar_atomico(imagem, caminho, formato):
+    caminho_temp = f"{caminho}.tmp"
+    imagem.save(caminho_temp, format=formato, quality=QUALIDADE, optimize=formato == 'JPEG', method=4 if formato == 'WEBP' else 0)
+    os.replace(caminho_temp, caminho)
+
+
+class FilaEvidencias:
+    """Pool de threads que processa as evidências fora da requisição.
+
+    O executor só é criado no primeiro envio (depois do fork dos workers do gunicorn).
+    `ao_concluir(resultado, erro)` é chamado na thread do pool ao fim de cada tarefa.
+    """
+
+    def __init__(self, trabalhadores=TRABALHADORES):
+        self.trabalhadores = trabalhadores
+        self._executor = None
+        self._lock = threading.Lock()
+
+    def _obter_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.trabalhadores, thread_name_prefix='evidencias')
+            return self._executor
+
+    def enviar(self, caminho_original, pasta_destino, nome_base, ao_concluir):
+        def tarefa():
+            try:
+                resultado = processar_evidencia(caminho_original, pasta_destino, nome_base)
+            except Exception as e:
+                logger.error(f"Erro ao processar evidência {caminho_original}: {e}")
+                ao_concluir(None, e)
+                return
+            logger.info(f"Evidência {resultado['arquivo']}: {resultado['bytes_original']} -> {resultado['bytes_final']} bytes.")
+            ao_concluir(resultado, None)
+        return self._obter_executor().submit(tarefa)
+
+    def aguardar(self):
+        """Espera as tarefas pendentes (CLI/testes) e recria o executor no próximo envio."""
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True)
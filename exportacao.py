@@ -0,0 +1,107 @@
+import csv
+import io
+import logging
+import os
+import tempfile
+from datetime import date, datetime
+from decimal import Decimal
+
+logger = logging.getLogger(__name__)
+
+LINHAS_POR_BLOCO = 500          # linhas acumuladas antes de cada envio do CSV
+TAMANHO_BLOCO_ARQUIVO = 64 * 1024
+MIMETYPES = {
+    'csv': 'text/csv; charset=utf-8',
+    'xlsx': 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet',
+}
+# Texto que começa com estes caracteres vira fórmula no Excel/LibreOffice (injeção de fórmula)
+INICIO_FORMULA = ('=', '+', '-', '@', '\t', '\r')
+
+
+def neutralizar_formula(texto):
+    """Prefixa com ' o texto que a planilha interpretaria como fórmula."""
+    if texto.startswith(INICIO_FORMULA):
+        return "'" + texto
+    return texto
+
+
+def _valor_csv(valor):
+    if valor is None:
+        return ''
+    if isinstance(valor, bool):
+        return 'Sim' if valor else 'Não'
+    if isinstance(valor, datetime):
+        return valor.strftime('%d/%m/%Y %H:%M:%S')
+    if isinstance(valor, date):
+        return valor.strftime('%d/%m/%Y')
+    if isinstance(valor, Decimal):
+        return f'{valor:.2f}'.replace('.', ',')
+    if isinstance(valor, (int, float)):
+        return str(valor)
+    return neutralizar_formula(str(valor))
+
+
+def gerar_csv(cabecalho, linhas):
+    """Gera o CSV (';', BOM para o Excel) em blocos de LINHAS_POR_BLOCO linhas, sem montar o arquivo em memória."""
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=';')
+    buffer.write('\ufeff')
+    escritor.writerow([neutralizar_formula(str(c)) for c in cabecalho])
+    pendentes = 0
+    for linha in linhas:
+        escritor.writerow([_valor_csv(v) for v in linha])
+        pendentes += 1
+        if pendentes >= LINHAS_POR_BLOCO:
+            yield buffer.getvalue().encode('utf-8')
+            buffer.seek(0)
+            buffer.truncate(0)
+            pendentes = 0
+    if buffer.tell():
+        yield buffer.getvalue().encode('utf-8')
+
+
+def _valor_xlsx(valor):
+    if isinstance(valor, datetime) and valor.tzinfo is not None:
+        return valor.replace(tzinfo=None)  # o Excel não guarda fuso
+    if isinstance(valor, Decimal):
+        return float(valor)
+    if isinstance(valor, str):
+        return neutralizar_formula(valor)  # no openpyxl, texto com '=' seria gravado como fórmula
+    return valor
+
+
+def gerar_xlsx(cabecalho, linhas, titulo='Dados'):
+    """Gera o XLSX com o writer write-only do openpyxl (memória constante) e envia o arquivo em blocos.
+
+    O formato é um zip, então o conteúdo só pode ser enviado depois de escrito; as linhas vão
+    para um arquivo temporário e não ficam na memória.
+    """
+    from openpyxl import Workbook
+
+    planilha = Workbook(write_only=True)
+    aba = planilha.create_sheet(title=titulo[:31])
+    aba.append([_valor_xlsx(c) for c in cabecalho])
+    for linha in linhas:
+        aba.append([_valor_xlsx(v) for v in linha])
+
+    descritor, caminho = tempfile.mkstemp(suffix='.xlsx')
+    os.close(descritor)
+    try:
+        planilha.save(caminho)
+        with open(caminho, 'rb') as f:
+            while True:
+                bloco = f.read(TAMANHO_BLOCO_ARQUIVO)
+                if not bloco:
+                    break
+                yield bloco
+    finally:
+        try:
+            os.remove(caminho)
+        except OSError as e:
+            logger.warning(f"Não foi possível remover o XLSX temporário {caminho}: {e}")
+
+
+def gerar_exportacao(formato, cabecalho, linhas, titulo='Dados'):
+    if formato == 'xlsx':
+        return gerar_xlsx(cabecalho, linhas, titulo)
+    return gerar_csv(cabecalho, linhas)
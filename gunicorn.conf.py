@@ -0,0 +1,130 @@
+"""Configuração do gunicorn em produção (`gunicorn -c gunicorn.conf.py app:app`).
+
+As rotas passam a maior parte do tempo em I/O (JSONs, banco, PDFs), então cada worker usa
+threads (gthread): uma exportação lenta ocupa uma thread e não o processo inteiro. Tudo pode
+ser ajustado por variáveis de ambiente; os valores de linha de comando têm prioridade.
+"""
+import logging
+import os
+import sys
+import tempfile
+import time
+
+logger = logging.getLogger('gunicorn.error')
+
+
+def _cpus():
+    try:
+        return len(os.sched_getaffinity(0))  # respeita o limite de CPU do container
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# --- Workers e threads ---
+bind = os.environ.get('GUNICORN_BIND') or f"0.0.0.0:{os.environ.get('PORT', '8000')}"
+worker_class = os.environ.get('GUNICORN_WORKER_CLASS', 'gthread')
+# Poucos processos (cada um guarda o índice de busca e os caches) e várias threads por processo
+workers = int(os.environ.get('WEB_CONCURRENCY') or min(_cpus() + 1, int(os.environ.get('GUNICORN_WORKERS_MAX', '4'))))
+threads = int(os.environ.get('GUNICORN_THREADS', '8'))
+# O app é importado uma vez no master e os workers herdam a memória (boot mais rápido, menos RAM)
+preload_app = os.environ.get('GUNICORN_PRELOAD', '1') != '0'
+
+# --- Tempos ---
+# No gthread o heartbeat vem do laço principal do worker, não da thread da requisição: o timeout
+# só derruba worker travado. O tempo de relatório é o prazo para terminar o que está em andamento
+# quando o worker é reciclado ou o deploy troca os processos.
+timeout = int(os.environ.get('GUNICORN_TIMEOUT', '30'))
+TIMEOUT_RELATORIO = int(os.environ.get('GUNICORN_TIMEOUT_RELATORIO', '180'))
+graceful_timeout = TIMEOUT_RELATORIO
+keepalive = int(os.environ.get('GUNICORN_KEEPALIVE', '5'))
+ROTAS_RELATORIO = ('/gerar_relatorio', '/exportar')
+
+# --- Reciclagem contra crescimento de memória ---
+max_requests = int(os.environ.get('GUNICORN_MAX_REQUESTS', '1000'))
+max_requests_jitter = int(os.environ.get('GUNICORN_MAX_REQUESTS_JITTER', '100'))  # workers não reciclam juntos
+
+accesslog = os.environ.get('GUNICORN_ACCESSLOG') or None
+loglevel = os.environ.get('GUNICORN_LOGLEVEL', 'info')
+
+# O /metrics agrega os arquivos de cada processo (ver metricas.py). Definido sempre: o número de
+# workers pode vir de -w ou GUNICORN_CMD_ARGS, que este arquivo não enxerga. Precisa estar no
+# ambiente antes de o app (e o metricas) ser importado.
+os.environ.setdefault('METRICAS_MULTIPROC_DIR', os.path.join(tempfile.gettempdir(), 'osm_metricas'))
+
+
+# --- Hooks ---
+def on_starting(server):
+    """Descarta os arquivos de métricas de uma execução anterior (pids que não existem mais)."""
+    diretorio = os.environ.get('METRICAS_MULTIPROC_DIR')
+    if not diretorio or not os.path.isdir(diretorio):
+        return
+    for nome in os.listdir(diretorio):
+        if nome.startswith('metricas_') and nome.endswith('.json'):
+            try:
+                os.remove(os.path.join(diretorio, nome))
+            except OSError as e:
+                logger.warning(f"Não foi possível remover {nome}: {e}")
+
+
+def when_ready(server):
+    logger.info(f"gunicorn pronto: {workers} worker(s) {worker_class} x {threads} thread(s), "
+                f"preload={preload_app}, max_requests={max_requests}±{max_requests_jitter}")
+    modulo = sys.modules.get('app')
+    if modulo is not None:
+        modulo.aquecer_cache_os()  # com preload: os workers herdam os caches prontos
+
+
+def post_worker_init(worker):
+    if not worker.cfg.preload_app:
+        import app
+        app.aquecer_cache_os()
+
+
+def post_fork(server, worker):
+    """Com preload, o worker herda o pool do master: as conexões herdadas não podem ser usadas no filho."""
+    modulo = sys.modules.get('app')
+    if modulo is None:
+        return  # sem preload o app é importado no próprio worker
+    with modulo.app.app_context():
+        modulo.db.engine.dispose(close=False)
+
+
+def pre_request(worker, req):
+    req.inicio_osm = time.monotonic()
+
+
+def post_request(worker, req, environ, resp):
+    inicio = getattr(req, 'inicio_osm', None)
+    if inicio is None:
+        return
+    duracao = time.monotonic() - inicio
+    limite = TIMEOUT_RELATORIO if req.path.startswith(ROTAS_RELATORIO) else timeout
+    if duracao > limite:
+        logger.warning(f"Requisição lenta: {req.method} {req.path} levou {duracao:.1f}s (limite {limite}s)")
+
+
+def worker_abort(worker):
+    """SIGABRT do master (timeout): registra o motivo antes do worker_exit."""
+    worker.motivo_saida_osm = 'timeout'
+    logger.error(f"Worker {worker.pid} abortado por timeout ({timeout}s)")
+
+
+def worker_exit(server, worker):
+    try:
+        from metricas import registro, workers_encerrados_total
+    except ImportError:
+        return
+    motivo = getattr(worker, 'motivo_saida_osm', None)
+    if motivo is None:
+        motivo = 'max_requests' if worker.nr >= worker.max_requests else 'encerramento'
+    workers_encerrados_total.inc(motivo=motivo)
+    registro.gravar(forcar=True)
+
+
+def child_exit(server, worker):
+    """No master: os contadores do worker encerrado vão para o arquivo dos encerrados; os medidores saem."""
+    try:
+        from metricas import registro
+    except ImportError:
+        return
+    registro.marcar_processo_encerrado(worker.pid)
@@ -0,0 +1,188 @@
+import cProfile
+import logging
+import math
+import os
+import random
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from functools import wraps
+
+from flask import g, has_request_context, jsonify, request, session
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+JANELA_ESTATISTICAS = int(os.environ.get('INSTRUMENTACAO_JANELA', '500'))
+PROFILE_HABILITADO = os.environ.get('PROFILE_HABILITADO', '0') == '1'
+PROFILE_AMOSTRAGEM = float(os.environ.get('PROFILE_AMOSTRAGEM', '1.0'))
+PROFILE_DIR = os.environ.get('PROFILE_DIR', os.path.join(os.path.dirname(__file__), 'profiles'))
+CABECALHO_PROFILE = 'X-Profile'
+
+# Janela móvel de durações (ms) por rota e por segmento (loaders, JSON, PDF...)
+_duracoes_rotas = defaultdict(lambda: deque(maxlen=JANELA_ESTATISTICAS))
+_consultas_rotas = defaultdict(lambda: deque(maxlen=JANELA_ESTATISTICAS))
+_duracoes_segmentos = defaultdict(lambda: deque(maxlen=JANELA_ESTATISTICAS))
+_lock_estatisticas = threading.Lock()
+
+# Callbacks externos (ex.: métricas) notificados a cada segmento e a cada requisição
+_ouvintes_segmento = []
+_ouvintes_requisicao = []
+
+
+def adicionar_ouvinte_segmento(funcao):
+    """Registra `funcao(nome, duracao_ms)` chamada ao fim de cada segmento medido."""
+    _ouvintes_segmento.append(funcao)
+
+
+def adicionar_ouvinte_requisicao(funcao):
+    """Registra `funcao(rota, metodo, status, duracao_ms, segmentos)` chamada ao fim de cada requisição."""
+    _ouvintes_requisicao.append(funcao)
+
+
+def _registrar_segmento(nome, duracao_ms):
+    """Acumula a duração de um segmento na requisição atual e na janela global."""
+    with _lock_estatisticas:
+        _duracoes_segmentos[nome].append(duracao_ms)
+    if has_request_context():
+        segmentos = g.setdefault('segmentos_instrumentacao', {})
+        total, quantidade = segmentos.get(nome, (0.0, 0))
+        segmentos[nome] = (total + duracao_ms, quantidade + 1)
+    for ouvinte in _ouvintes_segmento:
+        ouvinte(nome, duracao_ms)
+
+
+@contextmanager
+def medir(nome):
+    """Mede um bloco de código e registra o tempo sob `nome`."""
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        _registrar_segmento(nome, (time.perf_counter() - inicio) * 1000)
+
+
+def cronometrar(nome=None):
+    """Decorador que mede cada chamada da função (loaders `carregar_*`, geradores de PDF)."""
+    def decorador(func):
+        nome_segmento = nome or func.__name__
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            with medir(nome_segmento):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorador
+
+
+# --- Hooks do SQLAlchemy: contagem e tempo das consultas por requisição ---
+@event.listens_for(Engine, 'before_cursor_execute')
+def _antes_consulta(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault('inicio_consultas', []).append(time.perf_counter())
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def _depois_consulta(conn, cursor, statement, parameters, context, executemany):
+    inicios = conn.info.get('inicio_consultas')
+    if not inicios:
+        return
+    duracao_ms = (time.perf_counter() - inicios.pop()) * 1000
+    if has_request_context():
+        g.sql_total_ms = g.get('sql_total_ms', 0.0) + duracao_ms
+        g.sql_consultas = g.get('sql_consultas', 0) + 1
+
+
+def percentil(valores, p):
+    """Percentil pelo método nearest-rank sobre uma lista já ordenada."""
+    if not valores:
+        return 0.0
+    indice = max(0, min(len(valores) - 1, math.ceil(p / 100.0 * len(valores)) - 1))
+    return valores[indice]
+
+
+def _resumir(duracoes):
+    ordenadas = sorted(duracoes)
+    return {
+        'n': len(ordenadas),
+        'p50_ms': round(percentil(ordenadas, 50), 2),
+        'p95_ms': round(percentil(ordenadas, 95), 2),
+        'max_ms': round(ordenadas[-1], 2) if ordenadas else 0.0,
+    }
+
+
+def resumo_estatisticas():
+    """Retorna p50/p95 por rota e por segmento da janela móvel em memória."""
+    with _lock_estatisticas:
+        rotas = {rota: list(d) for rota, d in _duracoes_rotas.items()}
+        consultas = {rota: list(d) for rota, d in _consultas_rotas.items()}
+        segmentos = {nome: list(d) for nome, d in _duracoes_segmentos.items()}
+
+    resumo_rotas = {}
+    for rota, duracoes in rotas.items():
+        resumo = _resumir(duracoes)
+        lista_consultas = consultas.get(rota) or [0]
+        resumo['sql_consultas_media'] = round(sum(lista_consultas) / len(lista_consultas), 1)
+        resumo_rotas[rota] = resumo
+    return {
+        'pid': os.getpid(),
+        'janela': JANELA_ESTATISTICAS,
+        'rotas': dict(sorted(resumo_rotas.items(), key=lambda item: item[1]['p95_ms'], reverse=True)),
+        'segmentos': {nome: _resumir(d) for nome, d in sorted(segmentos.items())},
+    }
+
+
+def _cabecalho_server_timing(duracao_total_ms):
+    partes = [f'app;dur={duracao_total_ms:.1f}']
+    if g.get('sql_consultas'):
+        partes.append(f'sql;dur={g.sql_total_ms:.1f};desc="{g.sql_consultas} consultas"')
+    for nome, (total, quantidade) in g.get('segmentos_instrumentacao', {}).items():
+        partes.append(f'{nome};dur={total:.1f};desc="{quantidade}x"')
+    return ', '.join(partes)
+
+
+def instrumentar_app(app):
+    """Registra o cronômetro por requisição, o modo cProfile e a rota de estatísticas."""
+
+    @app.before_request
+    def _iniciar_cronometro():
+        g.inicio_requisicao = time.perf_counter()
+        if PROFILE_HABILITADO and request.headers.get(CABECALHO_PROFILE) and random.random() < PROFILE_AMOSTRAGEM:
+            g.profiler = cProfile.Profile()
+            g.profiler.enable()
+
+    @app.after_request
+    def _finalizar_cronometro(response):
+        inicio = g.pop('inicio_requisicao', None)
+        if inicio is None:
+            return response
+        duracao_ms = (time.perf_counter() - inicio) * 1000
+        rota = request.endpoint or 'desconhecida'
+
+        profiler = g.pop('profiler', None)
+        if profiler is not None:
+            profiler.disable()
+            os.makedirs(PROFILE_DIR, exist_ok=True)
+            caminho_profile = os.path.join(PROFILE_DIR, f"{rota}_{time.strftime('%Y%m%d%H%M%S')}_{os.getpid()}.prof")
+            profiler.dump_stats(caminho_profile)
+            logger.info(f"Profile de {request.path} salvo em {caminho_profile}")
+
+        with _lock_estatisticas:
+            _duracoes_rotas[rota].append(duracao_ms)
+            _consultas_rotas[rota].append(g.get('sql_consultas', 0))
+        response.headers['Server-Timing'] = _cabecalho_server_timing(duracao_ms)
+        segmentos = g.get('segmentos_instrumentacao', {})
+        for ouvinte in _ouvintes_requisicao:
+            try:
+                ouvinte(rota, request.method, response.status_code, duracao_ms, segmentos)
+            except Exception as e:
+                logger.error(f"Erro em ouvinte de requisição {ouvinte.__name__}: {e}")
+        return response
+
+    @app.route('/admin/desempenho')
+    def admin_desempenho():
+        if not session.get('is_admin'):
+            return jsonify({'erro': 'Acesso negado'}), 403
+        return jsonify(resumo_estatisticas())
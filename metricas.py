@@ -0,0 +1,344 @@
+import atexit
+import copy
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+
+from flask import Response, request, session
+
+from instrumentacao import adicionar_ouvinte_requisicao, adicionar_ouvinte_segmento
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+# Com vários workers do gunicorn, cada processo grava seus valores em METRICAS_MULTIPROC_DIR
+# e o /metrics agrega todos os arquivos do diretório.
+METRICAS_MULTIPROC_DIR = os.environ.get('METRICAS_MULTIPROC_DIR') or os.environ.get('PROMETHEUS_MULTIPROC_DIR')
+METRICAS_INTERVALO_GRAVACAO = float(os.environ.get('METRICAS_INTERVALO_GRAVACAO', '2'))
+METRICAS_TOKEN = os.environ.get('METRICAS_TOKEN')
+PREFIXO = 'osm_'
+ARQUIVO_ENCERRADOS = 'metricas_encerrados.json'  # soma dos workers que já saíram
+
+FAIXAS_LATENCIA = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+FAIXAS_PDF = (0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+FAIXAS_QUANTIDADE = (0, 1, 2, 5, 10, 25, 50, 100, 250, 500)
+
+
+class _Metrica:
+    tipo = None
+
+    def __init__(self, registro, nome, ajuda, rotulos=()):
+        self.registro = registro
+        self.nome = PREFIXO + nome
+        self.ajuda = ajuda
+        self.rotulos = tuple(rotulos)
+        self.valores = {}
+
+    def _chave(self, rotulos):
+        return tuple(str(rotulos.get(r, '')) for r in self.rotulos)
+
+
+class Contador(_Metrica):
+    tipo = 'counter'
+
+    def inc(self, valor=1, **rotulos):
+        chave = self._chave(rotulos)
+        with self.registro.lock:
+            self.valores[chave] = self.valores.get(chave, 0) + valor
+
+
+class Medidor(_Metrica):
+    """Gauge. `agregacao` define como combinar os workers: 'soma', 'max' ou 'ultimo' (valor mais recente)."""
+    tipo = 'gauge'
+
+    def __init__(self, registro, nome, ajuda, rotulos=(), agregacao='ultimo'):
+        super().__init__(registro, nome, ajuda, rotulos)
+        self.agregacao = agregacao
+
+    def set(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self.registro.lock:
+            self.valores[chave] = valor
+
+
+class Histograma(_Metrica):
+    tipo = 'histogram'
+
+    def __init__(self, registro, nome, ajuda, rotulos=(), faixas=FAIXAS_LATENCIA):
+        super().__init__(registro, nome, ajuda, rotulos)
+        self.faixas = tuple(faixas)
+
+    def observe(self, valor, **rotulos):
+        chave = self._chave(rotulos)
+        with self.registro.lock:
+            atual = self.valores.get(chave)
+            if atual is None:
+                atual = self.valores[chave] = {'faixas': [0] * len(self.faixas), 'soma': 0.0, 'quantidade': 0}
+            for i, limite in enumerate(self.faixas):
+                if valor <= limite:
+                    atual['faixas'][i] += 1
+                    break
+            atual['soma'] += valor
+            atual['quantidade'] += 1
+
+
+class RegistroMetricas:
+    """Registro de métricas em memória, sem dependências, com agregação multiprocesso por diretório."""
+
+    def __init__(self, diretorio_multiproc=None):
+        self.lock = threading.Lock()
+        self.metricas = {}
+        self.coletores = []
+        self.diretorio_multiproc = diretorio_multiproc
+        self._ultima_gravacao = 0.0
+
+    def _registrar(self, metrica):
+        self.metricas[metrica.nome] = metrica
+        return metrica
+
+    def contador(self, nome, ajuda, rotulos=()):
+        return self._registrar(Contador(self, nome, ajuda, rotulos))
+
+    def medidor(self, nome, ajuda, rotulos=(), agregacao='ultimo'):
+        return self._registrar(Medidor(self, nome, ajuda, rotulos, agregacao))
+
+    def histograma(self, nome, ajuda, rotulos=(), faixas=FAIXAS_LATENCIA):
+        return self._registrar(Histograma(self, nome, ajuda, rotulos, faixas))
+
+    def adicionar_coletor(self, funcao):
+        """Funções que atualizam medidores (ex.: pool do banco) logo antes de cada processo gravar seus valores."""
+        self.coletores.append(funcao)
+
+    def _coletar(self):
+        for coletor in self.coletores:
+            try:
+                coletor()
+            except Exception as e:
+                logger.error(f"Erro no coletor de métricas {coletor.__name__}: {e}")
+
+    # --- Persistência multiprocesso ---
+    def _arquivo_processo(self, pid=None):
+        return os.path.join(self.diretorio_multiproc, f"metricas_{pid or os.getpid()}.json")
+
+    def _estado(self):
+        with self.lock:
+            return {
+                nome: {'valores': [[list(chave), valor] for chave, valor in m.valores.items()]}
+                for nome, m in self.metricas.items() if m.valores
+            }
+
+    def gravar(self, forcar=False, vivo=True):
+        """Grava o snapshot deste processo no diretório compartilhado (no máximo a cada intervalo)."""
+        if not self.diretorio_multiproc:
+            return
+        agora = time.time()
+        if not forcar and agora - self._ultima_gravacao < METRICAS_INTERVALO_GRAVACAO:
+            return
+        self._ultima_gravacao = agora
+        self._coletar()  # cada worker grava a própria amostra (o /metrics soma as de todos)
+        conteudo = {'pid': os.getpid(), 'vivo': vivo, 'atualizado_em': agora, 'metricas': self._estado()}
+        caminho = self._arquivo_processo()
+        caminho_tmp = f"{caminho}.tmp"
+        try:
+            os.makedirs(self.diretorio_multiproc, exist_ok=True)
+            with open(caminho_tmp, 'w', encoding='utf-8') as f:
+                json.dump(conteudo, f)
+            os.replace(caminho_tmp, caminho)
+        except OSError as e:
+            logger.error(f"Erro ao gravar métricas em {caminho}: {e}")
+
+    def marcar_processo_encerrado(self, pid):
+        """Incorpora um worker encerrado ao arquivo dos encerrados e apaga o arquivo dele.
+
+        Contadores e histogramas continuam somando no /metrics; medidores são descartados. Assim os
+        workers reciclados por max_requests não deixam um arquivo cada no diretório.
+        """
+        if not self.diretorio_multiproc:
+            return
+        caminho = self._arquivo_processo(pid)
+        caminho_encerrados = os.path.join(self.diretorio_multiproc, ARQUIVO_ENCERRADOS)
+        try:
+            with open(caminho, 'r', encoding='utf-8') as f:
+                conteudo = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning(f"Não foi possível ler as métricas do pid {pid} encerrado: {e}")
+            return
+        try:
+            with open(caminho_encerrados, 'r', encoding='utf-8') as f:
+                encerrados = json.load(f)
+        except FileNotFoundError:
+            encerrados = {'pid': None, 'vivo': False, 'atualizado_em': 0, 'metricas': {}}
+        except (OSError, ValueError) as e:
+            logger.warning(f"Arquivo de métricas dos workers encerrados ilegível, recomeçando: {e}")
+            encerrados = {'pid': None, 'vivo': False, 'atualizado_em': 0, 'metricas': {}}
+
+        for nome, dados in conteudo.get('metricas', {}).items():
+            metrica = self.metricas.get(nome)
+            if metrica is None or metrica.tipo == 'gauge':
+                continue
+            valores = {tuple(chave): valor for chave, valor in encerrados['metricas'].get(nome, {}).get('valores', [])}
+            for chave, valor in dados['valores']:
+                chave = tuple(chave)
+                atual = valores.get(chave)
+                valores[chave] = valor if atual is None else _somar(metrica, atual, valor)
+            encerrados['metricas'][nome] = {'valores': [[list(chave), valor] for chave, valor in valores.items()]}
+
+        caminho_tmp = f"{caminho_encerrados}.tmp"
+        try:
+            with open(caminho_tmp, 'w', encoding='utf-8') as f:
+                json.dump(encerrados, f)
+            os.replace(caminho_tmp, caminho_encerrados)
+            os.remove(caminho)
+        except OSError as e:
+            logger.error(f"Erro ao incorporar as métricas do pid {pid} encerrado: {e}")
+
+    def _carregar_processos(self):
+        if not self.diretorio_multiproc:
+            self._coletar()
+            return [{'pid': os.getpid(), 'vivo': True, 'atualizado_em': time.time(), 'metricas': self._estado()}]
+        self.gravar(forcar=True)
+        processos = []
+        for nome_arquivo in os.listdir(self.diretorio_multiproc):
+            if not (nome_arquivo.startswith('metricas_') and nome_arquivo.endswith('.json')):
+                continue
+            try:
+                with open(os.path.join(self.diretorio_multiproc, nome_arquivo), 'r', encoding='utf-8') as f:
+                    processos.append(json.load(f))
+            except (OSError, ValueError) as e:
+                logger.warning(f"Arquivo de métricas ilegível {nome_arquivo}: {e}")
+        return processos
+
+    # --- Exportação ---
+    def _agregar(self):
+        agregado = {}
+        for processo in sorted(self._carregar_processos(), key=lambda p: p.get('atualizado_em', 0)):
+            for nome, dados in processo.get('metricas', {}).items():
+                metrica = self.metricas.get(nome)
+                if metrica is None:
+                    continue
+                if metrica.tipo == 'gauge' and not processo.get('vivo', True):
+                    continue
+                valores = agregado.setdefault(nome, {})
+                for chave, valor in dados['valores']:
+                    chave = tuple(chave)
+                    atual = valores.get(chave)
+                    if atual is None:
+                        valores[chave] = copy.deepcopy(valor)
+                    elif metrica.tipo in ('counter', 'histogram'):
+                        valores[chave] = _somar(metrica, atual, valor)
+                    elif metrica.agregacao == 'soma':
+                        valores[chave] = atual + valor
+                    elif metrica.agregacao == 'max':
+                        valores[chave] = max(atual, valor)
+                    else:
+                        valores[chave] = valor
+        return agregado
+
+    def exportar_texto(self):
+        """Gera o formato de exposição texto (Prometheus 0.0.4)."""
+        linhas = []
+        agregado = self._agregar()
+        for nome, metrica in sorted(self.metricas.items()):
+            linhas.append(f"# HELP {nome} {metrica.ajuda}")
+            linhas.append(f"# TYPE {nome} {metrica.tipo}")
+            for chave, valor in sorted(agregado.get(nome, {}).items()):
+                rotulos = list(zip(metrica.rotulos, chave))
+                if metrica.tipo == 'histogram':
+                    acumulado = 0
+                    for limite, quantidade in zip(metrica.faixas, valor['faixas']):
+                        acumulado += quantidade
+                        linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos + [('le', _formatar_numero(limite))])} {acumulado}")
+                    linhas.append(f"{nome}_bucket{_formatar_rotulos(rotulos + [('le', '+Inf')])} {valor['quantidade']}")
+                    linhas.append(f"{nome}_sum{_formatar_rotulos(rotulos)} {_formatar_numero(valor['soma'])}")
+                    linhas.append(f"{nome}_count{_formatar_rotulos(rotulos)} {valor['quantidade']}")
+                else:
+                    linhas.append(f"{nome}{_formatar_rotulos(rotulos)} {_formatar_numero(valor)}")
+        return '\n'.join(linhas) + '\n'
+
+
+def _somar(metrica, atual, valor):
+    """Soma o valor de outro processo a um contador ou histograma (o histograma é alterado no lugar)."""
+    if metrica.tipo == 'histogram':
+        atual['faixas'] = [a + b for a, b in zip(atual['faixas'], valor['faixas'])]
+        atual['soma'] += valor['soma']
+        atual['quantidade'] += valor['quantidade']
+        return atual
+    return atual + valor
+
+
+def _formatar_numero(valor):
+    if isinstance(valor, float) and valor.is_integer():
+        return str(int(valor))
+    return str(valor)
+
+
+def _formatar_rotulos(rotulos):
+    if not rotulos:
+        return ''
+    partes = []
+    for nome, valor in rotulos:
+        valor = str(valor).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+        partes.append(f'{nome}="{valor}"')
+    return '{' + ','.join(partes) + '}'
+
+
+# --- Registro global e métricas da aplicação ---
+registro = RegistroMetricas(METRICAS_MULTIPROC_DIR)
+
+requisicoes_total = registro.contador('requisicoes_total', 'Requisições HTTP por endpoint, método e status.', ('endpoint', 'metodo', 'status'))
+requisicao_duracao = registro.histograma('requisicao_duracao_segundos', 'Latência das requisições por endpoint.', ('endpoint',))
+json_lidos_requisicao = registro.histograma('json_arquivos_lidos_por_requisicao', 'Arquivos JSON lidos em cada requisição.', ('endpoint',), FAIXAS_QUANTIDADE)
+segmento_duracao = registro.histograma('segmento_duracao_segundos', 'Duração dos loaders, leituras de JSON e geradores de PDF.', ('segmento',))
+pdf_duracao = registro.histograma('pdf_geracao_duracao_segundos', 'Duração da geração de relatórios PDF.', ('relatorio',), FAIXAS_PDF)
+os_abertas = registro.medidor('os_abertas', 'OS em aberto por gerente/prestador (última leitura).', ('tipo', 'usuario'))
+os_finalizadas_total = registro.contador('os_finalizadas_total', 'OS finalizadas (use rate() para finalizações por minuto).', ('origem',))
+db_pool_conexoes = registro.medidor('db_pool_conexoes', 'Conexões do pool do banco por estado.', ('estado',), agregacao='soma')
+workers_encerrados_total = registro.contador('workers_encerrados_total', 'Workers do gunicorn encerrados por motivo (max_requests, timeout, encerramento).', ('motivo',))
+
+
+def _observar_requisicao(rota, metodo, status, duracao_ms, segmentos):
+    requisicoes_total.inc(endpoint=rota, metodo=metodo, status=status)
+    requisicao_duracao.observe(duracao_ms / 1000.0, endpoint=rota)
+    json_lidos_requisicao.observe(segmentos.get('json_load', (0.0, 0))[1], endpoint=rota)
+
+
+def _observar_segmento(nome, duracao_ms):
+    segmento_duracao.observe(duracao_ms / 1000.0, segmento=nome)
+    if nome.startswith('pdf_'):
+        pdf_duracao.observe(duracao_ms / 1000.0, relatorio=nome[len('pdf_'):])
+
+
+def registrar_metricas_app(app, db):
+    """Liga as métricas à instrumentação e expõe o endpoint /metrics.
+
+    O /metrics exige o token de METRICAS_TOKEN (Authorization: Bearer) ou uma sessão de admin:
+    os rótulos trazem nomes de usuários.
+    """
+    adicionar_ouvinte_requisicao(_observar_requisicao)
+    adicionar_ouvinte_segmento(_observar_segmento)
+
+    def coletar_pool():
+        with app.app_context():
+            pool = db.engine.pool
+        for estado, metodo in (('em_uso', 'checkedout'), ('ociosas', 'checkedin'), ('overflow', 'overflow'), ('tamanho', 'size')):
+            if hasattr(pool, metodo):
+                db_pool_conexoes.set(getattr(pool, metodo)(), estado=estado)
+    registro.adicionar_coletor(coletar_pool)
+    atexit.register(registro.gravar, forcar=True)
+
+    def gravar_ao_final(_erro=None):
+        registro.gravar()
+    # As funções de teardown rodam em ordem inversa: no início da lista, esta roda depois de o
+    # Flask-SQLAlchemy devolver a conexão da sessão, e a amostra do pool não conta a própria requisição.
+    app.teardown_appcontext_funcs.insert(0, gravar_ao_final)
+
+    @app.route('/metrics')
+    def metrics():
+        token_ok = bool(METRICAS_TOKEN) and hmac.compare_digest(
+            request.headers.get('Authorization', '').encode(), f"Bearer {METRICAS_TOKEN}".encode())
+        if not (token_ok or (session.get('gerente') and session.get('is_admin'))):
+            return Response('Acesso negado\n', status=403, mimetype='text/plain')
+        return Response(registro.exportar_texto(), mimetype='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,106 @@
+import logging
+import os
+import threading
+from dataclasses import dataclass
+from datetime import date, datetime
+
+from instrumentacao import medir
+
+logger = logging.getLogger(__name__)
+
+# Formatos de data vistos nos JSONs do ETL (o %Y exige 4 dígitos, então '12/03/24' cai no %y)
+FORMATOS_DATA = ("%d/%m/%Y", "%d/%m/%y", "%Y-%m-%d", "%d-%m-%Y", "%d-%m-%y", "%Y/%m/%d")
+
+
+def parse_data(texto):
+    """Data de abertura como `date` (None quando vazia ou em formato desconhecido)."""
+    if not texto:
+        return None
+    for fmt in FORMATOS_DATA:
+        try:
+            return datetime.strptime(texto, fmt).date()
+        except (ValueError, TypeError):
+            continue
+    return None
+
+
+def _campo(item, *nomes, padrao=''):
+    for nome in nomes:
+        valor = item.get(nome)
+        if valor not in (None, ''):
+            return str(valor)
+    return padrao
+
+
+@dataclass(frozen=True, slots=True)
+class RegistroOS:
+    """Uma OS aberta já normalizada (os/OS, data/data_entrada/Data...), compartilhada entre requisições.
+
+    É imutável: quem precisa marcar algo (ex.: status de pendência) usa `dataclasses.replace`.
+    """
+    os: str
+    frota: str = ''
+    modelo: str = 'Desconhecido'
+    servico: str = ''
+    prestador: str = ''
+    solicitante: str = ''
+    observacao: str = ''
+    data_entrada: str = ''                 # texto original, como veio do JSON
+    data_abertura: date | None = None
+    dias_abertos: int = 0
+    arquivo: str = ''
+    status: str | None = None
+    status_motivo: str | None = None
+    status_definido_por: str | None = None
+    status_data: str | None = None
+
+
+def registro_de_item(item, arquivo, hoje):
+    data_entrada = _campo(item, 'data_entrada', 'data', 'Data')
+    data_abertura = parse_data(data_entrada)
+    return RegistroOS(
+        os=_campo(item, 'os', 'OS'),
+        frota=_campo(item, 'frota', 'Frota'),
+        modelo=_campo(item, 'modelo', 'Modelo', padrao='Desconhecido'),
+        servico=_campo(item, 'servico', 'Servico', 'observacao', 'Observacao'),
+        prestador=_campo(item, 'prestador', 'Prestador'),
+        solicitante=_campo(item, 'solicitante'),
+        observacao=_campo(item, 'observacao', 'Observacao'),
+        data_entrada=data_entrada,
+        data_abertura=data_abertura,
+        dias_abertos=(hoje - data_abertura).days if data_abertura else 0,
+        arquivo=arquivo,
+    )
+
+
+class CacheRegistrosOS:
+    """Registros de cada JSON de OS, refeitos só quando o arquivo (mtime, tamanho) ou o dia mudam.
+
+    Devolve sempre a mesma tupla enquanto nada muda: as rotas só leem, nunca alteram.
+    """
+
+    def __init__(self, ler_json):
+        self.ler_json = ler_json
+        self._lock = threading.Lock()
+        self._entradas = {}   # caminho -> ((mtime_ns, tamanho, dia), registros)
+
+    def carregar(self, caminho, hoje):
+        """Tupla de RegistroOS do arquivo; propaga OSError/ValueError de leitura para quem chamou."""
+        st = os.stat(caminho)
+        validade = (st.st_mtime_ns, st.st_size, hoje)
+        with self._lock:
+            entrada = self._entradas.get(caminho)
+        if entrada is not None and entrada[0] == validade:
+            return entrada[1]
+        dados = self.ler_json(caminho)
+        arquivo = os.path.basename(caminho)
+        with medir('registros_os'):
+            registros = tuple(registro_de_item(item, arquivo, hoje)
+                              for item in (dados if isinstance(dados, list) else []) if isinstance(item, dict))
+        with self._lock:
+            self._entradas[caminho] = (validade, registros)
+        return registros
+
+    def limpar(self):
+        with self._lock:
+            self._entradas.clear()
@@ -0,0 +1,234 @@
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+
+import codec_json
+from instrumentacao import medir
+
+logger = logging.getLogger(__name__)
+
+# --- Configuração (via variáveis de ambiente) ---
+INTERVALO_VERIFICACAO = float(os.environ.get('SNAPSHOT_OS_INTERVALO', '5'))  # segundos entre checagens de snapshot novo
+# Cópia/checkout no deploy troca o mtime dos JSONs: vale também o JSON de mesmo tamanho que não é
+# mais novo que o próprio snapshot (folga para sistemas de arquivos com mtime grosseiro)
+TOLERANCIA_MTIME_NS = 2 * 10**9
+
+# Layout: MAGICO | tamanho do cabeçalho (uint32 LE) | cabeçalho msgpack | blocos msgpack (um por arquivo)
+MAGICO = b'OSMSNAP\x03'
+VERSAO = 3
+# Pastas de OS (relativas à raiz dos dados) que entram no snapshot
+PASTAS = ('mensagens_por_gerente', 'mensagens_por_prestador', 'static/json')
+
+
+def gerar(caminho_snapshot, raiz, pastas=PASTAS):
+    """Junta os JSONs de OS de `pastas` num único arquivo versionado. Retorna quantos arquivos entraram.
+
+    O cabeçalho traz a tabela de offsets por arquivo (um arquivo por gerente/prestador/manutenção):
+    [início, tamanho do bloco, mtime_ns do JSON, tamanho do JSON, quantidade de OS]. Os JSONs continuam
+    sendo a exportação compatível; o mtime e o tamanho dizem, só com um stat, se o arquivo em disco
+    ainda é o do snapshot.
+    """
+    import msgpack
+
+    tabela, blocos, posicao = {}, [], 0
+    for pasta in pastas:
+        diretorio = os.path.join(raiz, *pasta.split('/'))
+        try:
+            nomes = sorted(os.listdir(diretorio))
+        except OSError:
+            continue
+        for nome in nomes:
+            if not nome.lower().endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(diretorio, nome), 'rb') as f:
+                    st = os.fstat(f.fileno())  # do arquivo aberto: o conteúdo lido é desta versão
+                    conteudo = f.read()
+                dados = codec_json.loads(conteudo)
+            except (OSError, ValueError) as e:
+                logger.warning(f"Snapshot: {pasta}/{nome} ignorado: {e}")
+                continue
+            bloco = msgpack.packb(dados, use_bin_type=True)
+            # Chave com '/' (o ETL roda no Windows e o app no Linux)
+            tabela[f"{pasta}/{nome}"] = [posicao, len(bloco), st.st_mtime_ns, len(conteudo),
+                                        len(dados) if isinstance(dados, list) else 0]
+            blocos.append(bloco)
+            posicao += len(bloco)
+    cabecalho = msgpack.packb({'versao': VERSAO, 'gerado_em': time.time(), 'pastas': list(pastas), 'arquivos': tabela},
+                              use_bin_type=True)
+    os.makedirs(os.path.dirname(os.path.abspath(caminho_snapshot)), exist_ok=True)
+    codec_json.gravar_atomico(caminho_snapshot, b''.join([MAGICO, struct.pack('<I', len(cabecalho)), cabecalho, *blocos]))
+    return len(tabela)
+
+
+def _ler_cabecalho(mapa):
+    """(cabeçalho, início dos blocos) do snapshot mapeado; ValueError se o formato/versão não bate."""
+    import msgpack
+
+    if mapa[:len(MAGICO)] != MAGICO:
+        raise ValueError('formato desconhecido')
+    (tamanho_cabecalho,) = struct.unpack('<I', mapa[len(MAGICO):len(MAGICO) + 4])
+    base = len(MAGICO) + 4 + tamanho_cabecalho
+    cabecalho = msgpack.unpackb(mapa[len(MAGICO) + 4:base], raw=False)
+    if cabecalho.get('versao') != VERSAO:
+        raise ValueError(f"versão {cabecalho.get('versao')}")
+    return cabecalho, base
+
+
+class _Aberto:
+    __slots__ = ('assinatura', 'mapa', 'base', 'entradas', 'pastas', 'gerado_em')
+
+
+class SnapshotOS:
+    """Snapshot consolidado das OS mapeado em memória (mmap).
+
+    A lista de OS de um usuário sai de uma fatia do arquivo, sem abrir o JSON dele. Ao abrir,
+    cada arquivo do snapshot é conferido com o JSON em disco só por stat (mtime + tamanho gravados
+    pelo ETL), sem ler os JSONs. Se o app regravar um JSON (finalização, atribuição...) o mtime muda
+    e aquele arquivo volta a ser lido do disco. Um snapshot novo do ETL é detectado e reaberto sozinho.
+    """
+
+    def __init__(self, caminho, raiz, intervalo=INTERVALO_VERIFICACAO):
+        self.caminho = caminho
+        self.raiz = raiz
+        self.intervalo = intervalo
+        self._lock = threading.Lock()
+        self._aberto = None
+        self._assinatura_vista = None
+        self._verificado_em = 0.0
+
+    def _atual(self):
+        agora = time.monotonic()
+        if agora - self._verificado_em < self.intervalo:
+            return self._aberto
+        with self._lock:
+            if agora - self._verificado_em < self.intervalo:
+                return self._aberto
+            self._verificado_em = agora
+            try:
+                st = os.stat(self.caminho)
+                assinatura = (st.st_mtime_ns, st.st_size)
+            except OSError:
+                assinatura = None
+            if assinatura != self._assinatura_vista:
+                self._assinatura_vista = assinatura
+                # O mapa antigo é liberado quando ninguém mais o usa (as fatias são cópias)
+                self._aberto = self._abrir(assinatura) if assinatura else None
+            return self._aberto
+
+    def _abrir(self, assinatura):
+        try:
+            import msgpack
+        except ImportError:
+            logger.info("msgpack não instalado; snapshot de OS ignorado.")
+            return None
+        try:
+            with open(self.caminho, 'rb') as f:
+                mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            cabecalho, base = _ler_cabecalho(mapa)
+        except (OSError, ValueError, struct.error, msgpack.UnpackException) as e:
+            logger.warning(f"Snapshot de OS ilegível ({self.caminho}): {e}")
+            return None
+
+        with medir('snapshot_os_abrir'):
+            entradas, nomes_por_pasta = {}, {}
+            limite_mtime = assinatura[0] + TOLERANCIA_MTIME_NS
+            for relativo, (inicio, tamanho, mtime_json, tamanho_json, _quantidade) in cabecalho['arquivos'].items():
+                pasta, _, nome = relativo.rpartition('/')
+                caminho = os.path.join(self.raiz, *relativo.split('/'))
+                nomes_por_pasta.setdefault(pasta, []).append(nome)
+                try:
+                    st = os.stat(caminho)
+                except OSError:
+                    continue
+                if st.st_size == tamanho_json and (st.st_mtime_ns == mtime_json or st.st_mtime_ns <= limite_mtime):
+                    entradas[caminho] = (base + inicio, base + inicio + tamanho, (st.st_mtime_ns, st.st_size))
+
+            # Listagem das pastas pelo snapshot só enquanto o diretório tem exatamente os mesmos arquivos
+            pastas = {}
+            for pasta in cabecalho.get('pastas', PASTAS):
+                diretorio = os.path.join(self.raiz, *pasta.split('/'))
+                nomes = tuple(sorted(nomes_por_pasta.get(pasta, ())))
+                try:
+                    mtime_ns = os.stat(diretorio).st_mtime_ns  # antes do listdir: arquivo novo no meio muda o mtime
+                    if tuple(sorted(n for n in os.listdir(diretorio) if n.lower().endswith('.json'))) == nomes:
+                        pastas[os.path.normpath(diretorio)] = [nomes, mtime_ns]
+                except OSError:
+                    continue
+
+        aberto = _Aberto()
+        aberto.assinatura, aberto.mapa, aberto.base = assinatura, mapa, base
+        aberto.entradas, aberto.pastas, aberto.gerado_em = entradas, pastas, cabecalho.get('gerado_em')
+        logger.info(f"Snapshot de OS aberto: {len(entradas)}/{len(cabecalho['arquivos'])} arquivo(s) conferem com o disco.")
+        return aberto
+
+    def abrir(self):
+        """Força a checagem do snapshot agora (boot/CLI). Retorna quantos arquivos estão válidos."""
+        self._verificado_em = 0.0
+        aberto = self._atual()
+        return len(aberto.entradas) if aberto else 0
+
+    def dados(self, caminho):
+        """Lista de OS do arquivo tirada do snapshot, ou None se o snapshot não vale para ele."""
+        aberto = self._atual()
+        if aberto is None:
+            return None
+        entrada = aberto.entradas.get(caminho)
+        if entrada is None:
+            return None
+        inicio, fim, assinatura = entrada
+        try:
+            st = os.stat(caminho)
+        except OSError:
+            return None
+        if (st.st_mtime_ns, st.st_size) != assinatura:
+            return None
+        import msgpack
+        with medir('snapshot_os'):
+            return msgpack.unpackb(aberto.mapa[inicio:fim], raw=False, strict_map_key=False)
+
+    def listar(self, diretorio):
+        """Nomes dos JSONs do diretório pela tabela do snapshot, ou None (use os.listdir)."""
+        aberto = self._atual()
+        if aberto is None:
+            return None
+        pasta = aberto.pastas.get(os.path.normpath(diretorio))
+        if pasta is None:
+            return None
+        nomes, mtime_ns = pasta
+        try:
+            st = os.stat(diretorio)
+        except OSError:
+            return None
+        if st.st_mtime_ns == mtime_ns:
+            return list(nomes)
+        # O diretório mudou (ex.: o app regravou um JSON): confere de novo a lista de arquivos
+        atuais = tuple(sorted(n for n in os.listdir(diretorio) if n.lower().endswith('.json')))
+        if atuais == nomes:
+            pasta[1] = st.st_mtime_ns
+        return list(atuais)
+
+    def arquivos_validos(self):
+        """Caminhos dos arquivos que ainda podem ser lidos do snapshot."""
+        aberto = self._atual()
+        return list(aberto.entradas) if aberto else []
+
+    def exportar_json(self, destino):
+        """Exportação compatível: recria a estrutura de JSONs por usuário em `destino`. Retorna quantos arquivos."""
+        import msgpack
+
+        with open(self.caminho, 'rb') as f:
+            mapa = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            cabecalho, base = _ler_cabecalho(mapa)
+            for relativo, (inicio, tamanho, *_resto) in cabecalho['arquivos'].items():
+                caminho = os.path.join(destino, *relativo.split('/'))
+                os.makedirs(os.path.dirname(caminho), exist_ok=True)
+                codec_json.salvar(caminho, msgpack.unpackb(mapa[base + inicio:base + inicio + tamanho], raw=False,
+                                                          strict_map_key=False))
+        finally:
+            mapa.close()
+        return len(cabecalho['arquivos'])